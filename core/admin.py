@@ -13,7 +13,8 @@ from products.admin import (
 )
 from inventory.admin import (
     SupplierAdmin, WarehouseAdmin, StorageLocationAdmin,
-    RawMaterialAdmin, StockAdmin, StockMovementAdmin
+    RawMaterialAdmin, StockAdmin, StockMovementAdmin, ReorderCandidateAdmin,
+    StockSnapshotAdmin
 )
 from orders.admin import (
     OrderAdmin, OrderItemAdmin, PaymentAdmin, MaterialRequirementAdmin
@@ -40,7 +41,7 @@ from products.models import (
 )
 from inventory.models import (
     Supplier, Warehouse, StorageLocation,
-    RawMaterial, Stock, StockMovement
+    RawMaterial, Stock, StockMovement, ReorderCandidate, StockSnapshot
 )
 from orders.models import (
     Order, OrderItem, Payment, MaterialRequirement
@@ -184,6 +185,8 @@ admin_site.register(StorageLocation, StorageLocationAdmin)
 admin_site.register(RawMaterial, RawMaterialAdmin)
 admin_site.register(Stock, StockAdmin)
 admin_site.register(StockMovement, StockMovementAdmin)
+admin_site.register(ReorderCandidate, ReorderCandidateAdmin)
+admin_site.register(StockSnapshot, StockSnapshotAdmin)
 
 # Register Orders app models
 admin_site.register(Order, OrderAdmin)
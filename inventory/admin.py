@@ -2,8 +2,13 @@ from django.contrib import admin
 from django.utils.html import format_html
 from .models import (
     Supplier, Warehouse, StorageLocation,
-    RawMaterial, Stock, StockMovement
+    RawMaterial, Stock, StockMovement, ReorderCandidate, StockSnapshot,
+    ReplenishmentPlan, CostLayer, WarehouseUtilizationSnapshot,
+    ExpiryBucket, MovementDailyRollup, MaterialClassification, SlottingProposal,
+    CycleCount, CycleCountLine, TransferDocument, TransferDocumentLine, ScanCode,
+    SyncTombstone, MaterialReservation
 )
+from .services import delete_stock_record, save_stock_edit
 
 @admin.register(Supplier)
 class SupplierAdmin(admin.ModelAdmin):
@@ -21,7 +26,8 @@ class WarehouseAdmin(admin.ModelAdmin):
     list_display = ['name', 'code', 'location', 'capacity', 'utilization', 'manager', 'active']
     list_filter = ['active']
     search_fields = ['name', 'code', 'location']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['current_volume', 'created_at', 'updated_at']
+    list_select_related = ['manager']
     inlines = [StorageLocationInline]
 
     def utilization(self, obj):
@@ -39,9 +45,11 @@ class WarehouseAdmin(admin.ModelAdmin):
 
 @admin.register(StorageLocation)
 class StorageLocationAdmin(admin.ModelAdmin):
-    list_display = ['name', 'warehouse', 'location_type', 'capacity', 'utilization', 'temperature_controlled', 'active']
+    list_display = ['name', 'warehouse', 'location_type', 'barcode', 'capacity', 'utilization', 'accessibility_rank', 'temperature_controlled', 'active']
     list_filter = ['warehouse', 'location_type', 'temperature_controlled', 'active']
-    search_fields = ['name', 'warehouse__name']
+    search_fields = ['name', 'barcode', 'warehouse__name']
+    readonly_fields = ['current_volume', 'last_counted_at']
+    list_select_related = ['warehouse']
 
     def utilization(self, obj):
         util = (obj.current_volume / obj.capacity * 100) if obj.capacity else 0
@@ -66,17 +74,17 @@ class RawMaterialAdmin(admin.ModelAdmin):
     list_display = ['name', 'code', 'unit', 'current_stock', 'stock_status', 'unit_price', 'active']
     list_filter = ['active', 'unit']
     search_fields = ['name', 'code', 'description']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['on_hand', 'inventory_value', 'created_at', 'updated_at']
     inlines = [StockInline]
     fieldsets = (
         (None, {
             'fields': ('name', 'code', 'description', 'unit', 'active')
         }),
         ('Stock Management', {
-            'fields': ('minimum_stock', 'maximum_stock', 'reorder_point', 'lead_time')
+            'fields': ('on_hand', 'minimum_stock', 'maximum_stock', 'reorder_point', 'lead_time')
         }),
         ('Pricing & Storage', {
-            'fields': ('unit_price', 'volume_per_unit')
+            'fields': ('unit_price', 'valuation_method', 'inventory_value', 'volume_per_unit')
         }),
         ('Notes & Tracking', {
             'fields': ('notes', 'created_at', 'updated_at'),
@@ -114,16 +122,38 @@ class StockAdmin(admin.ModelAdmin):
     search_fields = ['material__name', 'batch_number']
     readonly_fields = ['created_at', 'updated_at']
 
+    def get_readonly_fields(self, request, obj=None):
+        # Moving stock between batches or locations is a transfer
+        if obj is not None:
+            return ['material', 'location', 'batch_number', *self.readonly_fields]
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        # Quantity edits are posted as adjustments so value and ledger follow
+        saved = save_stock_edit(obj, performed_by=request.user)
+        if saved is not None:
+            obj.pk = saved.pk
+
+    def delete_model(self, request, obj):
+        delete_stock_record(obj, performed_by=request.user)
+
+    def delete_queryset(self, request, queryset):
+        for stock in queryset:
+            delete_stock_record(stock, performed_by=request.user)
+
 @admin.register(StockMovement)
 class StockMovementAdmin(admin.ModelAdmin):
     list_display = ['reference_number', 'movement_type', 'material', 'quantity', 'source_location', 'destination_location', 'created_at']
     list_filter = ['movement_type', 'material', 'source_location', 'destination_location']
     search_fields = ['reference_number', 'batch_number', 'material__name']
-    readonly_fields = ['created_at']
+    readonly_fields = ['value', 'created_at']
     fieldsets = (
         (None, {
             'fields': ('movement_type', 'material', 'quantity', 'batch_number', 'reference_number')
         }),
+        ('Valuation', {
+            'fields': ('unit_cost', 'value')
+        }),
         ('Locations', {
             'fields': ('source_location', 'destination_location')
         }),
@@ -131,3 +161,115 @@ class StockMovementAdmin(admin.ModelAdmin):
             'fields': ('performed_by', 'notes', 'created_at')
         })
     )
+
+@admin.register(ReorderCandidate)
+class ReorderCandidateAdmin(admin.ModelAdmin):
+    list_display = ['material', 'severity', 'on_hand', 'reorder_point', 'minimum_stock', 'suggested_quantity', 'flagged_at']
+    list_filter = ['severity']
+    search_fields = ['material__name', 'material__code']
+    readonly_fields = ['flagged_at', 'updated_at']
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['snapshot_date', 'material', 'location', 'batch_number', 'quantity']
+    list_filter = ['snapshot_date']
+    search_fields = ['material__name', 'batch_number']
+    readonly_fields = ['created_at']
+
+@admin.register(ReplenishmentPlan)
+class ReplenishmentPlanAdmin(admin.ModelAdmin):
+    list_display = ['material', 'on_hand', 'avg_daily_demand', 'safety_stock', 'reorder_point', 'reorder_quantity', 'stockout_date', 'computed_at']
+    search_fields = ['material__name', 'material__code']
+    readonly_fields = ['computed_at']
+
+@admin.register(CostLayer)
+class CostLayerAdmin(admin.ModelAdmin):
+    list_display = ['material', 'reference_number', 'unit_cost', 'quantity', 'remaining', 'received_at']
+    search_fields = ['material__name', 'reference_number']
+
+@admin.register(WarehouseUtilizationSnapshot)
+class WarehouseUtilizationSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['warehouse', 'location_type', 'recorded_at', 'location_count', 'capacity', 'used_volume']
+    list_filter = ['warehouse', 'location_type']
+    date_hierarchy = 'recorded_at'
+
+@admin.register(ExpiryBucket)
+class ExpiryBucketAdmin(admin.ModelAdmin):
+    list_display = ['expiry_date', 'warehouse', 'batch_count', 'quantity', 'computed_on']
+    list_filter = ['warehouse']
+
+@admin.register(MovementDailyRollup)
+class MovementDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'material', 'location', 'movement_type', 'count', 'quantity']
+    list_filter = ['movement_type']
+    search_fields = ['material__name', 'material__code']
+    date_hierarchy = 'date'
+
+@admin.register(MaterialClassification)
+class MaterialClassificationAdmin(admin.ModelAdmin):
+    list_display = ['material', 'abc_class', 'xyz_class', 'issued_quantity', 'consumption_value', 'pick_count', 'demand_cv', 'computed_at']
+    list_filter = ['abc_class', 'xyz_class']
+    search_fields = ['material__name', 'material__code']
+    list_select_related = ['material']
+
+@admin.register(SlottingProposal)
+class SlottingProposalAdmin(admin.ModelAdmin):
+    list_display = ['material', 'stock', 'from_location', 'to_location', 'quantity', 'computed_at']
+    search_fields = ['material__name', 'material__code']
+    list_select_related = ['material', 'from_location', 'to_location']
+
+class CycleCountLineInline(admin.TabularInline):
+    model = CycleCountLine
+    extra = 0
+    raw_id_fields = ['material', 'location', 'adjustment']
+    readonly_fields = ['counted_at', 'counted_by', 'system_quantity', 'variance']
+
+@admin.register(CycleCount)
+class CycleCountAdmin(admin.ModelAdmin):
+    list_display = ['warehouse', 'scheduled_for', 'status', 'reconciled_at', 'reconciled_by']
+    list_filter = ['status', 'warehouse']
+    date_hierarchy = 'scheduled_for'
+    readonly_fields = ['created_at', 'reconciled_at', 'reconciled_by']
+    inlines = [CycleCountLineInline]
+
+class TransferDocumentLineInline(admin.TabularInline):
+    model = TransferDocumentLine
+    extra = 0
+    raw_id_fields = ['material', 'source_location', 'destination_location', 'movement']
+
+@admin.register(TransferDocument)
+class TransferDocumentAdmin(admin.ModelAdmin):
+    list_display = ['document_number', 'source_warehouse', 'destination_warehouse', 'performed_by', 'posted_at']
+    list_filter = ['source_warehouse', 'destination_warehouse']
+    search_fields = ['document_number', 'notes']
+    readonly_fields = ['posted_at']
+    list_select_related = ['source_warehouse', 'destination_warehouse', 'performed_by']
+    inlines = [TransferDocumentLineInline]
+
+@admin.register(ScanCode)
+class ScanCodeAdmin(admin.ModelAdmin):
+    list_display = ['code', 'kind', 'material', 'stock', 'movement', 'location']
+    list_filter = ['kind']
+    search_fields = ['code']
+    raw_id_fields = ['material', 'stock', 'movement', 'location']
+
+@admin.register(SyncTombstone)
+class SyncTombstoneAdmin(admin.ModelAdmin):
+    list_display = ['model', 'object_id', 'deleted_at']
+    list_filter = ['model']
+    date_hierarchy = 'deleted_at'
+
+@admin.register(MaterialReservation)
+class MaterialReservationAdmin(admin.ModelAdmin):
+    list_display = ['material', 'quantity', 'consumed_quantity', 'status', 'production_order', 'order_item', 'stock', 'created_at']
+    list_filter = ['status']
+    search_fields = ['material__name', 'material__code']
+    list_select_related = ['material', 'stock']
+    raw_id_fields = ['material', 'stock', 'production_order', 'order_item', 'created_by']
+
+    def has_add_permission(self, request):
+        # Reservations move the maintained reserved totals; make them through the service
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,55 @@
+import time
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import ChangeCounter
+
+# Counter covering stock quantities and the names shown next to them
+STOCK = 'stock'
+
+
+def current_version(name=STOCK):
+    """The counter's current value; 0 before anything has changed"""
+    return ChangeCounter.objects.filter(name=name).values_list('value', flat=True).first() or 0
+
+
+def cache_generation(name=STOCK):
+    """
+    Cache-side companion of the counter, for keys of cached reads.
+
+    Lives only in the cache, so reading it costs no query. A fresh
+    generation starts from the clock, never reusing an evicted one's keys.
+    """
+    key = f'change-generation:{name}'
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key, 0)
+    return generation
+
+
+def bump_version(name=STOCK):
+    """Increment the counter in its own short statement"""
+    try:
+        cache.incr(f'change-generation:{name}')
+    except ValueError:
+        pass  # No generation cached; the next reader starts a fresh one
+    if ChangeCounter.objects.filter(name=name).update(value=F('value') + 1, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            ChangeCounter.objects.create(name=name, value=1)
+    except IntegrityError:
+        ChangeCounter.objects.filter(name=name).update(value=F('value') + 1, updated_at=timezone.now())
+
+
+def bump_version_on_commit(name=STOCK):
+    """
+    Bump the counter once the current transaction commits.
+
+    Deferring the UPDATE keeps the counter row out of the posting
+    transaction, so concurrent postings never queue on it, and readers never
+    see a new version before the data behind it is visible.
+    """
+    transaction.on_commit(lambda: bump_version(name))
@@ -0,0 +1,209 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import MaterialClassification, MovementDailyRollup, RawMaterial, SlottingProposal, Stock, StorageLocation
+
+# Days of movement history the classes are based on
+CLASSIFICATION_WINDOW = 365
+# Cumulative consumption value share closing the A and B classes
+ABC_LIMITS = (0.80, 0.95)
+# Coefficient of variation of weekly demand closing the X and Y classes
+XYZ_LIMITS = (0.5, 1.0)
+
+
+def movement_profile(material_ids, start, end):
+    """
+    Weekly issued quantity and issue count per material over [start, end].
+
+    Reads the daily movement rollup with one grouped query, so a year of
+    movements costs at most one row per material per day. Returns the
+    materials x weeks demand matrix and the pick counts per material.
+    """
+    rows = (
+        MovementDailyRollup.objects.filter(movement_type='issue', date__gte=start, date__lte=end)
+        .values_list('material_id', 'date')
+        .annotate(total=Sum('quantity'), picks=Sum('count'))
+        .order_by()
+    )
+    weeks = (end - start).days // 7 + 1
+    frame = pd.DataFrame.from_records(list(rows), columns=['material_id', 'date', 'total', 'picks'])
+    if frame.empty:
+        return (
+            pd.DataFrame(0.0, index=pd.Index(material_ids, name='material_id'), columns=range(weeks)),
+            pd.Series(0, index=material_ids, dtype=int)
+        )
+    frame['week'] = (pd.to_datetime(frame['date']) - pd.Timestamp(start)).dt.days // 7
+    demand = (
+        frame.pivot_table(index='material_id', columns='week', values='total', aggfunc='sum')
+        .reindex(index=material_ids, columns=range(weeks), fill_value=0)
+        .fillna(0)
+        .astype(float)
+    )
+    picks = frame.groupby('material_id')['picks'].sum().reindex(material_ids, fill_value=0).astype(int)
+    return demand, picks
+
+
+def compute_classification(window_days=CLASSIFICATION_WINDOW, today=None):
+    """
+    ABC and XYZ class of every active material.
+
+    ABC ranks materials by consumption value (issued quantity x unit price)
+    and cuts the cumulative share at ABC_LIMITS; XYZ cuts the coefficient of
+    variation of weekly demand at XYZ_LIMITS, materials without demand being
+    Z. Returns a DataFrame indexed by material id.
+    """
+    if today is None:
+        today = timezone.localdate()
+    start = today - datetime.timedelta(days=window_days - 1)
+
+    materials = pd.DataFrame.from_records(
+        list(RawMaterial.objects.filter(active=True).values_list('pk', 'unit_price')),
+        columns=['material_id', 'unit_price'],
+        index='material_id'
+    )
+    if materials.empty:
+        return materials
+
+    demand, picks = movement_profile(materials.index, start, today)
+    weekly = demand.to_numpy()
+    issued = weekly.sum(axis=1)
+    value = issued * materials['unit_price'].to_numpy(dtype=float)
+
+    order = np.argsort(-value, kind='stable')
+    total = value.sum() or 1.0
+    share = np.empty_like(value)
+    share[order] = np.cumsum(value[order]) / total
+    # The material crossing a limit still belongs to the class it completes
+    previous = share - value / total
+    abc = np.where(
+        (value > 0) & (previous < ABC_LIMITS[0]), 'A',
+        np.where((value > 0) & (previous < ABC_LIMITS[1]), 'B', 'C')
+    )
+
+    mean = weekly.mean(axis=1)
+    std = weekly.std(axis=1, ddof=1) if weekly.shape[1] > 1 else np.zeros_like(mean)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = np.where(mean > 0, std / mean, np.nan)
+    xyz = np.where(cv <= XYZ_LIMITS[0], 'X', np.where(cv <= XYZ_LIMITS[1], 'Y', 'Z'))
+
+    return pd.DataFrame({
+        'abc_class': abc,
+        'xyz_class': xyz,
+        'issued_quantity': issued.astype(int),
+        'consumption_value': value,
+        'value_share': share,
+        'pick_count': picks.to_numpy(),
+        'demand_cv': cv,
+    }, index=materials.index)
+
+
+def propose_slotting(frame):
+    """
+    Moves that bring the batches of A materials into the most accessible
+    locations of their warehouse.
+
+    Locations are ranked by accessibility_rank; unranked locations count as
+    the least accessible. A materials are placed busiest first, each batch
+    going to the best-ranked location that beats its current one, matches
+    its temperature control and has room for it. Returns unsaved proposals.
+    """
+    a_items = frame[frame['abc_class'] == 'A'].sort_values('pick_count', ascending=False)
+    if a_items.empty:
+        return []
+    priority = {int(material_id): position for position, material_id in enumerate(a_items.index)}
+
+    locations = list(
+        StorageLocation.objects.filter(active=True, accessibility_rank__isnull=False)
+        .order_by('warehouse_id', 'accessibility_rank', 'pk')
+    )
+    ranked = defaultdict(list)
+    free = {}
+    for location in locations:
+        ranked[location.warehouse_id].append(location)
+        free[location.pk] = location.capacity - location.current_volume
+
+    batches = (
+        Stock.objects.select_related('material', 'location')
+        .filter(material_id__in=list(priority), quantity__gt=0)
+    )
+    batches = sorted(
+        batches,
+        # Worst placed batches first: unranked locations, then the highest rank
+        key=lambda stock: (
+            priority[stock.material_id],
+            stock.location.accessibility_rank is not None,
+            -(stock.location.accessibility_rank or 0),
+            stock.pk
+        )
+    )
+
+    proposals = []
+    for stock in batches:
+        current_rank = stock.location.accessibility_rank
+        volume = stock.material.volume_per_unit * stock.quantity
+        for location in ranked[stock.location.warehouse_id]:
+            if current_rank is not None and location.accessibility_rank >= current_rank:
+                break
+            if location.temperature_controlled != stock.location.temperature_controlled:
+                continue
+            if free[location.pk] < volume:
+                continue
+            free[location.pk] -= volume
+            free[stock.location_id] = free.get(stock.location_id, Decimal(0)) + volume
+            proposals.append(SlottingProposal(
+                material_id=stock.material_id,
+                stock=stock,
+                from_location=stock.location,
+                to_location=location,
+                quantity=stock.quantity
+            ))
+            break
+    return proposals
+
+
+def refresh_classification(window_days=CLASSIFICATION_WINDOW, today=None):
+    """
+    Recompute and store every material's classes and the slotting proposals.
+
+    Returns ``(classified materials, proposals)``.
+    """
+    frame = compute_classification(window_days=window_days, today=today)
+    now = timezone.now()
+    classifications = [
+        MaterialClassification(
+            material_id=int(material_id),
+            abc_class=row.abc_class,
+            xyz_class=row.xyz_class,
+            issued_quantity=int(row.issued_quantity),
+            consumption_value=Decimal(f'{row.consumption_value:.2f}'),
+            value_share=round(float(row.value_share), 4),
+            pick_count=int(row.pick_count),
+            demand_cv=None if np.isnan(row.demand_cv) else round(float(row.demand_cv), 4),
+            window_days=window_days,
+            computed_at=now
+        )
+        for material_id, row in zip(frame.index, frame.itertuples(index=False))
+    ]
+    proposals = propose_slotting(frame) if not frame.empty else []
+    for proposal in proposals:
+        proposal.computed_at = now
+    with transaction.atomic():
+        MaterialClassification.objects.filter(material__active=False).delete()
+        MaterialClassification.objects.bulk_create(
+            classifications,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['material'],
+            update_fields=[
+                'abc_class', 'xyz_class', 'issued_quantity', 'consumption_value', 'value_share',
+                'pick_count', 'demand_cv', 'window_days', 'computed_at'
+            ]
+        )
+        SlottingProposal.objects.all().delete()
+        SlottingProposal.objects.bulk_create(proposals, batch_size=1000)
+    return len(classifications), len(proposals)
@@ -0,0 +1,226 @@
+import datetime
+from collections import defaultdict
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import CycleCount, CycleCountLine, Stock, StockMovement, StorageLocation
+from .services import movement_legs, post_movements_bulk
+
+# Days between counts of a batch, by the material's ABC class; unclassified
+# materials are counted like C items
+COUNT_INTERVALS = {'A': 30, 'B': 90, 'C': 180}
+# Batches put on one warehouse's daily count list
+DAILY_COUNT_LIMIT = 200
+
+
+def due_for_count(now=None):
+    """
+    Stock batches whose last count is older than their class interval. A
+    batch never counted itself, such as one received again after being
+    counted empty, dates from its location's last count.
+    """
+    now = now or timezone.now()
+    due = Q(last_count__isnull=True)
+    for abc_class, days in COUNT_INTERVALS.items():
+        in_class = Q(material__classification__abc_class=abc_class)
+        if abc_class == 'C':
+            in_class |= Q(material__classification__isnull=True)
+        due |= in_class & Q(last_count__lt=now - datetime.timedelta(days=days))
+    return Stock.objects.annotate(
+        last_count=Coalesce('last_counted_at', 'location__last_counted_at')
+    ).filter(due, quantity__gt=0)
+
+
+def schedule_cycle_count(warehouse_id, day=None, limit=DAILY_COUNT_LIMIT):
+    """
+    Create the count list of a warehouse for ``day``, or return the existing one.
+
+    Picks the most overdue batches (never counted first, then by last count,
+    A items before B and C), leaving out batches already on an open list.
+    Batches without a count of their own go by their location's last count.
+    """
+    day = day or timezone.localdate()
+    with transaction.atomic():
+        count, created = CycleCount.objects.get_or_create(warehouse_id=warehouse_id, scheduled_for=day)
+        if not created:
+            return count
+        on_open_list = CycleCountLine.objects.filter(
+            count__status='open',
+            material_id=OuterRef('material_id'),
+            location_id=OuterRef('location_id'),
+            batch_number=OuterRef('batch_number')
+        )
+        batches = (
+            due_for_count()
+            .filter(location__warehouse_id=warehouse_id, location__active=True)
+            .exclude(Exists(on_open_list))
+            .annotate(class_rank=Case(
+                When(material__classification__abc_class='A', then=Value(0)),
+                When(material__classification__abc_class='B', then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField()
+            ))
+            .order_by(F('last_count').asc(nulls_first=True), 'class_rank', 'pk')
+            .values_list('material_id', 'location_id', 'batch_number', 'quantity')[:limit]
+        )
+        CycleCountLine.objects.bulk_create([
+            CycleCountLine(
+                count=count,
+                material_id=material_id,
+                location_id=location_id,
+                batch_number=batch_number,
+                expected_quantity=quantity
+            )
+            for material_id, location_id, batch_number, quantity in batches
+        ], batch_size=1000)
+    return count
+
+
+def record_counts(count, entries, counted_by=None):
+    """
+    Store scanned ``{'line': id, 'counted_quantity': n}`` entries on an open
+    count. A line counted again keeps the latest quantity. Returns the
+    number of lines updated.
+    """
+    if count.status != 'open':
+        raise ValidationError(f"Cycle count {count.pk} is already {count.status}")
+    quantities = {entry['line']: entry['counted_quantity'] for entry in entries}
+    lines = count.lines.in_bulk(list(quantities))
+    unknown = sorted(set(quantities) - set(lines))
+    if unknown:
+        raise ValidationError(f"Lines {unknown} are not on cycle count {count.pk}")
+    now = timezone.now()
+    for line_id, line in lines.items():
+        line.counted_quantity = quantities[line_id]
+        line.counted_at = now
+        line.counted_by = counted_by
+    CycleCountLine.objects.bulk_update(
+        list(lines.values()), ['counted_quantity', 'counted_at', 'counted_by'], batch_size=1000
+    )
+    return len(lines)
+
+
+def _moved_since_count(lines):
+    """Net stock change per (material, location, batch) posted after each line was counted"""
+    counted_at = {
+        (line.material_id, line.location_id, line.batch_number): line.counted_at
+        for line in lines if line.counted_at
+    }
+    if not counted_at:
+        return {}
+    location_ids = {location_id for _, location_id, _ in counted_at}
+    movements = StockMovement.objects.filter(
+        Q(source_location_id__in=location_ids) | Q(destination_location_id__in=location_ids),
+        created_at__gt=min(counted_at.values()),
+        material_id__in={material_id for material_id, _, _ in counted_at},
+        batch_number__in={batch_number for _, _, batch_number in counted_at}
+    ).only(
+        'material_id', 'movement_type', 'quantity', 'batch_number', 'created_at',
+        'source_location_id', 'destination_location_id'
+    )
+    moved = defaultdict(int)
+    for movement in movements.iterator():
+        for location_id, delta in movement_legs(movement, strict=False):
+            key = (movement.material_id, location_id, movement.batch_number)
+            if key in counted_at and movement.created_at > counted_at[key]:
+                moved[key] += delta
+    return moved
+
+
+def reconcile_cycle_count(count_id, performed_by=None):
+    """
+    Compare the counted lines with system quantities and post the variances.
+
+    In one transaction the counted locations and batches are locked and read
+    with a single query, and every variance is posted as an adjustment
+    movement through the bulk posting path. A line's variance is measured
+    against the system quantity when it was counted: movements posted since
+    are taken back out of the current quantity, so they are not reversed.
+    Uncounted lines are left alone. Returns a summary of the reconciliation.
+    """
+    with transaction.atomic():
+        count = CycleCount.objects.select_for_update().get(pk=count_id)
+        if count.status != 'open':
+            raise ValidationError(f"Cycle count {count.pk} is already {count.status}")
+        lines = list(count.lines.filter(counted_quantity__isnull=False))
+        keys = {(line.material_id, line.location_id, line.batch_number) for line in lines}
+
+        # Same lock order as posting: locations, then their stock rows
+        list(
+            StorageLocation.objects.select_for_update()
+            .filter(pk__in={location_id for _, location_id, _ in keys}).order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        system = {
+            (material_id, location_id, batch_number): (pk, quantity)
+            for pk, material_id, location_id, batch_number, quantity in Stock.objects.select_for_update()
+            .filter(
+                material_id__in={material_id for material_id, _, _ in keys},
+                location_id__in={location_id for _, location_id, _ in keys},
+                batch_number__in={batch_number for _, _, batch_number in keys}
+            )
+            .order_by('location_id', 'pk')
+            .values_list('pk', 'material_id', 'location_id', 'batch_number', 'quantity')
+        }
+
+        since_count = _moved_since_count(lines)
+
+        adjustments = []
+        adjusted_lines = []
+        for line in lines:
+            key = (line.material_id, line.location_id, line.batch_number)
+            _, quantity = system.get(key, (None, 0))
+            quantity -= since_count.get(key, 0)
+            line.system_quantity = quantity
+            line.variance = line.counted_quantity - quantity
+            if not line.variance:
+                continue
+            location = 'destination_location' if line.variance > 0 else 'source_location'
+            adjustments.append({
+                'material': line.material_id,
+                'movement_type': 'adjustment',
+                'quantity': abs(line.variance),
+                'batch_number': line.batch_number,
+                'reference_number': f'CC-{count.pk}-{line.pk}',
+                location: line.location_id,
+                'notes': f'Cycle count {count.pk} variance',
+            })
+            adjusted_lines.append(line)
+
+        if adjustments:
+            committed, results = post_movements_bulk(adjustments, atomic=True, performed_by=performed_by)
+            if not committed:
+                raise ValidationError([
+                    f"Line {adjusted_lines[result['line'] - 1].pk}: {error}"
+                    for result in results if result['status'] == 'error'
+                    for error in result['errors']
+                ])
+            for line, result in zip(adjusted_lines, results):
+                line.adjustment_id = result['id']
+
+        CycleCountLine.objects.bulk_update(
+            lines, ['system_quantity', 'variance', 'adjustment'], batch_size=1000
+        )
+        now = timezone.now()
+        counted = Q(pk__in=[system[key][0] for key in keys if key in system])
+        for material_id, location_id, batch_number in keys - set(system):
+            counted |= Q(material_id=material_id, location_id=location_id, batch_number=batch_number)
+        Stock.objects.filter(counted).update(last_counted_at=now, updated_at=now)
+        # Batches counted empty were deleted by their adjustment; the location keeps the stamp
+        StorageLocation.objects.filter(pk__in={location_id for _, location_id, _ in keys}).update(
+            last_counted_at=now, updated_at=now
+        )
+
+        count.status = 'reconciled'
+        count.reconciled_at = now
+        count.reconciled_by = performed_by
+        count.save(update_fields=['status', 'reconciled_at', 'reconciled_by'])
+
+    return {
+        'count': count.pk,
+        'counted': len(lines),
+        'variances': len(adjusted_lines),
+        'net_adjustment': sum(line.variance for line in adjusted_lines),
+    }
@@ -0,0 +1,89 @@
+import datetime
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from .models import ExpiryBucket, Stock
+
+# Days ahead covered by the nightly buckets and the dashboard counters
+EXPIRY_HORIZON = 90
+EXPIRY_WINDOWS = (7, 30, 90)
+
+
+def expiring_stock(days, warehouse_id=None, today=None):
+    """
+    Stock expiring between today and ``days`` from now.
+
+    The expiry_date range is served by the partial expiry index, which
+    leaves out the batches that never expire.
+    """
+    today = today or timezone.localdate()
+    stocks = Stock.objects.select_related('material', 'location').filter(
+        expiry_date__gte=today,
+        expiry_date__lte=today + datetime.timedelta(days=days)
+    )
+    if warehouse_id is not None:
+        stocks = stocks.filter(location__warehouse_id=warehouse_id)
+    return stocks
+
+
+def refresh_expiry_buckets(today=None):
+    """
+    Rebuild the per-warehouse, per-day expiry buckets for the horizon.
+
+    One grouped query over the expiring range; returns the bucket count.
+    """
+    today = today or timezone.localdate()
+    rows = (
+        Stock.objects.filter(
+            expiry_date__gte=today,
+            expiry_date__lte=today + datetime.timedelta(days=EXPIRY_HORIZON),
+            quantity__gt=0
+        )
+        .values('location__warehouse_id', 'expiry_date')
+        .annotate(batch_count=Count('pk'), total=Sum('quantity'))
+        .order_by()
+    )
+    buckets = [
+        ExpiryBucket(
+            warehouse_id=row['location__warehouse_id'],
+            expiry_date=row['expiry_date'],
+            batch_count=row['batch_count'],
+            quantity=row['total'],
+            computed_on=today
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        ExpiryBucket.objects.all().delete()
+        ExpiryBucket.objects.bulk_create(buckets, batch_size=1000)
+    return len(buckets)
+
+
+def expiry_counters(warehouse_id=None, today=None):
+    """
+    Batches and quantity expiring within each of EXPIRY_WINDOWS days.
+
+    Reads at most one bucket per day of the horizon, however much stock
+    there is.
+    """
+    today = today or timezone.localdate()
+    buckets = ExpiryBucket.objects.filter(expiry_date__gte=today)
+    if warehouse_id is not None:
+        buckets = buckets.filter(warehouse_id=warehouse_id)
+    aggregates = {}
+    for days in EXPIRY_WINDOWS:
+        window = Q(expiry_date__lte=today + datetime.timedelta(days=days))
+        aggregates[f'batches_{days}'] = Sum('batch_count', filter=window)
+        aggregates[f'quantity_{days}'] = Sum('quantity', filter=window)
+    totals = buckets.aggregate(**aggregates)
+    return {
+        'computed_on': ExpiryBucket.objects.values_list('computed_on', flat=True).first(),
+        'windows': [
+            {
+                'days': days,
+                'batch_count': totals[f'batches_{days}'] or 0,
+                'quantity': totals[f'quantity_{days}'] or 0,
+            }
+            for days in EXPIRY_WINDOWS
+        ],
+    }
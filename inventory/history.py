@@ -0,0 +1,155 @@
+import datetime
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Stock, StockMovement, StockSnapshot, StorageLocation
+from .services import movement_legs
+
+# Longest stretch of ledger replayed to rebuild a past balance
+MAX_REPLAY = datetime.timedelta(days=31)
+
+
+def day_end(day):
+    """The exclusive cutoff for 'as of the end of ``day``'"""
+    return timezone.make_aware(
+        datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min)
+    )
+
+
+def parse_as_of(value):
+    """
+    Parse an ``as_of`` query value into an exclusive cutoff datetime.
+
+    A plain date means the end of that day; a datetime is used as given.
+    """
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        return day_end(day)
+    if moment is None:
+        raise ValueError(f"Invalid as_of value {value!r}, expected YYYY-MM-DD or an ISO datetime")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _apply_movements(balances, start, end, material_ids=None, location_ids=None, sign=1):
+    """Add (or with sign=-1, undo) the movements created in [start, end)"""
+    movements = StockMovement.objects.filter(created_at__lt=end)
+    if start is not None:
+        movements = movements.filter(created_at__gte=start)
+    if material_ids is not None:
+        movements = movements.filter(material_id__in=material_ids)
+    movements = movements.only(
+        'material_id', 'movement_type', 'quantity', 'batch_number',
+        'source_location_id', 'destination_location_id'
+    )
+    for movement in movements.iterator():
+        for location_id, delta in movement_legs(movement, strict=False):
+            if location_ids is None or location_id in location_ids:
+                balances[(movement.material_id, location_id, movement.batch_number)] += sign * delta
+
+
+def stock_as_of(moment, material_ids=None, location_ids=None):
+    """
+    Rebuild stock held at ``moment`` from the movement ledger.
+
+    Starts from whichever is nearest to ``moment`` of the last nightly
+    snapshot before it, the first one after it and the current stock
+    table, and replays or undoes the movements in between. Raises
+    ValueError rather than replay more than MAX_REPLAY of movements.
+    Returns a dict of (material_id, location_id, batch_number) -> quantity.
+    """
+    if location_ids is not None:
+        location_ids = set(location_ids)
+    balances = defaultdict(int)
+
+    day = timezone.localdate(moment)
+    snapshots = StockSnapshot.objects.values_list('snapshot_date', flat=True)
+    earlier = snapshots.filter(snapshot_date__lt=day).order_by('-snapshot_date').first()
+    later = snapshots.filter(snapshot_date__gte=day).order_by('snapshot_date').first()
+    anchors = [(max(timezone.now() - moment, datetime.timedelta(0)), None)]
+    if earlier is not None:
+        anchors.append((moment - day_end(earlier), earlier))
+    if later is not None:
+        anchors.append((day_end(later) - moment, later))
+    window, snapshot_date = min(anchors, key=lambda anchor: anchor[0])
+    if window > MAX_REPLAY:
+        raise ValueError(
+            f"No stock snapshot within {MAX_REPLAY.days} days of {moment:%Y-%m-%d}; "
+            f"stock that far back cannot be rebuilt"
+        )
+
+    if snapshot_date is not None:
+        rows = StockSnapshot.objects.filter(snapshot_date=snapshot_date)
+        if material_ids is not None:
+            rows = rows.filter(material_id__in=material_ids)
+        if location_ids is not None:
+            rows = rows.filter(location_id__in=location_ids)
+        for material_id, location_id, batch_number, quantity in rows.values_list(
+            'material_id', 'location_id', 'batch_number', 'quantity'
+        ):
+            balances[(material_id, location_id, batch_number)] = quantity
+        if snapshot_date < day:
+            _apply_movements(balances, day_end(snapshot_date), moment, material_ids, location_ids)
+        else:
+            _apply_movements(balances, moment, day_end(snapshot_date), material_ids, location_ids, sign=-1)
+    else:
+        rows = Stock.objects.all()
+        if material_ids is not None:
+            rows = rows.filter(material_id__in=material_ids)
+        if location_ids is not None:
+            rows = rows.filter(location_id__in=location_ids)
+        for material_id, location_id, batch_number, quantity in rows.values_list(
+            'material_id', 'location_id', 'batch_number', 'quantity'
+        ):
+            balances[(material_id, location_id, batch_number)] = quantity
+        _apply_movements(balances, moment, timezone.now(), material_ids, location_ids, sign=-1)
+
+    return {key: quantity for key, quantity in balances.items() if quantity}
+
+
+def material_totals_as_of(moment, material_ids=None, location_ids=None):
+    """Per-material totals at ``moment``"""
+    totals = defaultdict(int)
+    for (material_id, _, _), quantity in stock_as_of(moment, material_ids, location_ids).items():
+        totals[material_id] += quantity
+    return dict(totals)
+
+
+def warehouse_location_ids(warehouse_id):
+    return set(
+        StorageLocation.objects.filter(warehouse_id=warehouse_id).values_list('pk', flat=True)
+    )
+
+
+def take_stock_snapshot(day=None):
+    """
+    Store the end-of-day stock for ``day`` (default: yesterday).
+
+    Safe to re-run: the day's rows are replaced. Returns the number of rows.
+    """
+    if day is None:
+        day = timezone.localdate() - datetime.timedelta(days=1)
+    with transaction.atomic():
+        StockSnapshot.objects.filter(snapshot_date=day).delete()
+        balances = stock_as_of(day_end(day))
+        StockSnapshot.objects.bulk_create(
+            [
+                StockSnapshot(
+                    snapshot_date=day,
+                    material_id=material_id,
+                    location_id=location_id,
+                    batch_number=batch_number,
+                    quantity=quantity
+                )
+                for (material_id, location_id, batch_number), quantity in balances.items()
+                if quantity > 0
+            ],
+            batch_size=1000
+        )
+    return len(balances)
@@ -0,0 +1,25 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from inventory.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily stock movement rollup from the movement ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Only rebuild days from this date on (YYYY-MM-DD); default is the whole ledger'
+        )
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since:
+            try:
+                since = datetime.date.fromisoformat(since)
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+
+        rows = rebuild_rollups(since)
+        scope = f"since {since}" if since else "for the whole ledger"
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} rollup row(s) {scope}"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from inventory.scanning import rebuild_scan_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the scan code index from materials, stock, movements and location barcodes"
+
+    def handle(self, *args, **options):
+        rows = rebuild_scan_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {rows} scan code(s)"))
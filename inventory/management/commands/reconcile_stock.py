@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from inventory.models import RawMaterial, Stock
+
+
+def stock_total_subquery():
+    """Sum of stock quantities for the outer material"""
+    return Coalesce(
+        Subquery(
+            Stock.objects.filter(material=OuterRef('pk'))
+            .values('material')
+            .annotate(total=Sum('quantity'))
+            .values('total')
+        ),
+        Value(0)
+    )
+
+
+class Command(BaseCommand):
+    help = "Find and repair drift between RawMaterial.on_hand and the sum of its stock records"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted materials without repairing them'
+        )
+
+    def handle(self, *args, **options):
+        drifted = list(
+            RawMaterial.objects.annotate(actual=stock_total_subquery())
+            .exclude(on_hand=F('actual'))
+            .values_list('pk', 'code', 'on_hand', 'actual')
+        )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("No on-hand drift found"))
+            return
+
+        for pk, code, on_hand, actual in drifted:
+            self.stdout.write(f"{code}: recorded {on_hand}, stock records total {actual}")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{len(drifted)} material(s) drifted (dry run, nothing changed)"))
+            return
+
+        # Recompute inside the UPDATE so movements posted since the scan
+        # above are not overwritten with a stale total.
+        with transaction.atomic():
+            repaired = RawMaterial.objects.filter(
+                pk__in=[row[0] for row in drifted]
+            ).update(on_hand=stock_total_subquery())
+
+        self.stdout.write(self.style.SUCCESS(f"Repaired on-hand totals for {repaired} material(s)"))
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:53
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_on_hand(apps, schema_editor):
+    RawMaterial = apps.get_model('inventory', 'RawMaterial')
+    Stock = apps.get_model('inventory', 'Stock')
+    totals = (
+        Stock.objects.filter(material=OuterRef('pk'))
+        .values('material')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    RawMaterial.objects.update(on_hand=Coalesce(Subquery(totals), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawmaterial',
+            name='on_hand',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Total quantity across all stock records, maintained on every stock write'),
+        ),
+        migrations.RunPython(populate_on_hand, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_rawmaterial_on_hand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReorderCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('on_hand', models.PositiveIntegerField()),
+                ('reorder_point', models.PositiveIntegerField()),
+                ('minimum_stock', models.PositiveIntegerField()),
+                ('suggested_quantity', models.PositiveIntegerField(help_text='Quantity needed to refill to maximum stock')),
+                ('severity', models.CharField(choices=[('reorder', 'Reorder'), ('critical', 'Below Minimum')], db_index=True, max_length=20)),
+                ('flagged_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reorder_candidate', to='inventory.rawmaterial')),
+            ],
+            options={
+                'ordering': ['on_hand'],
+            },
+        ),
+    ]
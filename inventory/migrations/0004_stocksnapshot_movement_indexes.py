@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_reordercandidate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField(db_index=True)),
+                ('batch_number', models.CharField(max_length=50)),
+                ('quantity', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-snapshot_date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['created_at'], name='inventory_s_created_05ebf5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['material', 'created_at'], name='inventory_s_materia_f89ef9_idx'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshot',
+            name='location',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.storagelocation'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshot',
+            name='material',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.rawmaterial'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocksnapshot',
+            unique_together={('snapshot_date', 'material', 'location', 'batch_number')},
+        ),
+    ]
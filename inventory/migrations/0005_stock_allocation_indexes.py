@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_stocksnapshot_movement_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['material', 'expiry_date', 'created_at'], name='inventory_s_materia_70f9a7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['material', 'created_at'], name='inventory_s_materia_5a35da_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_stock_allocation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplenishmentPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_days', models.PositiveIntegerField(help_text='Days of issue history the figures are based on')),
+                ('avg_daily_demand', models.FloatField()),
+                ('demand_std', models.FloatField(help_text='Standard deviation of daily demand')),
+                ('on_hand', models.PositiveIntegerField()),
+                ('safety_stock', models.PositiveIntegerField()),
+                ('reorder_point', models.PositiveIntegerField(help_text='Lead-time demand plus safety stock')),
+                ('reorder_quantity', models.PositiveIntegerField(help_text='Economic order quantity')),
+                ('days_of_stock', models.FloatField(blank=True, null=True)),
+                ('stockout_date', models.DateField(blank=True, db_index=True, null=True)),
+                ('computed_at', models.DateTimeField()),
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='replenishment_plan', to='inventory.rawmaterial')),
+            ],
+            options={
+                'ordering': [models.OrderBy(models.F('stockout_date'), nulls_last=True)],
+            },
+        ),
+    ]
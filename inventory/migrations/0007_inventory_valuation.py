@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F
+
+
+def populate_inventory_value(apps, schema_editor):
+    # Value existing stock at the current list price as the opening balance
+    RawMaterial = apps.get_model('inventory', 'RawMaterial')
+    RawMaterial.objects.update(inventory_value=F('on_hand') * F('unit_price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_replenishmentplan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawmaterial',
+            name='inventory_value',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Cost of the quantity on hand, maintained as movements post', max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='rawmaterial',
+            name='valuation_method',
+            field=models.CharField(choices=[('average', 'Weighted Average'), ('fifo', 'FIFO')], default='average', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=4, help_text='Cost per unit; given for receipts, derived from the valuation for issues', max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='value',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text="Signed change in the material's inventory value", max_digits=14, null=True),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_number', models.CharField(help_text='Movement that created the layer', max_length=50)),
+                ('unit_cost', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('quantity', models.PositiveIntegerField()),
+                ('remaining', models.PositiveIntegerField()),
+                ('received_at', models.DateTimeField()),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='inventory.rawmaterial')),
+            ],
+            options={
+                'ordering': ['received_at', 'pk'],
+                'indexes': [models.Index(fields=['material', 'received_at'], name='inventory_c_materia_fb5909_idx')],
+            },
+        ),
+        migrations.RunPython(populate_inventory_value, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:31
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_volumes(apps, schema_editor):
+    # Exact volumes replace the truncated integers, then warehouses start
+    # from the sum of their locations.
+    Stock = apps.get_model('inventory', 'Stock')
+    StorageLocation = apps.get_model('inventory', 'StorageLocation')
+    Warehouse = apps.get_model('inventory', 'Warehouse')
+    zero = Value(0, output_field=DecimalField(max_digits=12, decimal_places=3))
+    StorageLocation.objects.update(current_volume=Coalesce(Subquery(
+        Stock.objects.filter(location=OuterRef('pk'))
+        .values('location')
+        .annotate(total=Sum(F('quantity') * F('material__volume_per_unit')))
+        .values('total')
+    ), zero))
+    Warehouse.objects.update(current_volume=Coalesce(Subquery(
+        StorageLocation.objects.filter(warehouse=OuterRef('pk'))
+        .values('warehouse')
+        .annotate(total=Sum('current_volume'))
+        .values('total')
+    ), zero))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_changecounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warehouse',
+            name='current_volume',
+            field=models.DecimalField(decimal_places=3, default=0, editable=False, help_text='Volume occupied across all storage locations, maintained as stock moves', max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='storagelocation',
+            name='current_volume',
+            field=models.DecimalField(decimal_places=3, default=0, editable=False, help_text='Current volume occupied in cubic meters, maintained as stock moves', max_digits=12),
+        ),
+        migrations.RunPython(populate_volumes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_maintained_storage_volume'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarehouseUtilizationSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location_type', models.CharField(choices=[('shelf', 'Shelf'), ('rack', 'Rack'), ('bin', 'Bin'), ('floor', 'Floor Space'), ('cold', 'Cold Storage')], max_length=20)),
+                ('recorded_at', models.DateTimeField()),
+                ('location_count', models.PositiveIntegerField()),
+                ('capacity', models.PositiveIntegerField(help_text='Combined capacity of the locations in cubic meters')),
+                ('used_volume', models.DecimalField(decimal_places=3, max_digits=14)),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='utilization_snapshots', to='inventory.warehouse')),
+            ],
+            options={
+                'ordering': ['-recorded_at'],
+                'indexes': [models.Index(fields=['warehouse', 'recorded_at'], name='inventory_w_warehou_8ea3b7_idx')],
+            },
+        ),
+    ]
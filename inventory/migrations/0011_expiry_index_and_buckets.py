@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_warehouseutilizationsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpiryBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expiry_date', models.DateField()),
+                ('batch_count', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('computed_on', models.DateField()),
+            ],
+            options={
+                'ordering': ['expiry_date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(condition=models.Q(('expiry_date__isnull', False)), fields=['expiry_date', 'id'], name='stock_expiry_idx'),
+        ),
+        migrations.AddField(
+            model_name='expirybucket',
+            name='warehouse',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expiry_buckets', to='inventory.warehouse'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='expirybucket',
+            unique_together={('warehouse', 'expiry_date')},
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_expiry_index_and_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovementDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('movement_type', models.CharField(choices=[('receipt', 'Receipt'), ('issue', 'Issue'), ('transfer', 'Transfer'), ('adjustment', 'Adjustment'), ('return', 'Return')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('quantity', models.PositiveBigIntegerField(default=0)),
+                ('location', models.ForeignKey(help_text='Source location, or the destination for movements without one', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movement_rollups', to='inventory.storagelocation')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movement_rollups', to='inventory.rawmaterial')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['material', 'date'], name='inventory_m_materia_69f842_idx')],
+                'unique_together': {('date', 'material', 'location', 'movement_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_movementdailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagelocation',
+            name='accessibility_rank',
+            field=models.PositiveIntegerField(blank=True, help_text='Pick accessibility within the warehouse, 1 being the most accessible (e.g. next to the dock)', null=True),
+        ),
+        migrations.CreateModel(
+            name='SlottingProposal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('computed_at', models.DateTimeField()),
+                ('from_location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.storagelocation')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slotting_proposals', to='inventory.rawmaterial')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slotting_proposals', to='inventory.stock')),
+                ('to_location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.storagelocation')),
+            ],
+            options={
+                'ordering': ['to_location__accessibility_rank', 'pk'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MaterialClassification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('abc_class', models.CharField(choices=[('A', 'A - High value'), ('B', 'B - Medium value'), ('C', 'C - Low value')], db_index=True, max_length=1)),
+                ('xyz_class', models.CharField(choices=[('X', 'X - Steady demand'), ('Y', 'Y - Variable demand'), ('Z', 'Z - Erratic demand')], db_index=True, max_length=1)),
+                ('issued_quantity', models.PositiveBigIntegerField(help_text='Quantity issued over the window')),
+                ('consumption_value', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('value_share', models.FloatField(help_text='Cumulative share of total consumption value, in ABC order')),
+                ('pick_count', models.PositiveIntegerField(help_text='Issue movements over the window')),
+                ('demand_cv', models.FloatField(blank=True, help_text='Coefficient of variation of weekly demand', null=True)),
+                ('window_days', models.PositiveIntegerField()),
+                ('computed_at', models.DateTimeField()),
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='classification', to='inventory.rawmaterial')),
+            ],
+            options={
+                'ordering': ['abc_class', '-consumption_value'],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inventory', '0013_classification_and_slotting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CycleCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scheduled_for', models.DateField()),
+                ('status', models.CharField(choices=[('open', 'Open'), ('reconciled', 'Reconciled')], default='open', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+                ('reconciled_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cycle_counts', to='inventory.warehouse')),
+            ],
+            options={
+                'ordering': ['-scheduled_for', '-pk'],
+                'unique_together': {('warehouse', 'scheduled_for')},
+            },
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='last_counted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='CycleCountLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(max_length=50)),
+                ('expected_quantity', models.PositiveIntegerField(help_text='System quantity when the list was scheduled')),
+                ('counted_quantity', models.PositiveIntegerField(blank=True, null=True)),
+                ('counted_at', models.DateTimeField(blank=True, null=True)),
+                ('system_quantity', models.PositiveIntegerField(blank=True, help_text='System quantity at reconciliation', null=True)),
+                ('variance', models.IntegerField(blank=True, null=True)),
+                ('adjustment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.stockmovement')),
+                ('count', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='inventory.cyclecount')),
+                ('counted_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.storagelocation')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.rawmaterial')),
+            ],
+            options={
+                'ordering': ['location__name', 'pk'],
+                'unique_together': {('count', 'material', 'location', 'batch_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inventory', '0014_cycle_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_number', models.CharField(max_length=40, unique=True)),
+                ('notes', models.TextField(blank=True)),
+                ('posted_at', models.DateTimeField(auto_now_add=True)),
+                ('destination_warehouse', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='inbound_transfers', to='inventory.warehouse')),
+                ('performed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('source_warehouse', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='outbound_transfers', to='inventory.warehouse')),
+            ],
+            options={
+                'ordering': ['-posted_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TransferDocumentLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.PositiveIntegerField()),
+                ('batch_number', models.CharField(max_length=50)),
+                ('quantity', models.PositiveIntegerField()),
+                ('destination_location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='inventory.storagelocation')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='inventory.transferdocument')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='inventory.rawmaterial')),
+                ('movement', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='transfer_line', to='inventory.stockmovement')),
+                ('source_location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='inventory.storagelocation')),
+            ],
+            options={
+                'ordering': ['document', 'line_number'],
+                'unique_together': {('document', 'line_number')},
+            },
+        ),
+    ]
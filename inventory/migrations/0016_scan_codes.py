@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_transfer_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagelocation',
+            name='barcode',
+            field=models.CharField(blank=True, help_text='Label scanned at the location', max_length=50, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='ScanCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(db_index=True, max_length=50)),
+                ('kind', models.CharField(choices=[('material', 'Material'), ('batch', 'Batch'), ('movement', 'Movement'), ('location', 'Location')], max_length=10)),
+                ('location', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scan_code', to='inventory.storagelocation')),
+                ('material', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scan_code', to='inventory.rawmaterial')),
+                ('movement', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scan_code', to='inventory.stockmovement')),
+                ('stock', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scan_code', to='inventory.stock')),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_scan_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='app_label.model of the deleted row', max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='client_id',
+            field=models.UUIDField(blank=True, editable=False, help_text='Idempotency key of a movement queued on an offline client', null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='storagelocation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='rawmaterial',
+            index=models.Index(fields=['updated_at', 'id'], name='inventory_r_updated_946613_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['updated_at', 'id'], name='inventory_s_updated_deee56_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storagelocation',
+            index=models.Index(fields=['updated_at', 'id'], name='inventory_s_updated_bc1481_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='warehouse',
+            index=models.Index(fields=['updated_at', 'id'], name='inventory_w_updated_e63e64_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='synctombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='inventory_s_deleted_e35ecb_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:09
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def reserve_customer_allocations(apps, schema_editor):
+    """Allocations of open customer orders become their items' reservations"""
+    MaterialRequirement = apps.get_model('orders', 'MaterialRequirement')
+    MaterialReservation = apps.get_model('inventory', 'MaterialReservation')
+    RawMaterial = apps.get_model('inventory', 'RawMaterial')
+    MaterialReservation.objects.bulk_create([
+        MaterialReservation(material_id=material_id, order_item_id=order_item_id, quantity=quantity)
+        for material_id, order_item_id, quantity in MaterialRequirement.objects.filter(
+            allocated_quantity__gt=0,
+            order_item__order__status__in=('pending', 'confirmed', 'in_production')
+        ).values_list('material_id', 'order_item_id', 'allocated_quantity')
+    ])
+    totals = (
+        MaterialReservation.objects.filter(material=OuterRef('pk'), status='active')
+        .values('material')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    RawMaterial.objects.update(reserved=Coalesce(Subquery(totals), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0001_initial'),
+        ('production', '0004_versioned_formulations'),
+        ('inventory', '0017_sync_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawmaterial',
+            name='reserved',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Quantity held by active reservations, maintained by the reservation service', max_digits=14),
+        ),
+        migrations.CreateModel(
+            name='MaterialReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=14, validators=[django.core.validators.MinValueValidator(0)])),
+                ('consumed_quantity', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('consumed', 'Consumed'), ('released', 'Released')], default='active', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='material_reservations', to=settings.AUTH_USER_MODEL)),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='inventory.rawmaterial')),
+                ('order_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.orderitem')),
+                ('production_order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='production.productionorder')),
+                ('stock', models.ForeignKey(blank=True, help_text='Batch the quantity is held on, if reserved per batch', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='inventory.stock')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['material', 'status'], name='inventory_m_materia_ef2814_idx'), models.Index(fields=['stock', 'status'], name='inventory_m_stock_i_e8aab9_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='materialreservation',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('order_item__isnull', True), ('production_order__isnull', False)), models.Q(('order_item__isnull', False), ('production_order__isnull', True)), _connector='OR'), name='reservation_has_one_owner'),
+        ),
+        migrations.RunPython(reserve_customer_allocations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_material_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagelocation',
+            name='last_counted_at',
+            field=models.DateTimeField(blank=True, help_text='When a cycle count last reconciled batches here, including batches counted empty', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_storagelocation_last_counted_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cyclecountline',
+            name='system_quantity',
+            field=models.PositiveIntegerField(blank=True, help_text='System quantity when the line was counted', null=True),
+        ),
+    ]
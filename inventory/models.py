@@ -1,8 +1,23 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.conf import settings
 
+class MaintainedFieldsMixin:
+    """
+    Leaves totals maintained with F() updates out of ordinary saves, so a
+    possibly stale instance never writes them back.
+    """
+    MAINTAINED_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 class Supplier(models.Model):
     name = models.CharField(max_length=200)
     code = models.CharField(max_length=50, unique=True)
@@ -18,11 +33,20 @@ class Supplier(models.Model):
     def __str__(self):
         return f"{self.name} ({self.code})"
 
-class Warehouse(models.Model):
+class Warehouse(MaintainedFieldsMixin, models.Model):
+    MAINTAINED_FIELDS = ('current_volume',)
+
     name = models.CharField(max_length=200)
     code = models.CharField(max_length=50, unique=True)
     location = models.CharField(max_length=200)
     capacity = models.PositiveIntegerField(help_text="Storage capacity in cubic meters")
+    current_volume = models.DecimalField(
+        max_digits=14,
+        decimal_places=3,
+        default=0,
+        editable=False,
+        help_text="Volume occupied across all storage locations, maintained as stock moves"
+    )
     manager = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET_NULL,
@@ -34,17 +58,21 @@ class Warehouse(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.code})"
 
     def get_current_utilization(self):
         """Calculate current warehouse utilization"""
-        total_volume = sum(
-            location.current_volume for location in self.storage_locations.all()
-        )
-        return (total_volume / self.capacity) * 100 if self.capacity else 0
+        return (self.current_volume / self.capacity) * 100 if self.capacity else 0
+
+class StorageLocation(MaintainedFieldsMixin, models.Model):
+    MAINTAINED_FIELDS = ('current_volume',)
 
-class StorageLocation(models.Model):
     LOCATION_TYPES = [
         ('shelf', 'Shelf'),
         ('rack', 'Rack'),
@@ -55,22 +83,50 @@ class StorageLocation(models.Model):
 
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='storage_locations')
     name = models.CharField(max_length=100)
+    barcode = models.CharField(max_length=50, unique=True, null=True, blank=True, help_text="Label scanned at the location")
     location_type = models.CharField(max_length=20, choices=LOCATION_TYPES)
     capacity = models.PositiveIntegerField(help_text="Storage capacity in cubic meters")
-    current_volume = models.PositiveIntegerField(default=0, help_text="Current volume occupied in cubic meters")
+    current_volume = models.DecimalField(
+        max_digits=12,
+        decimal_places=3,
+        default=0,
+        editable=False,
+        help_text="Current volume occupied in cubic meters, maintained as stock moves"
+    )
     temperature_controlled = models.BooleanField(default=False)
     temperature_range = models.CharField(max_length=50, blank=True, help_text="e.g., '2-8°C'")
+    accessibility_rank = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Pick accessibility within the warehouse, 1 being the most accessible (e.g. next to the dock)"
+    )
     active = models.BooleanField(default=True)
     notes = models.TextField(blank=True)
+    last_counted_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When a cycle count last reconciled batches here, including batches counted empty"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.warehouse.name} - {self.name} ({self.location_type})"
 
+    def save(self, *args, **kwargs):
+        # Unlabelled locations store NULL so they don't collide on the unique barcode
+        self.barcode = self.barcode or None
+        super().save(*args, **kwargs)
+
     def is_available(self, required_volume):
         """Check if location has enough space"""
         return (self.capacity - self.current_volume) >= required_volume
 
-class RawMaterial(models.Model):
+class RawMaterial(MaintainedFieldsMixin, models.Model):
     UNIT_CHOICES = [
         ('kg', 'Kilograms'),
         ('l', 'Liters'),
@@ -79,6 +135,10 @@ class RawMaterial(models.Model):
         ('m2', 'Square Meters'),
         ('m3', 'Cubic Meters'),
     ]
+    VALUATION_METHODS = [
+        ('average', 'Weighted Average'),
+        ('fifo', 'FIFO'),
+    ]
 
     name = models.CharField(max_length=200)
     code = models.CharField(max_length=50, unique=True)
@@ -89,6 +149,26 @@ class RawMaterial(models.Model):
     maximum_stock = models.PositiveIntegerField()
     reorder_point = models.PositiveIntegerField()
     lead_time = models.PositiveIntegerField(help_text="Lead time in days")
+    on_hand = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Total quantity across all stock records, maintained on every stock write"
+    )
+    reserved = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        help_text="Quantity held by active reservations, maintained by the reservation service"
+    )
+    valuation_method = models.CharField(max_length=10, choices=VALUATION_METHODS, default='average')
+    inventory_value = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        help_text="Cost of the quantity on hand, maintained as movements post"
+    )
     
     # Dimensions for storage calculations
     volume_per_unit = models.DecimalField(
@@ -103,18 +183,30 @@ class RawMaterial(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    MAINTAINED_FIELDS = ('on_hand', 'inventory_value', 'reserved')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.code})"
 
     @property
     def current_stock(self):
         """Get current stock level across all locations"""
-        return sum(stock.quantity for stock in self.stock_records.all())
+        return self.on_hand
+
+    @property
+    def available(self):
+        """Quantity on hand that no reservation holds"""
+        return self.on_hand - self.reserved
 
     @property
     def stock_value(self):
-        """Calculate total value of current stock"""
-        return self.current_stock * self.unit_price
+        """Cost of current stock under the material's valuation method"""
+        return self.inventory_value
 
 class Stock(models.Model):
     material = models.ForeignKey(RawMaterial, on_delete=models.CASCADE, related_name='stock_records')
@@ -123,22 +215,70 @@ class Stock(models.Model):
     batch_number = models.CharField(max_length=50)
     expiry_date = models.DateField(null=True, blank=True)
     notes = models.TextField(blank=True)
+    last_counted_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['material', 'location', 'batch_number']
+        indexes = [
+            models.Index(fields=['material', 'expiry_date', 'created_at']),
+            models.Index(fields=['material', 'created_at']),
+            models.Index(fields=['updated_at', 'id']),
+            # Only batches that can expire; the expiring-stock feed walks it in order
+            models.Index(
+                fields=['expiry_date', 'id'],
+                name='stock_expiry_idx',
+                condition=models.Q(expiry_date__isnull=False)
+            ),
+        ]
 
     def __str__(self):
         return f"{self.material.name} at {self.location.name} - {self.quantity} {self.material.unit}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the persisted quantity so saves can post the exact delta
+        # to RawMaterial.on_hand instead of re-summing every stock record.
+        if 'quantity' in field_names:
+            instance._loaded_quantity = values[field_names.index('quantity')]
+        if 'location_id' in field_names:
+            instance._loaded_location_id = values[field_names.index('location_id')]
+        return instance
+
+    def get_quantity_delta(self):
+        """Difference between the in-memory and the persisted quantity"""
+        if self._state.adding:
+            return self.quantity
+        loaded = getattr(self, '_loaded_quantity', None)
+        if loaded is None:
+            loaded = Stock.objects.filter(pk=self.pk).values_list('quantity', flat=True).first() or 0
+        return self.quantity - loaded
+
+    def get_volume_deltas(self):
+        """Signed volume change per location id that saving this record makes"""
+        volume_per_unit = self.material.volume_per_unit
+        if self._state.adding:
+            return {self.location_id: self.quantity * volume_per_unit}
+        loaded_quantity = getattr(self, '_loaded_quantity', None)
+        loaded_location_id = getattr(self, '_loaded_location_id', None)
+        if loaded_quantity is None or loaded_location_id is None:
+            loaded_quantity, loaded_location_id = Stock.objects.filter(pk=self.pk).values_list(
+                'quantity', 'location_id'
+            ).first() or (0, self.location_id)
+        if loaded_location_id == self.location_id:
+            return {self.location_id: (self.quantity - loaded_quantity) * volume_per_unit}
+        return {
+            loaded_location_id: -loaded_quantity * volume_per_unit,
+            self.location_id: self.quantity * volume_per_unit,
+        }
+
     def save(self, *args, **kwargs):
-        if not self.pk:  # New stock record
-            # Update storage location volume
-            volume = self.quantity * self.material.volume_per_unit
-            self.location.current_volume += volume
-            self.location.save()
-        super().save(*args, **kwargs)
+        # Keep the stock row, the material's on-hand total and the location
+        # volume (maintained by the post_save signals) in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 class StockMovement(models.Model):
     MOVEMENT_TYPES = [
@@ -166,62 +306,431 @@ class StockMovement(models.Model):
     quantity = models.PositiveIntegerField()
     batch_number = models.CharField(max_length=50)
     reference_number = models.CharField(max_length=50, unique=True)
+    unit_cost = models.DecimalField(
+        max_digits=12,
+        decimal_places=4,
+        null=True,
+        blank=True,
+        help_text="Cost per unit; given for receipts, derived from the valuation for issues"
+    )
+    value = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Signed change in the material's inventory value"
+    )
     performed_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET_NULL,
         null=True
     )
+    client_id = models.UUIDField(
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        help_text="Idempotency key of a movement queued on an offline client"
+    )
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['material', 'created_at']),
+        ]
+
     def __str__(self):
         return f"{self.movement_type}: {self.material.name} - {self.quantity} {self.material.unit}"
 
     def save(self, *args, **kwargs):
-        if not self.pk:  # New movement
-            if self.movement_type == 'transfer':
-                # Update source location
-                source_stock = Stock.objects.get(
-                    material=self.material,
-                    location=self.source_location,
-                    batch_number=self.batch_number
-                )
-                source_stock.quantity -= self.quantity
-                if source_stock.quantity == 0:
-                    source_stock.delete()
-                else:
-                    source_stock.save()
-
-                # Update destination location
-                dest_stock, created = Stock.objects.get_or_create(
-                    material=self.material,
-                    location=self.destination_location,
-                    batch_number=self.batch_number,
-                    defaults={'quantity': 0}
-                )
-                dest_stock.quantity += self.quantity
-                dest_stock.save()
-
-            elif self.movement_type == 'receipt':
-                stock, created = Stock.objects.get_or_create(
-                    material=self.material,
-                    location=self.destination_location,
-                    batch_number=self.batch_number,
-                    defaults={'quantity': 0}
-                )
-                stock.quantity += self.quantity
-                stock.save()
-
-            elif self.movement_type == 'issue':
-                stock = Stock.objects.get(
-                    material=self.material,
-                    location=self.source_location,
-                    batch_number=self.batch_number
-                )
-                stock.quantity -= self.quantity
-                if stock.quantity == 0:
-                    stock.delete()
-                else:
-                    stock.save()
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
 
-        super().save(*args, **kwargs)
+        from .services import apply_movement
+
+        # Post the stock effects and the ledger row in one transaction so a
+        # failed movement never leaves stock half-updated.
+        with transaction.atomic():
+            apply_movement(self)
+            super().save(*args, **kwargs)
+
+class CostLayer(models.Model):
+    """Quantity received at one unit cost and not yet issued, for FIFO valuation"""
+    material = models.ForeignKey(RawMaterial, on_delete=models.CASCADE, related_name='cost_layers')
+    reference_number = models.CharField(max_length=50, help_text="Movement that created the layer")
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4)
+    quantity = models.PositiveIntegerField()
+    remaining = models.PositiveIntegerField()
+    received_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['received_at', 'pk']
+        indexes = [
+            models.Index(fields=['material', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.material_id}: {self.remaining}/{self.quantity} at {self.unit_cost}"
+
+class ReorderCandidate(models.Model):
+    """Materials whose on-hand total is at or below their reorder point"""
+    SEVERITY_CHOICES = [
+        ('reorder', 'Reorder'),
+        ('critical', 'Below Minimum'),
+    ]
+
+    material = models.OneToOneField(RawMaterial, on_delete=models.CASCADE, related_name='reorder_candidate')
+    on_hand = models.PositiveIntegerField()
+    reorder_point = models.PositiveIntegerField()
+    minimum_stock = models.PositiveIntegerField()
+    suggested_quantity = models.PositiveIntegerField(help_text="Quantity needed to refill to maximum stock")
+    severity = models.CharField(max_length=20, choices=SEVERITY_CHOICES, db_index=True)
+    flagged_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['on_hand']
+
+    def __str__(self):
+        return f"{self.material} - {self.get_severity_display()} ({self.on_hand})"
+
+class StockSnapshot(models.Model):
+    """Stock held per material, location and batch at the end of a day"""
+    snapshot_date = models.DateField(db_index=True)
+    material = models.ForeignKey(RawMaterial, on_delete=models.CASCADE, related_name='stock_snapshots')
+    location = models.ForeignKey(StorageLocation, on_delete=models.CASCADE, related_name='stock_snapshots')
+    batch_number = models.CharField(max_length=50)
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['snapshot_date', 'material', 'location', 'batch_number']
+        ordering = ['-snapshot_date']
+
+    def __str__(self):
+        return f"{self.snapshot_date}: {self.material_id} at {self.location_id} - {self.quantity}"
+
+class ReplenishmentPlan(models.Model):
+    """Demand statistics and replenishment figures computed by the planning job"""
+    material = models.OneToOneField(RawMaterial, on_delete=models.CASCADE, related_name='replenishment_plan')
+    window_days = models.PositiveIntegerField(help_text="Days of issue history the figures are based on")
+    avg_daily_demand = models.FloatField()
+    demand_std = models.FloatField(help_text="Standard deviation of daily demand")
+    on_hand = models.PositiveIntegerField()
+    safety_stock = models.PositiveIntegerField()
+    reorder_point = models.PositiveIntegerField(help_text="Lead-time demand plus safety stock")
+    reorder_quantity = models.PositiveIntegerField(help_text="Economic order quantity")
+    days_of_stock = models.FloatField(null=True, blank=True)
+    stockout_date = models.DateField(null=True, blank=True, db_index=True)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = [models.F('stockout_date').asc(nulls_last=True)]
+
+    def __str__(self):
+        return f"{self.material} - reorder {self.reorder_quantity} at {self.reorder_point}"
+
+class ChangeCounter(models.Model):
+    """A named counter bumped whenever the data it covers changes"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+class WarehouseUtilizationSnapshot(models.Model):
+    """Capacity and occupied volume of one location type in a warehouse at a point in time"""
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='utilization_snapshots')
+    location_type = models.CharField(max_length=20, choices=StorageLocation.LOCATION_TYPES)
+    recorded_at = models.DateTimeField()
+    location_count = models.PositiveIntegerField()
+    capacity = models.PositiveIntegerField(help_text="Combined capacity of the locations in cubic meters")
+    used_volume = models.DecimalField(max_digits=14, decimal_places=3)
+
+    class Meta:
+        ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['warehouse', 'recorded_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.warehouse_id} {self.location_type} at {self.recorded_at}: {self.used_volume}/{self.capacity}"
+
+class ExpiryBucket(models.Model):
+    """Stock in a warehouse expiring on one day, rebuilt nightly for dashboard counters"""
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='expiry_buckets')
+    expiry_date = models.DateField()
+    batch_count = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    computed_on = models.DateField()
+
+    class Meta:
+        unique_together = ['warehouse', 'expiry_date']
+        ordering = ['expiry_date']
+
+    def __str__(self):
+        return f"{self.warehouse_id} {self.expiry_date}: {self.batch_count} batch(es)"
+
+class MovementDailyRollup(models.Model):
+    """Movements per day, material, location and type, maintained as movements post"""
+    date = models.DateField()
+    material = models.ForeignKey(RawMaterial, on_delete=models.CASCADE, related_name='movement_rollups')
+    location = models.ForeignKey(
+        StorageLocation,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='movement_rollups',
+        help_text="Source location, or the destination for movements without one"
+    )
+    movement_type = models.CharField(max_length=20, choices=StockMovement.MOVEMENT_TYPES)
+    count = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['date', 'material', 'location', 'movement_type']
+        indexes = [
+            models.Index(fields=['material', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.movement_type}: {self.material_id} x{self.count} ({self.quantity})"
+
+class MaterialClassification(models.Model):
+    """ABC (consumption value) and XYZ (demand variability) class of a material"""
+    ABC_CLASSES = [
+        ('A', 'A - High value'),
+        ('B', 'B - Medium value'),
+        ('C', 'C - Low value'),
+    ]
+    XYZ_CLASSES = [
+        ('X', 'X - Steady demand'),
+        ('Y', 'Y - Variable demand'),
+        ('Z', 'Z - Erratic demand'),
+    ]
+
+    material = models.OneToOneField(RawMaterial, on_delete=models.CASCADE, related_name='classification')
+    abc_class = models.CharField(max_length=1, choices=ABC_CLASSES, db_index=True)
+    xyz_class = models.CharField(max_length=1, choices=XYZ_CLASSES, db_index=True)
+    issued_quantity = models.PositiveBigIntegerField(help_text="Quantity issued over the window")
+    consumption_value = models.DecimalField(max_digits=16, decimal_places=2)
+    value_share = models.FloatField(help_text="Cumulative share of total consumption value, in ABC order")
+    pick_count = models.PositiveIntegerField(help_text="Issue movements over the window")
+    demand_cv = models.FloatField(null=True, blank=True, help_text="Coefficient of variation of weekly demand")
+    window_days = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['abc_class', '-consumption_value']
+
+    def __str__(self):
+        return f"{self.material} - {self.abc_class}{self.xyz_class}"
+
+class SlottingProposal(models.Model):
+    """Suggested move of a fast-moving batch to a more accessible location"""
+    material = models.ForeignKey(RawMaterial, on_delete=models.CASCADE, related_name='slotting_proposals')
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='slotting_proposals')
+    from_location = models.ForeignKey(StorageLocation, on_delete=models.CASCADE, related_name='+')
+    to_location = models.ForeignKey(StorageLocation, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['to_location__accessibility_rank', 'pk']
+
+    def __str__(self):
+        return f"{self.material}: {self.from_location} -> {self.to_location} ({self.quantity})"
+
+class CycleCount(models.Model):
+    """A day's list of stock batches to count in one warehouse"""
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('reconciled', 'Reconciled'),
+    ]
+
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='cycle_counts')
+    scheduled_for = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    created_at = models.DateTimeField(auto_now_add=True)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+    reconciled_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        ordering = ['-scheduled_for', '-pk']
+        unique_together = ['warehouse', 'scheduled_for']
+
+    def __str__(self):
+        return f"Cycle count {self.warehouse.code} {self.scheduled_for}"
+
+class CycleCountLine(models.Model):
+    """One batch to count, and what was found"""
+    count = models.ForeignKey(CycleCount, on_delete=models.CASCADE, related_name='lines')
+    material = models.ForeignKey(RawMaterial, on_delete=models.CASCADE, related_name='+')
+    location = models.ForeignKey(StorageLocation, on_delete=models.CASCADE, related_name='+')
+    batch_number = models.CharField(max_length=50)
+    expected_quantity = models.PositiveIntegerField(help_text="System quantity when the list was scheduled")
+    counted_quantity = models.PositiveIntegerField(null=True, blank=True)
+    counted_at = models.DateTimeField(null=True, blank=True)
+    counted_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    system_quantity = models.PositiveIntegerField(null=True, blank=True, help_text="System quantity when the line was counted")
+    variance = models.IntegerField(null=True, blank=True)
+    adjustment = models.ForeignKey(
+        StockMovement,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+
+    class Meta:
+        ordering = ['location__name', 'pk']
+        unique_together = ['count', 'material', 'location', 'batch_number']
+
+    def __str__(self):
+        return f"{self.material_id} at {self.location_id} ({self.batch_number})"
+
+class TransferDocument(models.Model):
+    """A multi-line transfer of stock, posted as one unit"""
+    document_number = models.CharField(max_length=40, unique=True)
+    source_warehouse = models.ForeignKey(Warehouse, on_delete=models.PROTECT, related_name='outbound_transfers')
+    destination_warehouse = models.ForeignKey(Warehouse, on_delete=models.PROTECT, related_name='inbound_transfers')
+    performed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    notes = models.TextField(blank=True)
+    posted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-posted_at']
+
+    def __str__(self):
+        return f"{self.document_number}: {self.source_warehouse.code} -> {self.destination_warehouse.code}"
+
+class TransferDocumentLine(models.Model):
+    document = models.ForeignKey(TransferDocument, on_delete=models.CASCADE, related_name='lines')
+    line_number = models.PositiveIntegerField()
+    material = models.ForeignKey(RawMaterial, on_delete=models.PROTECT, related_name='+')
+    source_location = models.ForeignKey(StorageLocation, on_delete=models.PROTECT, related_name='+')
+    destination_location = models.ForeignKey(StorageLocation, on_delete=models.PROTECT, related_name='+')
+    batch_number = models.CharField(max_length=50)
+    quantity = models.PositiveIntegerField()
+    movement = models.OneToOneField(StockMovement, on_delete=models.PROTECT, related_name='transfer_line')
+
+    class Meta:
+        ordering = ['document', 'line_number']
+        unique_together = ['document', 'line_number']
+
+    def __str__(self):
+        return f"{self.document.document_number}/{self.line_number}"
+
+class ScanCode(models.Model):
+    """
+    Index of scannable codes: material codes, batch numbers, movement
+    references and location barcodes. Exactly one of the entity links is set.
+    """
+    KINDS = [
+        ('material', 'Material'),
+        ('batch', 'Batch'),
+        ('movement', 'Movement'),
+        ('location', 'Location'),
+    ]
+
+    code = models.CharField(max_length=50, db_index=True)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    material = models.OneToOneField(
+        RawMaterial, on_delete=models.CASCADE, null=True, blank=True, related_name='scan_code'
+    )
+    stock = models.OneToOneField(Stock, on_delete=models.CASCADE, null=True, blank=True, related_name='scan_code')
+    movement = models.OneToOneField(
+        StockMovement, on_delete=models.CASCADE, null=True, blank=True, related_name='scan_code'
+    )
+    location = models.OneToOneField(
+        StorageLocation, on_delete=models.CASCADE, null=True, blank=True, related_name='scan_code'
+    )
+
+    def __str__(self):
+        return f"{self.code} ({self.kind})"
+
+class SyncTombstone(models.Model):
+    """Marker left by a deleted row so offline clients can drop their copy"""
+    model = models.CharField(max_length=100, help_text="app_label.model of the deleted row")
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} deleted at {self.deleted_at}"
+
+
+class MaterialReservation(models.Model):
+    """
+    Material held for a production order or a customer order item, from
+    scheduling until it is consumed or released. ``quantity`` is what the
+    reservation still holds; RawMaterial.reserved is the sum over the
+    active ones.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('consumed', 'Consumed'),
+        ('released', 'Released'),
+    ]
+
+    material = models.ForeignKey(RawMaterial, on_delete=models.PROTECT, related_name='reservations')
+    stock = models.ForeignKey(
+        Stock, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations',
+        help_text="Batch the quantity is held on, if reserved per batch"
+    )
+    production_order = models.ForeignKey(
+        'production.ProductionOrder', on_delete=models.CASCADE, null=True, blank=True, related_name='reservations'
+    )
+    order_item = models.ForeignKey(
+        'orders.OrderItem', on_delete=models.CASCADE, null=True, blank=True, related_name='reservations'
+    )
+    quantity = models.DecimalField(max_digits=14, decimal_places=2, validators=[MinValueValidator(0)])
+    consumed_quantity = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='material_reservations'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=(
+                    models.Q(production_order__isnull=False, order_item__isnull=True)
+                    | models.Q(production_order__isnull=True, order_item__isnull=False)
+                ),
+                name='reservation_has_one_owner'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['material', 'status']),
+            models.Index(fields=['stock', 'status']),
+        ]
+
+    def __str__(self):
+        if self.production_order_id:
+            return f"{self.material} - {self.quantity} for production order {self.production_order_id}"
+        return f"{self.material} - {self.quantity} for order item {self.order_item_id}"
@@ -0,0 +1,143 @@
+import datetime
+import math
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import MovementDailyRollup, RawMaterial, ReplenishmentPlan
+
+# Days of issue history the demand statistics are based on
+DEMAND_WINDOW = 90
+# Probability of not running out during a replenishment lead time
+SERVICE_LEVEL = 0.95
+# Fixed cost of placing one purchase order
+ORDER_COST = 5000
+# Yearly cost of holding one unit, as a fraction of its unit price
+HOLDING_RATE = 0.25
+# Stock lasting longer than this has no stockout date
+STOCKOUT_HORIZON_DAYS = 3650
+
+
+def daily_demand_matrix(material_ids, start, end):
+    """
+    Issued quantity per material and day in [start, end], as a DataFrame
+    indexed by material id with one column per day.
+
+    Read from the daily movement rollup rather than the ledger; its rows
+    are summed over locations, so one query returns at most one row per
+    material per day.
+    """
+    rows = (
+        MovementDailyRollup.objects.filter(
+            movement_type='issue',
+            date__gte=start,
+            date__lte=end
+        )
+        .values_list('material_id', 'date')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    )
+    days = pd.date_range(start, end, freq='D')
+    frame = pd.DataFrame.from_records(list(rows), columns=['material_id', 'day', 'total'])
+    if frame.empty:
+        return pd.DataFrame(0.0, index=pd.Index(material_ids, name='material_id'), columns=days)
+    frame['day'] = pd.to_datetime(frame['day'])
+    return (
+        frame.pivot_table(index='material_id', columns='day', values='total', aggfunc='sum')
+        .reindex(index=material_ids, columns=days, fill_value=0)
+        .fillna(0)
+        .astype(float)
+    )
+
+
+def compute_replenishment(window_days=DEMAND_WINDOW, service_level=SERVICE_LEVEL,
+                          order_cost=ORDER_COST, holding_rate=HOLDING_RATE, today=None):
+    """
+    Demand statistics and replenishment figures for every active material.
+
+    Works on the whole materials x days demand matrix at once: safety stock
+    is z * sigma * sqrt(lead time), the reorder point adds the expected
+    lead-time demand, and the reorder quantity is the economic order
+    quantity sqrt(2 * yearly demand * order cost / yearly holding cost).
+    Returns a DataFrame indexed by material id.
+    """
+    if today is None:
+        today = timezone.localdate()
+    start = today - datetime.timedelta(days=window_days - 1)
+
+    materials = pd.DataFrame.from_records(
+        list(RawMaterial.objects.filter(active=True).values_list('pk', 'on_hand', 'lead_time', 'unit_price')),
+        columns=['material_id', 'on_hand', 'lead_time', 'unit_price'],
+        index='material_id'
+    )
+    if materials.empty:
+        return materials
+
+    demand = daily_demand_matrix(materials.index, start, today).to_numpy()
+    on_hand = materials['on_hand'].to_numpy(dtype=float)
+    lead_time = materials['lead_time'].to_numpy(dtype=float)
+    unit_price = materials['unit_price'].to_numpy(dtype=float)
+
+    mean = demand.mean(axis=1)
+    std = demand.std(axis=1, ddof=1) if window_days > 1 else np.zeros_like(mean)
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = np.ceil(z * std * np.sqrt(lead_time))
+    reorder_point = np.ceil(mean * lead_time) + safety_stock
+
+    holding_cost = unit_price * holding_rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eoq = np.sqrt(2 * mean * 365 * order_cost / holding_cost)
+        days_of_stock = np.where(mean > 0, on_hand / mean, np.nan)
+    reorder_quantity = np.where(holding_cost > 0, np.ceil(eoq), 0)
+    reorder_quantity = np.where(mean > 0, reorder_quantity, 0)
+
+    return pd.DataFrame({
+        'avg_daily_demand': mean,
+        'demand_std': std,
+        'on_hand': on_hand.astype(int),
+        'safety_stock': safety_stock.astype(int),
+        'reorder_point': reorder_point.astype(int),
+        'reorder_quantity': np.nan_to_num(reorder_quantity).astype(int),
+        'days_of_stock': days_of_stock,
+    }, index=materials.index)
+
+
+def refresh_replenishment_plans(window_days=DEMAND_WINDOW, **kwargs):
+    """Recompute and store the plan of every active material; returns the count"""
+    today = kwargs.setdefault('today', timezone.localdate())
+    frame = compute_replenishment(window_days=window_days, **kwargs)
+    now = timezone.now()
+    plans = [
+        ReplenishmentPlan(
+            material_id=int(material_id),
+            window_days=window_days,
+            avg_daily_demand=round(float(row.avg_daily_demand), 4),
+            demand_std=round(float(row.demand_std), 4),
+            on_hand=int(row.on_hand),
+            safety_stock=int(row.safety_stock),
+            reorder_point=int(row.reorder_point),
+            reorder_quantity=int(row.reorder_quantity),
+            days_of_stock=None if math.isnan(row.days_of_stock) else round(float(row.days_of_stock), 1),
+            stockout_date=(
+                None if math.isnan(row.days_of_stock) or row.days_of_stock > STOCKOUT_HORIZON_DAYS
+                else today + datetime.timedelta(days=int(row.days_of_stock))
+            ),
+            computed_at=now
+        )
+        for material_id, row in zip(frame.index, frame.itertuples(index=False))
+    ]
+    with transaction.atomic():
+        ReplenishmentPlan.objects.filter(material__active=False).delete()
+        ReplenishmentPlan.objects.bulk_create(
+            plans,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['material'],
+            update_fields=[
+                'window_days', 'avg_daily_demand', 'demand_std', 'on_hand', 'safety_stock',
+                'reorder_point', 'reorder_quantity', 'days_of_stock', 'stockout_date', 'computed_at'
+            ]
+        )
+    return len(plans)
@@ -0,0 +1,208 @@
+import heapq
+import threading
+import time
+from contextlib import closing
+from decimal import Decimal
+from .models import StorageLocation
+
+# Rebuild the index from the database at least this often, so capacity
+# changes posted by other worker processes are picked up.
+INDEX_MAX_AGE = 300
+
+
+class FreeCapacityIndex:
+    """
+    In-memory index of free storage volume.
+
+    Locations are kept in one max-heap per (warehouse, location type,
+    temperature controlled) key. Updates push a new heap entry and leave the
+    old one behind; every push gets a sequence number, so stale entries are
+    recognised by not carrying their location's latest one, even when the
+    free volume has returned to an earlier value, and are dropped when they
+    reach the top.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._heaps = {}
+        self._entries = {}
+        self._sequences = {}
+        self._sequence = 0
+        self._loaded_at = None
+
+    def _key(self, entry):
+        return (entry['warehouse_id'], entry['location_type'], entry['temperature_controlled'])
+
+    def _push(self, location_id, entry):
+        self._entries[location_id] = entry
+        self._sequence += 1
+        self._sequences[location_id] = self._sequence
+        if entry['active']:
+            heap = self._heaps.setdefault(self._key(entry), [])
+            heapq.heappush(heap, (-entry['free'], location_id, self._sequence))
+
+    def _is_current(self, key, location_id, sequence):
+        entry = self._entries.get(location_id)
+        return (
+            entry is not None and entry['active'] and self._sequences.get(location_id) == sequence
+            and self._key(entry) == key
+        )
+
+    def rebuild(self):
+        """Load every storage location in one query"""
+        with self._lock:
+            self._heaps = {}
+            self._entries = {}
+            self._sequences = {}
+            for row in StorageLocation.objects.values(
+                'pk', 'warehouse_id', 'location_type', 'temperature_controlled',
+                'capacity', 'current_volume', 'active'
+            ):
+                self._push(row['pk'], self._entry(row))
+            self._loaded_at = time.monotonic()
+
+    def _entry(self, row):
+        return {
+            'warehouse_id': row['warehouse_id'],
+            'location_type': row['location_type'],
+            'temperature_controlled': row['temperature_controlled'],
+            'free': Decimal(row['capacity']) - Decimal(row['current_volume']),
+            'active': row['active'],
+        }
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > INDEX_MAX_AGE:
+                self.rebuild()
+
+    def refresh(self, location_ids):
+        """Re-read the given locations after their volume or settings changed"""
+        location_ids = list(location_ids)
+        if not location_ids:
+            return
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            rows = StorageLocation.objects.filter(pk__in=location_ids).values(
+                'pk', 'warehouse_id', 'location_type', 'temperature_controlled',
+                'capacity', 'current_volume', 'active'
+            )
+            seen = set()
+            for row in rows:
+                seen.add(row['pk'])
+                entry = self._entry(row)
+                current = self._entries.get(row['pk'])
+                if current != entry:
+                    self._push(row['pk'], entry)
+            for location_id in set(location_ids) - seen:
+                self._entries.pop(location_id, None)
+                self._sequences.pop(location_id, None)
+
+    def largest(self, warehouse_id, location_types=None, temperature_controlled=None):
+        """
+        Yield (location_id, free volume) for matching locations, largest first.
+
+        Only as many heap entries as the caller consumes are popped, and the
+        current ones are pushed back once the caller is done.
+        """
+        with self._lock:
+            keys = [
+                key for key in self._heaps
+                if key[0] == warehouse_id
+                and (location_types is None or key[1] in location_types)
+                and (temperature_controlled is None or key[2] == temperature_controlled)
+            ]
+            frontier = []
+            popped = []
+
+            def advance(key):
+                heap = self._heaps[key]
+                while heap:
+                    item = heapq.heappop(heap)
+                    neg_free, location_id, sequence = item
+                    if self._is_current(key, location_id, sequence):
+                        popped.append((key, item))
+                        heapq.heappush(frontier, (neg_free, location_id, key))
+                        return
+
+            try:
+                for key in keys:
+                    advance(key)
+                while frontier:
+                    neg_free, location_id, key = heapq.heappop(frontier)
+                    yield location_id, -neg_free
+                    advance(key)
+            finally:
+                for key, item in popped:
+                    heapq.heappush(self._heaps[key], item)
+
+
+free_capacity_index = FreeCapacityIndex()
+
+
+def suggest_putaway(material, quantity, warehouse_id, location_types=None,
+                    temperature_controlled=None, max_attempts=3):
+    """
+    Plan where to store ``quantity`` units of ``material`` in a warehouse.
+
+    Bins are filled largest-free-volume first, so the plan uses as few
+    locations as possible. The chosen bins are re-checked against the
+    database in one query; if another process changed them since the index
+    was built, the index is refreshed and the plan recomputed.
+    """
+    volume_per_unit = Decimal(material.volume_per_unit)
+    free_capacity_index.ensure_loaded()
+
+    for _ in range(max_attempts):
+        plan = []
+        remaining = quantity
+        with closing(free_capacity_index.largest(
+            warehouse_id, location_types, temperature_controlled
+        )) as locations:
+            for location_id, free in locations:
+                if remaining <= 0:
+                    break
+                if volume_per_unit:
+                    fits = min(remaining, int(free // volume_per_unit))
+                else:
+                    fits = remaining
+                if fits <= 0:
+                    break  # Every remaining location has even less room
+                plan.append({
+                    'location_id': location_id,
+                    'quantity': fits,
+                    'volume': fits * volume_per_unit,
+                    'free_volume': free,
+                })
+                remaining -= fits
+
+        chosen = {
+            row['pk']: row
+            for row in StorageLocation.objects.filter(
+                pk__in=[line['location_id'] for line in plan]
+            ).values(
+                'pk', 'name', 'location_type', 'capacity', 'current_volume', 'active'
+            )
+        }
+        stale = [
+            line['location_id'] for line in plan
+            if line['location_id'] not in chosen
+            or not chosen[line['location_id']]['active']
+            or Decimal(chosen[line['location_id']]['capacity'])
+            - Decimal(chosen[line['location_id']]['current_volume']) != line['free_volume']
+        ]
+        if not stale:
+            break
+        free_capacity_index.refresh(stale)
+
+    for line in plan:
+        row = chosen.get(line['location_id'], {})
+        line['location_name'] = row.get('name')
+        line['location_type'] = row.get('location_type')
+        line['free_volume_after'] = line['free_volume'] - line['volume']
+
+    return {
+        'plan': plan,
+        'planned_quantity': quantity - remaining,
+        'unplaced_quantity': max(remaining, 0),
+    }
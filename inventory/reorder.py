@@ -0,0 +1,75 @@
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import RawMaterial, ReorderCandidate
+
+
+def _build_candidate(material_id, on_hand, reorder_point, minimum_stock, maximum_stock):
+    """Return a ReorderCandidate if the material needs reordering, else None"""
+    if on_hand > reorder_point and on_hand > minimum_stock:
+        return None
+    now = timezone.now()
+    return ReorderCandidate(
+        material_id=material_id,
+        on_hand=on_hand,
+        reorder_point=reorder_point,
+        minimum_stock=minimum_stock,
+        suggested_quantity=max(maximum_stock - on_hand, 0),
+        severity='critical' if on_hand <= minimum_stock else 'reorder',
+        flagged_at=now,
+        updated_at=now
+    )
+
+
+def _save_candidates(material_ids, candidates):
+    """Replace the flags for material_ids with the given candidates"""
+    flagged_ids = [candidate.material_id for candidate in candidates]
+    stale = ReorderCandidate.objects.exclude(material_id__in=flagged_ids)
+    if material_ids is not None:
+        stale = stale.filter(material_id__in=material_ids)
+    stale.delete()
+
+    if candidates:
+        ReorderCandidate.objects.bulk_create(
+            candidates,
+            update_conflicts=True,
+            unique_fields=['material'],
+            update_fields=[
+                'on_hand', 'reorder_point', 'minimum_stock',
+                'suggested_quantity', 'severity', 'updated_at'
+            ]
+        )
+
+
+def low_stock_materials():
+    """
+    Active materials at or below their reorder point or minimum stock.
+
+    The per-material total is summed from the stock records in one grouped
+    query, so a full refresh does not depend on the denormalized on_hand.
+    """
+    return (
+        RawMaterial.objects.filter(active=True)
+        .annotate(total=Coalesce(Sum('stock_records__quantity'), Value(0)))
+        .filter(Q(total__lte=F('reorder_point')) | Q(total__lte=F('minimum_stock')))
+    )
+
+
+def refresh_reorder_candidates():
+    """Rebuild the whole flagged-materials table; returns the flagged count"""
+    rows = low_stock_materials().values_list(
+        'pk', 'total', 'reorder_point', 'minimum_stock', 'maximum_stock'
+    )
+    candidates = [_build_candidate(*row) for row in rows]
+    _save_candidates(None, candidates)
+    return len(candidates)
+
+
+def update_reorder_flags(material_ids):
+    """Re-evaluate the flags of a few materials from their on-hand totals"""
+    material_ids = list(material_ids)
+    rows = RawMaterial.objects.filter(pk__in=material_ids, active=True).values_list(
+        'pk', 'on_hand', 'reorder_point', 'minimum_stock', 'maximum_stock'
+    )
+    candidates = [candidate for candidate in (_build_candidate(*row) for row in rows) if candidate]
+    _save_candidates(material_ids, candidates)
@@ -0,0 +1,242 @@
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+from .models import MaterialReservation, RawMaterial, Stock
+
+
+class ReservationShortage(ValidationError):
+    """More was asked for than is available; ``shortages`` lists what is missing"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__([
+            f"{shortage['name']}: required {shortage['required']}, available {shortage['available']}"
+            for shortage in shortages
+        ])
+
+
+def _owner(production_order=None, order_item=None):
+    if (production_order is None) == (order_item is None):
+        raise ValueError("A reservation belongs to exactly one production order or order item")
+    if production_order is not None:
+        return {'production_order': production_order}
+    return {'order_item': order_item}
+
+
+def _lock_materials(material_ids):
+    """Lock material rows in id order, the order every reserver takes them in"""
+    return {
+        material.pk: material
+        for material in RawMaterial.objects.select_for_update().filter(pk__in=list(material_ids)).order_by('pk')
+    }
+
+
+def _adjust_reserved(deltas):
+    """Apply ``{material id: delta}`` to the maintained totals in one UPDATE"""
+    deltas = {material_id: delta for material_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    RawMaterial.objects.filter(pk__in=list(deltas)).update(
+        reserved=F('reserved') + Case(
+            *[When(pk=material_id, then=Value(delta)) for material_id, delta in deltas.items()],
+            output_field=DecimalField(max_digits=14, decimal_places=2)
+        )
+    )
+
+
+def held_quantities(production_order=None, order_item=None):
+    """What the owner's active reservations hold, per material"""
+    return {
+        material_id: total
+        for material_id, total in MaterialReservation.objects.filter(
+            status='active', **_owner(production_order, order_item)
+        )
+        .values_list('material_id')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    }
+
+
+def reserve(quantities=None, batches=None, production_order=None, order_item=None, performed_by=None):
+    """
+    Reserve material for a production order or a customer order item.
+
+    ``quantities`` maps material ids to quantities held against the
+    material as a whole; ``batches`` maps stock ids to quantities held on
+    that batch. Batch rows, then material rows are locked, in id order, so
+    two reservations can never both take the last of a material. Raises
+    ReservationShortage, reserving nothing, if any line asks for more than
+    is available. Repeated reservations add to the owner's existing ones.
+    """
+    quantities = {material_id: Decimal(quantity) for material_id, quantity in (quantities or {}).items() if quantity}
+    batches = {stock_id: Decimal(quantity) for stock_id, quantity in (batches or {}).items() if quantity}
+    if any(quantity < 0 for quantity in [*quantities.values(), *batches.values()]):
+        raise ValidationError("Reserved quantities must be positive")
+    owner = _owner(production_order, order_item)
+
+    with transaction.atomic():
+        # Same order as posting: stock rows before the material totals
+        stocks = {
+            stock.pk: stock
+            for stock in Stock.objects.select_for_update().filter(pk__in=list(batches)).order_by('pk')
+        }
+        missing = sorted(set(batches) - set(stocks))
+        if missing:
+            raise ValidationError(f"Stock records {missing} do not exist")
+        wanted = dict(quantities)
+        for stock_id, quantity in batches.items():
+            material_id = stocks[stock_id].material_id
+            wanted[material_id] = wanted.get(material_id, Decimal(0)) + quantity
+        materials = _lock_materials(wanted)
+        missing = sorted(set(wanted) - set(materials))
+        if missing:
+            raise ValidationError(f"Materials {missing} do not exist")
+
+        shortages = [
+            {
+                'material': material_id,
+                'name': materials[material_id].name,
+                'required': quantity,
+                'available': materials[material_id].available,
+            }
+            for material_id, quantity in sorted(wanted.items())
+            if quantity > materials[material_id].available
+        ]
+        held_on_batches = dict(
+            MaterialReservation.objects.filter(stock_id__in=list(batches), status='active')
+            .values_list('stock_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        )
+        for stock_id, quantity in sorted(batches.items()):
+            stock = stocks[stock_id]
+            free = stock.quantity - held_on_batches.get(stock_id, Decimal(0))
+            if quantity > free:
+                shortages.append({
+                    'material': stock.material_id,
+                    'name': f"{materials[stock.material_id].name} batch {stock.batch_number}",
+                    'required': quantity,
+                    'available': free,
+                })
+        if shortages:
+            raise ReservationShortage(shortages)
+
+        lines = [(material_id, None, quantity) for material_id, quantity in quantities.items()]
+        lines += [(stocks[stock_id].material_id, stock_id, quantity) for stock_id, quantity in batches.items()]
+        existing = {
+            (reservation.material_id, reservation.stock_id): reservation
+            for reservation in MaterialReservation.objects.select_for_update().filter(
+                status='active', material_id__in=list(wanted), **owner
+            )
+        }
+        created, updated = [], []
+        now = timezone.now()
+        for material_id, stock_id, quantity in lines:
+            reservation = existing.get((material_id, stock_id))
+            if reservation:
+                reservation.quantity += quantity
+                # bulk_update skips auto_now
+                reservation.updated_at = now
+                updated.append(reservation)
+            else:
+                created.append(MaterialReservation(
+                    material_id=material_id, stock_id=stock_id, quantity=quantity,
+                    created_by=performed_by, **owner
+                ))
+        MaterialReservation.objects.bulk_create(created)
+        MaterialReservation.objects.bulk_update(updated, ['quantity', 'updated_at'])
+        _adjust_reserved(wanted)
+    return created + updated
+
+
+def reserve_to(quantities, production_order=None, order_item=None, performed_by=None):
+    """
+    Make the owner hold exactly ``quantities`` (material id -> quantity),
+    reserving what is missing and releasing any surplus, atomically.
+    """
+    with transaction.atomic():
+        _lock_materials(quantities)
+        held = held_quantities(production_order, order_item)
+        missing = {
+            material_id: Decimal(quantity) - held.get(material_id, Decimal(0))
+            for material_id, quantity in quantities.items()
+        }
+        surplus = {material_id: -delta for material_id, delta in missing.items() if delta < 0}
+        if surplus:
+            release(quantities=surplus, production_order=production_order, order_item=order_item)
+        return reserve(
+            {material_id: delta for material_id, delta in missing.items() if delta > 0},
+            production_order=production_order, order_item=order_item, performed_by=performed_by
+        )
+
+
+def _draw_down(reservations, quantities, status):
+    """
+    Take ``quantities`` (material id -> quantity) off locked reservations,
+    newest first for releases and oldest first for consumption. Returns
+    the totals taken per material.
+    """
+    remaining = dict(quantities) if quantities is not None else None
+    taken = {}
+    changed = []
+    now = timezone.now()
+    for reservation in reservations:
+        if remaining is None:
+            amount = reservation.quantity
+        else:
+            amount = min(reservation.quantity, remaining.get(reservation.material_id, Decimal(0)))
+            if not amount:
+                continue
+            remaining[reservation.material_id] -= amount
+        taken[reservation.material_id] = taken.get(reservation.material_id, Decimal(0)) + amount
+        if status == 'consumed':
+            reservation.consumed_quantity += amount
+            reservation.quantity -= amount
+            if not reservation.quantity:
+                reservation.status = 'consumed'
+        elif amount == reservation.quantity:
+            reservation.status = 'released'
+        else:
+            reservation.quantity -= amount
+        reservation.updated_at = now
+        changed.append(reservation)
+    MaterialReservation.objects.bulk_update(changed, ['quantity', 'consumed_quantity', 'status', 'updated_at'])
+    return taken
+
+
+def _locked_reservations(owner, material_ids, oldest_first):
+    reservations = MaterialReservation.objects.filter(status='active', **owner)
+    if material_ids is not None:
+        reservations = reservations.filter(material_id__in=list(material_ids))
+    _lock_materials(set(reservations.values_list('material_id', flat=True)))
+    order = ('created_at', 'pk') if oldest_first else ('-created_at', '-pk')
+    return list(reservations.select_for_update().order_by(*order))
+
+
+def release(quantities=None, production_order=None, order_item=None):
+    """
+    Release the owner's reservations: all of them, or up to ``quantities``
+    per material, newest first. Returns the released totals per material.
+    """
+    owner = _owner(production_order, order_item)
+    with transaction.atomic():
+        reservations = _locked_reservations(owner, quantities, oldest_first=False)
+        released = _draw_down(reservations, quantities, 'released')
+        _adjust_reserved({material_id: -quantity for material_id, quantity in released.items()})
+    return released
+
+
+def consume(material_id, quantity, production_order):
+    """
+    Draw a production order's reservations of a material down by what
+    production used, oldest first. Consumption beyond what is reserved is
+    ignored here. Returns the quantity taken off reservations.
+    """
+    owner = _owner(production_order=production_order)
+    with transaction.atomic():
+        reservations = _locked_reservations(owner, [material_id], oldest_first=True)
+        consumed = _draw_down(reservations, {material_id: Decimal(quantity)}, 'consumed')
+        _adjust_reserved({material_id: -consumed.get(material_id, Decimal(0))})
+    return consumed.get(material_id, Decimal(0))
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import MovementDailyRollup, StockMovement
+
+
+def rollup_key(movement, day):
+    return (
+        day,
+        movement.material_id,
+        movement.source_location_id or movement.destination_location_id,
+        movement.movement_type,
+    )
+
+
+def record_movements(movements, day=None):
+    """
+    Add new movements to the daily rollup. Must run inside the posting
+    transaction.
+
+    Movements are first summed per rollup row, then each row is incremented
+    with an F() update, or created if this is its first movement of the day.
+    """
+    day = day or timezone.localdate()
+    totals = defaultdict(lambda: [0, 0])
+    for movement in movements:
+        total = totals[rollup_key(movement, day)]
+        total[0] += 1
+        total[1] += movement.quantity
+
+    for (date, material_id, location_id, movement_type), (count, quantity) in sorted(
+        totals.items(), key=lambda item: (item[0][1], item[0][2] or 0, item[0][3])
+    ):
+        row = MovementDailyRollup.objects.filter(
+            date=date, material_id=material_id, location_id=location_id, movement_type=movement_type
+        )
+        if row.update(count=F('count') + count, quantity=F('quantity') + quantity):
+            continue
+        try:
+            with transaction.atomic():
+                MovementDailyRollup.objects.create(
+                    date=date, material_id=material_id, location_id=location_id,
+                    movement_type=movement_type, count=count, quantity=quantity
+                )
+        except IntegrityError:
+            # A concurrent poster created the row first
+            row.update(count=F('count') + count, quantity=F('quantity') + quantity)
+
+
+def rebuild_rollups(since=None):
+    """
+    Recompute the rollup from the movement ledger, from ``since`` (a date)
+    onwards or entirely. Returns the number of rollup rows written.
+    """
+    movements = StockMovement.objects.all()
+    if since is not None:
+        movements = movements.filter(created_at__date__gte=since)
+    rows = (
+        movements.annotate(
+            day=TruncDate('created_at'),
+            rollup_location=Coalesce('source_location_id', 'destination_location_id')
+        )
+        .values('day', 'material_id', 'rollup_location', 'movement_type')
+        .annotate(movement_count=Count('pk'), total=Sum('quantity'))
+        .order_by()
+    )
+    with transaction.atomic():
+        stale = MovementDailyRollup.objects.all()
+        if since is not None:
+            stale = stale.filter(date__gte=since)
+        stale.delete()
+        return len(MovementDailyRollup.objects.bulk_create(
+            (
+                MovementDailyRollup(
+                    date=row['day'],
+                    material_id=row['material_id'],
+                    location_id=row['rollup_location'],
+                    movement_type=row['movement_type'],
+                    count=row['movement_count'],
+                    quantity=row['total']
+                )
+                for row in rows.iterator()
+            ),
+            batch_size=1000
+        ))
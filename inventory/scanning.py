@@ -0,0 +1,135 @@
+from django.core.cache import cache
+from django.db import transaction
+from .changes import cache_generation
+from .models import RawMaterial, ScanCode, Stock, StockMovement, StorageLocation
+
+# Seconds a resolved scan stays cached; any stock change invalidates it sooner
+SCAN_CACHE_TIMEOUT = 300
+REBUILD_CHUNK = 5000
+# Entity link of each kind of index row
+LINKS = {'material': 'material', 'batch': 'stock', 'movement': 'movement', 'location': 'location'}
+
+
+def index_stock(stocks):
+    """Index the batch numbers of newly created stock rows"""
+    ScanCode.objects.bulk_create([
+        ScanCode(code=stock.batch_number, kind='batch', stock_id=stock.pk) for stock in stocks
+    ])
+
+
+def index_movements(movements):
+    """Index the reference numbers of newly posted movements"""
+    ScanCode.objects.bulk_create([
+        ScanCode(code=movement.reference_number, kind='movement', movement_id=movement.pk)
+        for movement in movements
+    ])
+
+
+def reindex(kind, instance, code):
+    """Point the entity's index row at its current code, or drop it when it has none"""
+    rows = ScanCode.objects.filter(**{LINKS[kind]: instance})
+    if not code:
+        rows.delete()
+    elif not rows.update(code=code):
+        ScanCode.objects.create(code=code, kind=kind, **{LINKS[kind]: instance})
+
+
+def _material_payload(material):
+    return {
+        'id': material.pk,
+        'code': material.code,
+        'name': material.name,
+        'unit': material.unit,
+        'on_hand': material.on_hand,
+        'reorder_point': material.reorder_point,
+    }
+
+
+def _location_payload(location):
+    return {
+        'id': location.pk,
+        'name': location.name,
+        'barcode': location.barcode,
+        'warehouse': location.warehouse_id,
+        'capacity': location.capacity,
+        'current_volume': location.current_volume,
+        'free_volume': location.capacity - location.current_volume,
+    }
+
+
+def _payload(entry):
+    if entry.kind == 'material':
+        return _material_payload(entry.material)
+    if entry.kind == 'batch':
+        stock = entry.stock
+        return {
+            'id': stock.pk,
+            'batch_number': stock.batch_number,
+            'quantity': stock.quantity,
+            'expiry_date': stock.expiry_date,
+            'material': _material_payload(stock.material),
+            'location': _location_payload(stock.location),
+        }
+    if entry.kind == 'movement':
+        movement = entry.movement
+        return {
+            'id': movement.pk,
+            'reference_number': movement.reference_number,
+            'movement_type': movement.movement_type,
+            'quantity': movement.quantity,
+            'batch_number': movement.batch_number,
+            'source_location': movement.source_location_id,
+            'destination_location': movement.destination_location_id,
+            'created_at': movement.created_at,
+            'material': _material_payload(movement.material),
+        }
+    return _location_payload(entry.location)
+
+
+def resolve_scan(code):
+    """
+    Every entity a scanned code names, with current quantities.
+
+    A cache hit costs no query; a miss reads the index and the entities
+    behind it in one joined query. Cached results are keyed by the stock
+    cache generation, so any stock change retires them.
+    """
+    key = f'scan:{cache_generation()}:{code}'
+    matches = cache.get(key)
+    if matches is None:
+        entries = (
+            ScanCode.objects.filter(code=code)
+            .select_related(
+                'material', 'stock__material', 'stock__location',
+                'movement__material', 'location'
+            )
+            .order_by('kind', 'pk')
+        )
+        matches = [{'kind': entry.kind, entry.kind: _payload(entry)} for entry in entries]
+        cache.set(key, matches, SCAN_CACHE_TIMEOUT)
+    return matches
+
+
+def rebuild_scan_index():
+    """Recreate the whole index from the entity tables; returns the row count"""
+    sources = [
+        ('material', RawMaterial.objects.values_list('pk', 'code')),
+        ('batch', Stock.objects.values_list('pk', 'batch_number')),
+        ('movement', StockMovement.objects.values_list('pk', 'reference_number')),
+        ('location', StorageLocation.objects.exclude(barcode=None).values_list('pk', 'barcode')),
+    ]
+    total = 0
+    with transaction.atomic():
+        ScanCode.objects.all().delete()
+        for kind, rows in sources:
+            # Written in chunks so a large movement ledger is never in memory whole
+            pending = []
+            for pk, code in rows.iterator(chunk_size=REBUILD_CHUNK):
+                pending.append(ScanCode(code=code, kind=kind, **{f'{LINKS[kind]}_id': pk}))
+                if len(pending) == REBUILD_CHUNK:
+                    ScanCode.objects.bulk_create(pending)
+                    total += len(pending)
+                    pending = []
+            ScanCode.objects.bulk_create(pending)
+            total += len(pending)
+    return total
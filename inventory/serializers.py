@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from .models import (
     Supplier, Warehouse, StorageLocation,
-    RawMaterial, Stock, StockMovement
+    RawMaterial, Stock, StockMovement, ReorderCandidate, ReplenishmentPlan,
+    MaterialClassification, SlottingProposal, CycleCount, CycleCountLine,
+    TransferDocument, TransferDocumentLine, MaterialReservation
 )
+from .services import BULK_MAX_LINES
 
 class SupplierSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,10 +24,15 @@ class StorageLocationSerializer(serializers.ModelSerializer):
         return (obj.current_volume / obj.capacity * 100) if obj.capacity else 0
 
 class WarehouseSerializer(serializers.ModelSerializer):
+    utilization = serializers.SerializerMethodField()
+
     class Meta:
         model = Warehouse
         fields = '__all__'
 
+    def get_utilization(self, obj):
+        return obj.get_current_utilization()
+
 class WarehouseDetailSerializer(serializers.ModelSerializer):
     storage_locations = StorageLocationSerializer(many=True, read_only=True)
     utilization = serializers.SerializerMethodField()
@@ -39,6 +47,7 @@ class WarehouseDetailSerializer(serializers.ModelSerializer):
 
 class RawMaterialSerializer(serializers.ModelSerializer):
     current_stock = serializers.IntegerField(read_only=True)
+    available = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
     stock_value = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
@@ -67,6 +76,9 @@ class RawMaterialDetailSerializer(serializers.ModelSerializer):
         ]
 
     def get_recent_movements(self, obj):
+        movements = getattr(obj, 'recent_movement_list', None)
+        if movements is None:
+            movements = obj.movements.order_by('-created_at')[:5]
         return [
             {
                 'date': movement.created_at,
@@ -74,7 +86,7 @@ class RawMaterialDetailSerializer(serializers.ModelSerializer):
                 'quantity': movement.quantity,
                 'reference': movement.reference_number
             }
-            for movement in obj.movements.order_by('-created_at')[:5]
+            for movement in movements
         ]
 
 class StockSerializer(serializers.ModelSerializer):
@@ -95,3 +107,137 @@ class StockMovementSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockMovement
         fields = '__all__'
+        read_only_fields = ['value']
+
+class MaterialReservationSerializer(serializers.ModelSerializer):
+    material_name = serializers.CharField(source='material.name', read_only=True)
+    batch_number = serializers.CharField(source='stock.batch_number', read_only=True)
+
+    class Meta:
+        model = MaterialReservation
+        fields = '__all__'
+
+class ReorderCandidateSerializer(serializers.ModelSerializer):
+    material_name = serializers.CharField(source='material.name', read_only=True)
+    material_code = serializers.CharField(source='material.code', read_only=True)
+    unit = serializers.CharField(source='material.unit', read_only=True)
+
+    class Meta:
+        model = ReorderCandidate
+        fields = '__all__'
+
+class ReplenishmentPlanSerializer(serializers.ModelSerializer):
+    material_name = serializers.CharField(source='material.name', read_only=True)
+    material_code = serializers.CharField(source='material.code', read_only=True)
+    unit = serializers.CharField(source='material.unit', read_only=True)
+
+    class Meta:
+        model = ReplenishmentPlan
+        fields = '__all__'
+
+class MaterialClassificationSerializer(serializers.ModelSerializer):
+    material_name = serializers.CharField(source='material.name', read_only=True)
+    material_code = serializers.CharField(source='material.code', read_only=True)
+
+    class Meta:
+        model = MaterialClassification
+        fields = '__all__'
+
+class SlottingProposalSerializer(serializers.ModelSerializer):
+    material_name = serializers.CharField(source='material.name', read_only=True)
+    from_location_name = serializers.CharField(source='from_location.name', read_only=True)
+    to_location_name = serializers.CharField(source='to_location.name', read_only=True)
+    to_location_rank = serializers.IntegerField(source='to_location.accessibility_rank', read_only=True)
+
+    class Meta:
+        model = SlottingProposal
+        fields = '__all__'
+
+class CycleCountLineSerializer(serializers.ModelSerializer):
+    material_code = serializers.CharField(source='material.code', read_only=True)
+    material_name = serializers.CharField(source='material.name', read_only=True)
+    location_name = serializers.CharField(source='location.name', read_only=True)
+
+    class Meta:
+        model = CycleCountLine
+        exclude = ['count']
+
+class CycleCountSerializer(serializers.ModelSerializer):
+    warehouse_name = serializers.CharField(source='warehouse.name', read_only=True)
+    line_count = serializers.IntegerField(read_only=True)
+    counted_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = CycleCount
+        fields = '__all__'
+
+class CycleCountDetailSerializer(CycleCountSerializer):
+    lines = CycleCountLineSerializer(many=True, read_only=True)
+
+class TransferDocumentLineSerializer(serializers.ModelSerializer):
+    material_code = serializers.CharField(source='material.code', read_only=True)
+    source_location_name = serializers.CharField(source='source_location.name', read_only=True)
+    destination_location_name = serializers.CharField(source='destination_location.name', read_only=True)
+
+    class Meta:
+        model = TransferDocumentLine
+        exclude = ['document']
+
+class TransferDocumentSerializer(serializers.ModelSerializer):
+    lines = TransferDocumentLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = TransferDocument
+        fields = '__all__'
+
+class PutawayRequestSerializer(serializers.Serializer):
+    material = serializers.PrimaryKeyRelatedField(queryset=RawMaterial.objects.all())
+    quantity = serializers.IntegerField(min_value=1)
+    warehouse = serializers.PrimaryKeyRelatedField(queryset=Warehouse.objects.filter(active=True))
+    location_types = serializers.ListField(
+        child=serializers.ChoiceField(choices=StorageLocation.LOCATION_TYPES),
+        required=False
+    )
+    temperature_controlled = serializers.BooleanField(required=False, allow_null=True, default=None)
+
+
+class AllocationRequestSerializer(serializers.Serializer):
+    material = serializers.PrimaryKeyRelatedField(queryset=RawMaterial.objects.all())
+    quantity = serializers.IntegerField(min_value=1)
+    warehouse = serializers.PrimaryKeyRelatedField(queryset=Warehouse.objects.filter(active=True))
+    strategy = serializers.ChoiceField(choices=[('fefo', 'FEFO'), ('fifo', 'FIFO')], default='fefo')
+    reference_number = serializers.CharField(max_length=40)
+    include_expired = serializers.BooleanField(default=False)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class CycleCountScheduleSerializer(serializers.Serializer):
+    warehouse = serializers.PrimaryKeyRelatedField(queryset=Warehouse.objects.filter(active=True))
+    scheduled_for = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=5000, required=False)
+
+
+class CountEntrySerializer(serializers.Serializer):
+    line = serializers.IntegerField()
+    counted_quantity = serializers.IntegerField(min_value=0)
+
+
+class CountSubmissionSerializer(serializers.Serializer):
+    counts = CountEntrySerializer(many=True, allow_empty=False, max_length=5000)
+
+
+class TransferLineRequestSerializer(serializers.Serializer):
+    # Plain ids: existence is checked by the bulk posting snapshot, not per line
+    material = serializers.IntegerField()
+    source_location = serializers.IntegerField()
+    destination_location = serializers.IntegerField()
+    batch_number = serializers.CharField(max_length=50)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class TransferRequestSerializer(serializers.Serializer):
+    document_number = serializers.CharField(max_length=40)
+    source_warehouse = serializers.PrimaryKeyRelatedField(queryset=Warehouse.objects.filter(active=True))
+    destination_warehouse = serializers.PrimaryKeyRelatedField(queryset=Warehouse.objects.filter(active=True))
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+    lines = TransferLineRequestSerializer(many=True, allow_empty=False, max_length=BULK_MAX_LINES)
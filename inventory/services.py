@@ -0,0 +1,813 @@
+import datetime
+import itertools
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .changes import bump_version_on_commit
+from .models import (
+    RawMaterial, Stock, StockMovement, StorageLocation, TransferDocument, TransferDocumentLine, Warehouse
+)
+from .putaway import free_capacity_index
+from .reorder import update_reorder_flags
+from .rollups import record_movements
+from .scanning import index_movements, index_stock
+from .valuation import value_movements
+
+# Movement types that only add stock at the destination location
+INBOUND_TYPES = ('receipt', 'return')
+
+
+def movement_legs(movement, strict=True):
+    """
+    Split a movement into (location_id, signed quantity) legs.
+
+    Adjustments carry an unsigned quantity, so their direction comes from the
+    location they name: a destination adds stock, a source removes it.
+    With ``strict=False`` (used when replaying history) legs whose location
+    has since been deleted are dropped instead of rejected.
+    """
+    quantity = movement.quantity
+    if movement.movement_type in INBOUND_TYPES:
+        legs = [(movement.destination_location_id, quantity)]
+    elif movement.movement_type == 'issue':
+        legs = [(movement.source_location_id, -quantity)]
+    elif movement.movement_type == 'transfer':
+        if strict and movement.source_location_id == movement.destination_location_id:
+            raise ValidationError("Transfer source and destination must differ")
+        legs = [
+            (movement.source_location_id, -quantity),
+            (movement.destination_location_id, quantity),
+        ]
+    elif movement.movement_type == 'adjustment':
+        if strict and bool(movement.source_location_id) == bool(movement.destination_location_id):
+            raise ValidationError(
+                "Adjustments need exactly one location: a destination to add "
+                "stock or a source to remove it"
+            )
+        if movement.destination_location_id:
+            legs = [(movement.destination_location_id, quantity)]
+        else:
+            legs = [(movement.source_location_id, -quantity)]
+    else:
+        raise ValidationError(f"Unknown movement type {movement.movement_type}")
+
+    if not strict:
+        return [(location_id, delta) for location_id, delta in legs if location_id is not None]
+    if any(location_id is None for location_id, _ in legs):
+        raise ValidationError(
+            f"A {movement.movement_type} movement needs "
+            f"{'a source and a destination' if len(legs) > 1 else 'a location'}"
+        )
+    return legs
+
+
+def apply_volume_deltas(deltas, warehouse_ids=None):
+    """
+    Add signed volume changes to locations and their warehouses.
+
+    ``deltas`` maps location id to volume; ``warehouse_ids`` maps location id
+    to warehouse id and is looked up when not given. Locations are updated
+    in the current transaction (posters already hold their row locks), in
+    primary-key order. Warehouse totals are shared by every location in the
+    warehouse, so they are updated after commit instead, to keep postings
+    from queuing on the warehouse row; the volume verifier repairs a delta
+    lost between commit and that update.
+    """
+    deltas = {location_id: delta for location_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if warehouse_ids is None:
+        warehouse_ids = dict(
+            StorageLocation.objects.filter(pk__in=deltas).values_list('pk', 'warehouse_id')
+        )
+    warehouse_deltas = {}
+    for location_id in sorted(deltas):
+        StorageLocation.objects.filter(pk=location_id).update(
+            current_volume=F('current_volume') + deltas[location_id]
+        )
+        warehouse_id = warehouse_ids.get(location_id)
+        if warehouse_id is not None:
+            warehouse_deltas[warehouse_id] = warehouse_deltas.get(warehouse_id, 0) + deltas[location_id]
+
+    def apply_warehouse_deltas():
+        for warehouse_id in sorted(warehouse_deltas):
+            if warehouse_deltas[warehouse_id]:
+                Warehouse.objects.filter(pk=warehouse_id).update(
+                    current_volume=F('current_volume') + warehouse_deltas[warehouse_id]
+                )
+
+    location_ids = sorted(deltas)
+    transaction.on_commit(apply_warehouse_deltas)
+    transaction.on_commit(lambda: free_capacity_index.refresh(location_ids))
+
+
+def find_volume_drift():
+    """
+    Compare maintained volumes with a fresh aggregation over all stock.
+
+    Returns ``(locations, warehouses)``, each a list of
+    (pk, recorded, actual) for the rows that differ.
+    """
+    actual = dict(
+        Stock.objects.values('location_id')
+        .annotate(total=Sum(F('quantity') * F('material__volume_per_unit')))
+        .values_list('location_id', 'total')
+    )
+    locations = []
+    warehouse_actual = {}
+    for pk, warehouse_id, recorded in StorageLocation.objects.values_list(
+        'pk', 'warehouse_id', 'current_volume'
+    ).iterator():
+        volume = actual.get(pk) or Decimal(0)
+        warehouse_actual[warehouse_id] = warehouse_actual.get(warehouse_id, 0) + volume
+        if recorded != volume:
+            locations.append((pk, recorded, volume))
+    warehouses = [
+        (pk, recorded, warehouse_actual.get(pk, Decimal(0)))
+        for pk, recorded in Warehouse.objects.values_list('pk', 'current_volume')
+        if recorded != warehouse_actual.get(pk, Decimal(0))
+    ]
+    return locations, warehouses
+
+
+def repair_volume_drift(locations, warehouses):
+    """Re-aggregate the drifted rows found by find_volume_drift"""
+    zero = Value(0, output_field=DecimalField(max_digits=12, decimal_places=3))
+    with transaction.atomic():
+        # Recompute inside the UPDATE so stock moved since the scan is not
+        # overwritten with a stale total.
+        StorageLocation.objects.filter(pk__in=[row[0] for row in locations]).update(
+            current_volume=Coalesce(Subquery(
+                Stock.objects.filter(location=OuterRef('pk'))
+                .values('location')
+                .annotate(total=Sum(F('quantity') * F('material__volume_per_unit')))
+                .values('total')
+            ), zero)
+        )
+        Warehouse.objects.filter(
+            pk__in={row[0] for row in warehouses}
+            | set(
+                StorageLocation.objects.filter(pk__in=[row[0] for row in locations])
+                .values_list('warehouse_id', flat=True)
+            )
+        ).update(
+            current_volume=Coalesce(Subquery(
+                StorageLocation.objects.filter(warehouse=OuterRef('pk'))
+                .values('warehouse')
+                .annotate(total=Sum('current_volume'))
+                .values('total')
+            ), zero)
+        )
+    location_ids = [row[0] for row in locations]
+    transaction.on_commit(lambda: free_capacity_index.refresh(location_ids))
+
+
+def _create_or_lock_stock(material, location_id, batch_number, quantity, expiry_date=None):
+    """
+    Insert a new stock row holding ``quantity``. If a concurrent poster created
+    the row first, lock and return it so the caller can add to it instead.
+    """
+    try:
+        with transaction.atomic():
+            index_stock(Stock.objects.bulk_create([
+                Stock(
+                    material=material,
+                    location_id=location_id,
+                    batch_number=batch_number,
+                    quantity=quantity,
+                    expiry_date=expiry_date
+                )
+            ]))
+        return None
+    except IntegrityError:
+        return Stock.objects.select_for_update().get(
+            material=material,
+            location_id=location_id,
+            batch_number=batch_number
+        )
+
+
+def apply_movement(movement):
+    """
+    Apply a new movement's stock effects. Must run inside a transaction.
+
+    Every touched StorageLocation row, then every touched Stock row, is locked
+    in primary-key order before anything is read, so concurrent posters
+    against the same batch queue up instead of losing updates and cannot
+    deadlock on each other. Quantities are changed with F() expressions.
+    """
+    legs = movement_legs(movement)
+    location_ids = sorted({location_id for location_id, _ in legs})
+    material = movement.material
+
+    locations = {
+        location.pk: location
+        for location in StorageLocation.objects.select_for_update()
+        .filter(pk__in=location_ids).order_by('pk')
+    }
+    stocks = {
+        stock.location_id: stock
+        for stock in Stock.objects.select_for_update()
+        .filter(
+            material=material,
+            batch_number=movement.batch_number,
+            location_id__in=location_ids
+        ).order_by('location_id')
+    }
+
+    for location_id, delta in legs:
+        location = locations.get(location_id)
+        if location is None:
+            raise ValidationError(f"Storage location {location_id} does not exist")
+        if delta < 0:
+            stock = stocks.get(location_id)
+            if stock is None:
+                raise ValidationError(
+                    f"No stock found for {material} at {location} "
+                    f"with batch number {movement.batch_number}"
+                )
+            if stock.quantity < -delta:
+                raise ValidationError(
+                    f"Insufficient stock at {location}. "
+                    f"Available: {stock.quantity}, Required: {-delta}"
+                )
+        else:
+            required_volume = delta * material.volume_per_unit
+            if not location.is_available(required_volume):
+                raise ValidationError(
+                    f"Destination location {location} does not have "
+                    f"enough space for {delta} units"
+                )
+
+    # A batch keeps its expiry date wherever it is moved to
+    expiry_date = next((stock.expiry_date for stock in stocks.values() if stock.expiry_date), None)
+    emptied = []
+    for location_id, delta in legs:
+        stock = stocks.get(location_id)
+        if stock is None:
+            stock = _create_or_lock_stock(material, location_id, movement.batch_number, delta, expiry_date)
+            if stock is None:
+                continue
+        Stock.objects.filter(pk=stock.pk).update(quantity=F('quantity') + delta, updated_at=timezone.now())
+        if stock.quantity + delta == 0:
+            emptied.append(stock.pk)
+
+    if emptied:
+        Stock.objects.filter(pk__in=emptied, quantity=0).delete()
+
+    net = sum(delta for _, delta in legs)
+    value_movements([(movement, net)])
+    record_movements([movement])
+    if net:
+        RawMaterial.objects.filter(pk=material.pk).update(on_hand=F('on_hand') + net)
+        update_reorder_flags([material.pk])
+
+    apply_volume_deltas(
+        {location_id: delta * material.volume_per_unit for location_id, delta in legs},
+        {pk: location.warehouse_id for pk, location in locations.items()}
+    )
+    bump_version_on_commit()
+
+
+def post_movement(**fields):
+    """Create and post a stock movement atomically"""
+    movement = StockMovement(**fields)
+    movement.save()
+    return movement
+
+
+STOCK_EDIT_FIELDS = ('expiry_date', 'notes', 'last_counted_at')
+
+
+def adjust_stock_to(material, location_id, batch_number, quantity, performed_by=None, notes=''):
+    """
+    Bring a batch's quantity at a location to ``quantity`` by posting the
+    difference as an adjustment. Returns the movement, or None if the
+    quantity was already right.
+    """
+    with transaction.atomic():
+        # Same lock order as posting: the location, then its stock row
+        list(StorageLocation.objects.select_for_update().filter(pk=location_id).values_list('pk', flat=True))
+        current = Stock.objects.select_for_update().filter(
+            material=material, location_id=location_id, batch_number=batch_number
+        ).values_list('quantity', flat=True).first() or 0
+        delta = quantity - current
+        if not delta:
+            return None
+        location = 'destination_location_id' if delta > 0 else 'source_location_id'
+        return post_movement(
+            material=material,
+            movement_type='adjustment',
+            quantity=abs(delta),
+            batch_number=batch_number,
+            reference_number=f"ADJ-{uuid.uuid4().hex[:12].upper()}",
+            performed_by=performed_by,
+            notes=notes or 'Stock record edited',
+            **{location: location_id}
+        )
+
+
+def save_stock_edit(stock, performed_by=None):
+    """
+    Save a stock record edited by hand (admin, stock API). A new or changed
+    quantity is posted as an adjustment, so on_hand, the inventory value
+    and the movement ledger follow it; only STOCK_EDIT_FIELDS are saved
+    directly. Moving a record to another material, location or batch is
+    refused: that is a transfer. Returns the saved record, or None if the
+    adjustment emptied it.
+    """
+    with transaction.atomic():
+        if stock.pk:
+            stored = Stock.objects.filter(pk=stock.pk).values('material_id', 'location_id', 'batch_number').first()
+            key = {'material_id': stock.material_id, 'location_id': stock.location_id, 'batch_number': stock.batch_number}
+            if stored is not None and stored != key:
+                raise ValidationError(
+                    "A stock record's material, location and batch cannot be changed; post a transfer instead"
+                )
+        elif not stock.quantity:
+            raise ValidationError("A new stock record needs a quantity")
+        adjust_stock_to(stock.material, stock.location_id, stock.batch_number, stock.quantity, performed_by)
+        saved = Stock.objects.filter(
+            material_id=stock.material_id, location_id=stock.location_id, batch_number=stock.batch_number
+        ).first()
+        if saved is None:
+            return None
+        for field in STOCK_EDIT_FIELDS:
+            setattr(saved, field, getattr(stock, field))
+        saved.save(update_fields=[*STOCK_EDIT_FIELDS, 'updated_at'])
+        return saved
+
+
+def delete_stock_record(stock, performed_by=None):
+    """Write a stock record off with an adjustment to zero, which removes it"""
+    with transaction.atomic():
+        adjust_stock_to(
+            stock.material, stock.location_id, stock.batch_number, 0, performed_by,
+            notes='Stock record deleted'
+        )
+        Stock.objects.filter(pk=stock.pk).delete()
+
+
+BULK_MAX_LINES = 10000
+
+
+def _parse_bulk_line(row):
+    """Turn one raw JSON/CSV line into StockMovement field values"""
+    # Lines that are not objects report that alone, not every missing field
+    shaped = isinstance(row, dict)
+    if not shaped:
+        row = {}
+    errors = [] if shaped else ["Each line must be an object of movement fields"]
+
+    def text(name):
+        value = row.get(name)
+        return '' if value is None else str(value).strip()
+
+    def optional_id(name):
+        value = row.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            errors.append(f"{name} must be an id")
+            return None
+
+    if shaped and row.get('material') in (None, ''):
+        errors.append("material is required")
+    material_id = optional_id('material')
+
+    movement_type = text('movement_type')
+    if shaped and movement_type not in dict(StockMovement.MOVEMENT_TYPES):
+        errors.append(f"Unknown movement type {movement_type!r}")
+
+    try:
+        quantity = int(row.get('quantity'))
+        if quantity <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        quantity = None
+        if shaped:
+            errors.append("quantity must be a positive integer")
+
+    batch_number = text('batch_number')
+    reference_number = text('reference_number')
+    if shaped and not batch_number:
+        errors.append("batch_number is required")
+    if shaped and not reference_number:
+        errors.append("reference_number is required")
+
+    expiry_date = row.get('expiry_date') or None
+    if expiry_date:
+        try:
+            expiry_date = datetime.date.fromisoformat(str(expiry_date))
+        except ValueError:
+            errors.append("expiry_date must be YYYY-MM-DD")
+
+    unit_cost = row.get('unit_cost')
+    if unit_cost in (None, ''):
+        unit_cost = None
+    else:
+        try:
+            unit_cost = Decimal(str(unit_cost))
+            if unit_cost < 0 or not unit_cost.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            unit_cost = None
+            errors.append("unit_cost must be a non-negative number")
+
+    client_id = row.get('client_id')
+    if client_id in (None, ''):
+        client_id = None
+    else:
+        try:
+            client_id = uuid.UUID(str(client_id))
+        except ValueError:
+            client_id = None
+            errors.append("client_id must be a UUID")
+
+    fields = {
+        'material_id': material_id,
+        'movement_type': movement_type,
+        'quantity': quantity,
+        'batch_number': batch_number,
+        'reference_number': reference_number,
+        'unit_cost': unit_cost,
+        'source_location_id': optional_id('source_location'),
+        'destination_location_id': optional_id('destination_location'),
+        'notes': text('notes'),
+        'client_id': client_id,
+    }
+    return fields, expiry_date, errors
+
+
+def post_movements_bulk(rows, atomic=True, performed_by=None):
+    """
+    Validate and post many movements against one locked snapshot.
+
+    All affected StorageLocation and Stock rows are fetched (and locked) up
+    front, every line is checked against an in-memory copy of that snapshot
+    in file order, and the accepted lines are written with bulk_create /
+    bulk_update. Each touched location's volume is recomputed once.
+
+    With ``atomic`` any rejected line rejects the whole file; otherwise the
+    valid lines are committed and the rest reported. Returns
+    ``(committed, results)`` where results has one entry per input line.
+    """
+    parsed = [_parse_bulk_line(row) for row in itertools.islice(rows, BULK_MAX_LINES + 1)]
+    if len(parsed) > BULK_MAX_LINES:
+        raise ValidationError(f"At most {BULK_MAX_LINES} lines can be posted per request")
+
+    material_ids = {fields['material_id'] for fields, _, _ in parsed if fields['material_id']}
+    location_ids = {
+        location_id
+        for fields, _, _ in parsed
+        for location_id in (fields['source_location_id'], fields['destination_location_id'])
+        if location_id
+    }
+    batch_numbers = {fields['batch_number'] for fields, _, _ in parsed}
+    references = [fields['reference_number'] for fields, _, _ in parsed]
+
+    with transaction.atomic():
+        materials = RawMaterial.objects.in_bulk(material_ids)
+        locations = {
+            location.pk: location
+            for location in StorageLocation.objects.select_for_update()
+            .filter(pk__in=location_ids).order_by('pk')
+        }
+        stocks = {
+            (stock.material_id, stock.location_id, stock.batch_number): stock
+            for stock in Stock.objects.select_for_update()
+            .filter(
+                material_id__in=material_ids,
+                location_id__in=location_ids,
+                batch_number__in=batch_numbers
+            ).order_by('location_id', 'pk')
+        }
+        taken_references = set(
+            StockMovement.objects.filter(reference_number__in=references)
+            .values_list('reference_number', flat=True)
+        )
+
+        quantities = {key: stock.quantity for key, stock in stocks.items()}
+        free_volume = {pk: location.capacity - location.current_volume for pk, location in locations.items()}
+        expiry_dates = {}
+        volume_deltas = {}
+        accepted = []
+        results = []
+
+        for line, (fields, expiry_date, errors) in enumerate(parsed, start=1):
+            errors = list(errors)
+            material = materials.get(fields['material_id'])
+            if fields['material_id'] and material is None:
+                errors.append(f"Material {fields['material_id']} does not exist")
+            if fields['reference_number'] in taken_references:
+                errors.append(f"Reference number {fields['reference_number']} already exists")
+
+            movement = StockMovement(performed_by=performed_by, **fields)
+            legs = []
+            if not errors:
+                try:
+                    legs = movement_legs(movement)
+                except ValidationError as e:
+                    errors.extend(e.messages)
+
+            pending = {}
+            volume_change = {}
+            for location_id, delta in legs:
+                location = locations.get(location_id)
+                if location is None:
+                    errors.append(f"Storage location {location_id} does not exist")
+                    continue
+                key = (material.pk, location_id, fields['batch_number'])
+                available = pending.get(key, quantities.get(key))
+                if delta < 0 and not available:
+                    errors.append(
+                        f"No stock found for {material} at {location} "
+                        f"with batch number {fields['batch_number']}"
+                    )
+                elif delta < 0 and available < -delta:
+                    errors.append(
+                        f"Insufficient stock at {location}. "
+                        f"Available: {available}, Required: {-delta}"
+                    )
+                volume = delta * material.volume_per_unit
+                if delta > 0 and free_volume[location_id] - volume_change.get(location_id, 0) < volume:
+                    errors.append(
+                        f"Destination location {location} does not have "
+                        f"enough space for {delta} units"
+                    )
+                pending[key] = (available or 0) + delta
+                volume_change[location_id] = volume_change.get(location_id, 0) + volume
+
+            if errors:
+                results.append({'line': line, 'status': 'error', 'errors': errors})
+                continue
+
+            quantities.update(pending)
+            for location_id, volume in volume_change.items():
+                free_volume[location_id] -= volume
+                volume_deltas[location_id] = volume_deltas.get(location_id, 0) + volume
+            if expiry_date:
+                for key in pending:
+                    expiry_dates.setdefault(key, expiry_date)
+            taken_references.add(fields['reference_number'])
+            accepted.append((line, movement, legs))
+            results.append({'line': line, 'status': 'accepted'})
+
+        if not accepted or (atomic and len(accepted) != len(parsed)):
+            return False, results
+
+        value_movements([
+            (movement, sum(delta for _, delta in legs)) for _, movement, legs in accepted
+        ])
+        record_movements([movement for _, movement, _ in accepted])
+        created = StockMovement.objects.bulk_create([movement for _, movement, _ in accepted])
+        index_movements(created)
+        by_line = {line: movement.pk for (line, _, _), movement in zip(accepted, created)}
+        for result in results:
+            if result['line'] in by_line:
+                result.update(status='posted', id=by_line[result['line']])
+
+        # New rows of a batch already held somewhere keep that batch's expiry date
+        batch_expiry = {
+            (material_id, batch_number): expiry_date
+            for (material_id, _, batch_number), expiry_date in expiry_dates.items()
+        }
+        for stock in stocks.values():
+            if stock.expiry_date:
+                batch_expiry.setdefault((stock.material_id, stock.batch_number), stock.expiry_date)
+
+        now = timezone.now()
+        changed, new_stock, emptied = [], [], []
+        for key, quantity in quantities.items():
+            stock = stocks.get(key)
+            if stock is None:
+                if quantity:
+                    material_id, location_id, batch_number = key
+                    new_stock.append(Stock(
+                        material_id=material_id,
+                        location_id=location_id,
+                        batch_number=batch_number,
+                        quantity=quantity,
+                        expiry_date=expiry_dates.get(key) or batch_expiry.get((material_id, batch_number))
+                    ))
+            elif stock.quantity != quantity:
+                stock.quantity = quantity
+                stock.updated_at = now
+                changed.append(stock)
+                if quantity == 0:
+                    emptied.append(stock.pk)
+
+        Stock.objects.bulk_update(changed, ['quantity', 'updated_at'])
+        index_stock(Stock.objects.bulk_create(new_stock))
+        if emptied:
+            Stock.objects.filter(pk__in=emptied, quantity=0).delete()
+
+        net_by_material = {}
+        for _, movement, legs in accepted:
+            net = sum(delta for _, delta in legs)
+            net_by_material[movement.material_id] = net_by_material.get(movement.material_id, 0) + net
+        for material_id, net in net_by_material.items():
+            if net:
+                RawMaterial.objects.filter(pk=material_id).update(on_hand=F('on_hand') + net)
+        update_reorder_flags(material_id for material_id, net in net_by_material.items() if net)
+
+        apply_volume_deltas(
+            volume_deltas,
+            {pk: location.warehouse_id for pk, location in locations.items()}
+        )
+        bump_version_on_commit()
+
+    return True, results
+
+
+def post_transfer_document(document_number, source_warehouse_id, destination_warehouse_id, lines,
+                           performed_by=None, notes=''):
+    """
+    Post a multi-line transfer between two warehouses as one unit.
+
+    ``lines`` are dicts of material, source_location, destination_location,
+    batch_number and quantity. Every line goes through post_movements_bulk,
+    so all source quantities and destination capacities are checked against
+    one locked snapshot and the movements (numbered ``<document_number>-1``,
+    ``-2``, ...) are written with bulk writes; the query count does not grow
+    with the number of lines. Either every line posts or none does.
+    Returns ``(document or None, results)`` with one result per line.
+    """
+    if TransferDocument.objects.filter(document_number=document_number).exists():
+        raise ValidationError(f"Transfer document {document_number} already exists")
+
+    location_warehouses = dict(
+        StorageLocation.objects.filter(pk__in={
+            line[name] for line in lines for name in ('source_location', 'destination_location')
+        }).values_list('pk', 'warehouse_id')
+    )
+    misplaced = {}
+    rows = []
+    for number, line in enumerate(lines, start=1):
+        for name, warehouse_id in (
+            ('source_location', source_warehouse_id),
+            ('destination_location', destination_warehouse_id),
+        ):
+            if location_warehouses.get(line[name], warehouse_id) != warehouse_id:
+                misplaced.setdefault(number, []).append(
+                    f"{name.replace('_', ' ').capitalize()} {line[name]} is not in warehouse {warehouse_id}"
+                )
+        rows.append({
+            'material': line['material'],
+            'movement_type': 'transfer',
+            'quantity': line['quantity'],
+            'batch_number': line['batch_number'],
+            'reference_number': f"{document_number}-{number}",
+            'source_location': line['source_location'],
+            'destination_location': line['destination_location'],
+            'notes': notes or f"Transfer {document_number}",
+        })
+
+    with transaction.atomic():
+        committed, results = post_movements_bulk(rows, atomic=True, performed_by=performed_by)
+        if misplaced:
+            # Undo whatever posted; the other lines are valid but not posted
+            transaction.set_rollback(True)
+            for result in results:
+                result.pop('id', None)
+                if result['line'] in misplaced:
+                    result.update(status='error', errors=result.get('errors', []) + misplaced[result['line']])
+                elif result['status'] == 'posted':
+                    result['status'] = 'accepted'
+            return None, results
+        if not committed:
+            return None, results
+
+        document = TransferDocument.objects.create(
+            document_number=document_number,
+            source_warehouse_id=source_warehouse_id,
+            destination_warehouse_id=destination_warehouse_id,
+            performed_by=performed_by,
+            notes=notes
+        )
+        TransferDocumentLine.objects.bulk_create([
+            TransferDocumentLine(
+                document=document,
+                line_number=result['line'],
+                material_id=line['material'],
+                source_location_id=line['source_location'],
+                destination_location_id=line['destination_location'],
+                batch_number=line['batch_number'],
+                quantity=line['quantity'],
+                movement_id=result['id']
+            )
+            for line, result in zip(lines, results)
+        ])
+    return document, results
+
+
+ALLOCATION_STRATEGIES = ('fefo', 'fifo')
+ALLOCATION_CHUNK = 100
+
+
+def plan_allocation(material, quantity, warehouse_id, strategy='fefo', include_expired=False):
+    """
+    Pick batches to issue ``quantity`` of ``material`` from a warehouse, or
+    from every warehouse if ``warehouse_id`` is None.
+
+    FEFO takes the earliest expiry first (batches without an expiry date
+    last) and breaks ties by age; FIFO goes purely by age. Rows are read in
+    index order a chunk at a time, so only as many batches as needed are
+    fetched. Returns a list of (stock, quantity) pairs, which may cover less
+    than ``quantity`` if the warehouse runs out.
+    """
+    if strategy not in ALLOCATION_STRATEGIES:
+        raise ValidationError(f"Unknown allocation strategy {strategy!r}")
+
+    stocks = Stock.objects.filter(
+        material=material,
+        location__active=True,
+        quantity__gt=0
+    )
+    if warehouse_id is not None:
+        stocks = stocks.filter(location__warehouse_id=warehouse_id)
+    if not include_expired:
+        stocks = stocks.exclude(expiry_date__lt=timezone.localdate())
+    if strategy == 'fefo':
+        stocks = stocks.order_by(F('expiry_date').asc(nulls_last=True), 'created_at', 'pk')
+    else:
+        stocks = stocks.order_by('created_at', 'pk')
+
+    plan = []
+    remaining = quantity
+    offset = 0
+    while remaining > 0:
+        chunk = list(stocks[offset:offset + ALLOCATION_CHUNK])
+        for stock in chunk:
+            take = min(stock.quantity, remaining)
+            plan.append((stock, take))
+            remaining -= take
+            if remaining == 0:
+                break
+        if len(chunk) < ALLOCATION_CHUNK:
+            break
+        offset += ALLOCATION_CHUNK
+    return plan
+
+
+def allocate_issue(material, quantity, warehouse_id, reference_number, strategy='fefo',
+                   include_expired=False, performed_by=None, notes='', max_attempts=3):
+    """
+    Issue ``quantity`` of ``material`` from a warehouse (any warehouse if
+    ``warehouse_id`` is None) across as many batches as needed, chosen by
+    ``strategy``.
+
+    The issue movements (numbered ``<reference_number>-1``, ``-2``, ...) are
+    posted in one transaction, in location order so they take their locks in
+    the same order as every other poster. If a concurrent issue drains a
+    planned batch first, the whole allocation is re-planned.
+    """
+    for attempt in range(max_attempts):
+        plan = plan_allocation(material, quantity, warehouse_id, strategy, include_expired)
+        allocated = sum(take for _, take in plan)
+        if allocated < quantity:
+            where = f" in warehouse {warehouse_id}" if warehouse_id is not None else ""
+            raise ValidationError(
+                f"Insufficient stock of {material}{where}. "
+                f"Available: {allocated}, Required: {quantity}"
+            )
+
+        references = [f"{reference_number}-{number}" for number in range(1, len(plan) + 1)]
+        taken = list(
+            StockMovement.objects.filter(reference_number__in=references)
+            .values_list('reference_number', flat=True)
+        )
+        if taken:
+            raise ValidationError(f"Reference number {taken[0]} already exists")
+
+        lines = sorted(
+            enumerate(plan, start=1),
+            key=lambda line: (line[1][0].location_id, line[1][0].pk)
+        )
+        try:
+            with transaction.atomic():
+                movements = []
+                for number, (stock, take) in lines:
+                    movement = StockMovement(
+                        material=material,
+                        source_location_id=stock.location_id,
+                        movement_type='issue',
+                        quantity=take,
+                        batch_number=stock.batch_number,
+                        reference_number=references[number - 1],
+                        performed_by=performed_by,
+                        notes=notes
+                    )
+                    movement.save()
+                    movements.append((number, movement))
+            return [movement for _, movement in sorted(movements, key=lambda line: line[0])]
+        except ValidationError:
+            if attempt == max_attempts - 1:
+                raise
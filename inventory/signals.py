@@ -1,8 +1,36 @@
 from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
-from .models import Stock, StockMovement, StorageLocation
+from django.db import transaction
+from django.db.models import F
+from .changes import bump_version_on_commit
+from .models import MaterialReservation, RawMaterial, Stock, StockMovement, StorageLocation, Warehouse
+from .putaway import free_capacity_index
+from .reorder import update_reorder_flags
+from .scanning import index_movements, index_stock, reindex
+from .services import apply_volume_deltas
+from .sync import record_tombstone, synced_models
+
+@receiver(post_save, sender=RawMaterial)
+def refresh_reorder_flag(sender, instance, **kwargs):
+    """Re-check the reorder flag when thresholds or status change"""
+    update_reorder_flags([instance.pk])
+
+@receiver(post_save, sender=StorageLocation)
+@receiver(post_delete, sender=StorageLocation)
+def refresh_free_capacity(sender, instance, **kwargs):
+    """Keep the putaway index in step with location capacity and volume"""
+    transaction.on_commit(lambda: free_capacity_index.refresh([instance.pk]))
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+@receiver(post_save, sender=RawMaterial)
+@receiver(post_save, sender=StorageLocation)
+@receiver(post_delete, sender=StorageLocation)
+@receiver(post_save, sender=Warehouse)
+def bump_stock_version(sender, instance, **kwargs):
+    """Invalidate cached stock views such as the stock matrix ETag"""
+    bump_version_on_commit()
 
 @receiver(pre_save, sender=Stock)
 def validate_stock_location(sender, instance, **kwargs):
@@ -15,88 +43,85 @@ def validate_stock_location(sender, instance, **kwargs):
                 f"{instance.quantity} units of {instance.material}"
             )
 
+@receiver(pre_save, sender=Stock)
+def capture_stock_delta(sender, instance, **kwargs):
+    """Record how much this save changes the material's on-hand total"""
+    instance._on_hand_delta = instance.get_quantity_delta()
+
 @receiver(post_save, sender=Stock)
-def update_location_volume(sender, instance, created, **kwargs):
-    """Update storage location volume when stock changes"""
-    location = instance.location
-    total_volume = location.stock_records.aggregate(
-        total=Sum(
-            F('quantity') * F('material__volume_per_unit')
+def update_material_on_hand(sender, instance, **kwargs):
+    """Apply the stock delta to the material's denormalized on-hand total"""
+    delta = getattr(instance, '_on_hand_delta', 0)
+    if delta:
+        RawMaterial.objects.filter(pk=instance.material_id).update(
+            on_hand=F('on_hand') + delta
         )
-    )['total'] or 0
-    
-    location.current_volume = total_volume
-    location.save()
+        update_reorder_flags([instance.material_id])
+    instance._on_hand_delta = 0
+    instance._loaded_quantity = instance.quantity
 
 @receiver(post_delete, sender=Stock)
-def handle_stock_deletion(sender, instance, **kwargs):
-    """Update location volume when stock is deleted"""
-    location = instance.location
-    total_volume = location.stock_records.exclude(
-        pk=instance.pk
-    ).aggregate(
-        total=Sum(
-            F('quantity') * F('material__volume_per_unit')
+def release_material_on_hand(sender, instance, **kwargs):
+    """Remove deleted stock from the material's on-hand total"""
+    loaded = getattr(instance, '_loaded_quantity', instance.quantity)
+    if loaded:
+        RawMaterial.objects.filter(pk=instance.material_id).update(
+            on_hand=F('on_hand') - loaded
         )
-    )['total'] or 0
-    
-    location.current_volume = total_volume
-    location.save()
-
-@receiver(pre_save, sender=StockMovement)
-def validate_stock_movement(sender, instance, **kwargs):
-    """Validate stock movement"""
-    if instance.movement_type == 'transfer':
-        # Check source location has enough stock
-        try:
-            source_stock = Stock.objects.get(
-                material=instance.material,
-                location=instance.source_location,
-                batch_number=instance.batch_number
-            )
-            if source_stock.quantity < instance.quantity:
-                raise ValidationError(
-                    f"Insufficient stock at {instance.source_location}. "
-                    f"Available: {source_stock.quantity}, Required: {instance.quantity}"
-                )
-        except Stock.DoesNotExist:
-            raise ValidationError(
-                f"No stock found for {instance.material} at {instance.source_location} "
-                f"with batch number {instance.batch_number}"
-            )
-        
-        # Check destination location has enough space
-        required_volume = instance.quantity * instance.material.volume_per_unit
-        if not instance.destination_location.is_available(required_volume):
-            raise ValidationError(
-                f"Destination location {instance.destination_location} does not have "
-                f"enough space for {instance.quantity} units"
-            )
-    
-    elif instance.movement_type == 'issue':
-        # Check source location has enough stock
-        try:
-            source_stock = Stock.objects.get(
-                material=instance.material,
-                location=instance.source_location,
-                batch_number=instance.batch_number
-            )
-            if source_stock.quantity < instance.quantity:
-                raise ValidationError(
-                    f"Insufficient stock at {instance.source_location}. "
-                    f"Available: {source_stock.quantity}, Required: {instance.quantity}"
-                )
-        except Stock.DoesNotExist:
-            raise ValidationError(
-                f"No stock found for {instance.material} at {instance.source_location} "
-                f"with batch number {instance.batch_number}"
-            )
-    
-    elif instance.movement_type == 'receipt':
-        # Check destination location has enough space
-        required_volume = instance.quantity * instance.material.volume_per_unit
-        if not instance.destination_location.is_available(required_volume):
-            raise ValidationError(
-                f"Destination location {instance.destination_location} does not have "
-                f"enough space for {instance.quantity} units"
-            )
+        update_reorder_flags([instance.material_id])
+
+@receiver(post_delete, sender=MaterialReservation)
+def release_deleted_reservation(sender, instance, **kwargs):
+    """Deleting an owner cascades to its reservations; stop holding what they held"""
+    if instance.status == 'active' and instance.quantity:
+        RawMaterial.objects.filter(pk=instance.material_id).update(
+            reserved=F('reserved') - instance.quantity
+        )
+
+@receiver(pre_save, sender=Stock)
+def capture_volume_deltas(sender, instance, **kwargs):
+    """Record how much this save changes each location's occupied volume"""
+    instance._volume_deltas = instance.get_volume_deltas()
+
+@receiver(post_save, sender=Stock)
+def update_location_volume(sender, instance, **kwargs):
+    """Apply the stock's volume change to its location and warehouse"""
+    apply_volume_deltas(getattr(instance, '_volume_deltas', {}))
+    instance._volume_deltas = {}
+    instance._loaded_location_id = instance.location_id
+
+@receiver(post_delete, sender=Stock)
+def handle_stock_deletion(sender, instance, **kwargs):
+    """Release the deleted stock's volume"""
+    loaded = getattr(instance, '_loaded_quantity', instance.quantity)
+    location_id = getattr(instance, '_loaded_location_id', instance.location_id)
+    apply_volume_deltas({location_id: -loaded * instance.material.volume_per_unit})
+
+@receiver(post_save, sender=RawMaterial)
+def index_material_code(sender, instance, **kwargs):
+    """Keep the material's code in the scan index"""
+    reindex('material', instance, instance.code)
+
+@receiver(post_save, sender=StorageLocation)
+def index_location_barcode(sender, instance, **kwargs):
+    """Keep the location's barcode in the scan index"""
+    reindex('location', instance, instance.barcode)
+
+@receiver(post_save, sender=Stock)
+def index_batch_number(sender, instance, created, **kwargs):
+    """Keep the batch number in the scan index"""
+    if created:
+        index_stock([instance])
+    else:
+        reindex('batch', instance, instance.batch_number)
+
+@receiver(post_save, sender=StockMovement)
+def index_reference_number(sender, instance, created, **kwargs):
+    """Index the reference number of a newly posted movement"""
+    if created:
+        index_movements([instance])
+
+for synced_model in synced_models():
+    post_delete.connect(
+        record_tombstone, sender=synced_model, dispatch_uid=f'sync-tombstone-{synced_model._meta.label_lower}'
+    )
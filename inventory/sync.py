@@ -0,0 +1,212 @@
+import datetime
+import uuid
+from django.apps import apps
+from django.core import signing
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import StockMovement, SyncTombstone
+from .services import post_movements_bulk
+
+# Models offline clients mirror, in the order a sync walks them
+SYNCED_MODELS = [
+    'inventory.Warehouse',
+    'inventory.StorageLocation',
+    'inventory.RawMaterial',
+    'inventory.Stock',
+    'production.ProductionLine',
+    'production.ProductionOrder',
+    'production.ProductionBatch',
+]
+# Rows per sync page
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+# How far back each sync re-reads, so rows committed late by long
+# transactions are not skipped; clients upsert, so repeats are harmless
+SYNC_OVERLAP = datetime.timedelta(seconds=30)
+# Tombstones are kept this long; older tokens must start a full sync
+TOMBSTONE_RETENTION = datetime.timedelta(days=30)
+TOKEN_SALT = 'inventory.sync'
+# Times a replay re-checks client_ids after losing an insert race
+REPLAY_ATTEMPTS = 3
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def synced_models():
+    return [apps.get_model(label) for label in SYNCED_MODELS]
+
+
+def model_label(model):
+    return model._meta.label_lower
+
+
+def synced_fields(model):
+    """
+    Columns sent for a model, foreign keys as ids. Totals maintained by
+    F() updates are left out: they change without touching updated_at, and
+    clients derive them from the rows they hold.
+    """
+    maintained = getattr(model, 'MAINTAINED_FIELDS', ())
+    return [field for field in model._meta.concrete_fields if field.name not in maintained]
+
+
+def encode_token(state):
+    return signing.dumps(state, salt=TOKEN_SALT, compress=True)
+
+
+def decode_token(token):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        raise InvalidToken("Unknown sync token; start over without one")
+
+
+def _keyset(queryset, time_field, after):
+    if not after:
+        return queryset
+    moment, pk = parse_datetime(after[0]), after[1]
+    return queryset.filter(Q(**{f'{time_field}__gt': moment}) | Q(**{time_field: moment, 'pk__gt': pk}))
+
+
+def sync_changes(token=None, limit=SYNC_PAGE_SIZE):
+    """
+    One page of the rows changed since ``token``.
+
+    A sync walks every synced model, then the tombstones, in
+    (updated_at, id) order, so each step is a range scan on that index.
+    The window is fixed when a sync starts; rows changed while it pages
+    through are picked up by the next one. Without a token every row is
+    sent and no tombstones. Returns ``(changes, deleted, next token, more)``.
+    """
+    state = decode_token(token) if token else {'since': None}
+    if not state.get('until'):
+        state = {'since': state['since'], 'until': timezone.now().isoformat(), 'step': 0, 'after': None}
+    since = parse_datetime(state['since']) if state['since'] else None
+    until = parse_datetime(state['until'])
+    if since and since < timezone.now() - TOMBSTONE_RETENTION:
+        raise InvalidToken("Sync token has expired; start over without one")
+    models = synced_models()
+
+    changes = {}
+    deleted = {}
+    remaining = limit
+    while remaining and state['step'] <= len(models):
+        if state['step'] < len(models):
+            model = models[state['step']]
+            fields = synced_fields(model)
+            rows = model.objects.filter(updated_at__lt=until)
+            if since:
+                rows = rows.filter(updated_at__gte=since)
+            rows = list(
+                _keyset(rows, 'updated_at', state['after'])
+                .order_by('updated_at', 'pk')
+                .values_list(*[field.attname for field in fields])[:remaining]
+            )
+            if rows:
+                changes[model_label(model)] = {'fields': [field.name for field in fields], 'rows': rows}
+                attnames = [field.attname for field in fields]
+                last = rows[-1]
+                last_key = [last[attnames.index('updated_at')].isoformat(), last[attnames.index(model._meta.pk.attname)]]
+        else:
+            rows = []
+            if since:
+                rows = list(
+                    _keyset(SyncTombstone.objects.filter(deleted_at__gte=since, deleted_at__lt=until),
+                            'deleted_at', state['after'])
+                    .order_by('deleted_at', 'pk')
+                    .values_list('pk', 'deleted_at', 'model', 'object_id')[:remaining]
+                )
+            for _, _, label, object_id in rows:
+                deleted.setdefault(label, []).append(object_id)
+            if rows:
+                last_key = [rows[-1][1].isoformat(), rows[-1][0]]
+
+        remaining -= len(rows)
+        if remaining:
+            # Step exhausted
+            state['step'] += 1
+            state['after'] = None
+        else:
+            state['after'] = last_key
+
+    more = state['step'] <= len(models)
+    if not more:
+        state = {'since': (until - SYNC_OVERLAP).isoformat()}
+    return changes, deleted, encode_token(state), more
+
+
+def record_tombstone(sender, instance, **kwargs):
+    """post_delete handler for synced models"""
+    SyncTombstone.objects.create(model=model_label(sender), object_id=instance.pk)
+
+
+def prune_tombstones():
+    """Drop tombstones past the retention period; returns how many"""
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=timezone.now() - TOMBSTONE_RETENTION).delete()
+    return deleted
+
+
+def replay_movements(rows, performed_by=None):
+    """
+    Post movements queued by offline clients, each carrying a ``client_id``.
+
+    Movements already posted under their client_id (an earlier upload whose
+    response was lost) are reported as duplicates with the original id
+    instead of being posted twice. The rest post independently through the
+    bulk path, so one rejected movement does not hold back the queue. If a
+    concurrent replay of the same queue inserts first, the unique client_id
+    rejects the batch and the lines are checked again, so the movements it
+    posted come back as duplicates. Returns one result per row.
+    """
+    results = [None] * len(rows)
+    first_line = {}
+    for line, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            results[line - 1] = {
+                'line': line, 'status': 'error', 'errors': ["Each line must be an object of movement fields"]
+            }
+            continue
+        try:
+            client_id = uuid.UUID(str(row.get('client_id') or ''))
+        except ValueError:
+            results[line - 1] = {'line': line, 'status': 'error', 'errors': ["client_id must be a UUID"]}
+            continue
+        if client_id in first_line:
+            results[line - 1] = {'line': line, 'status': 'duplicate', 'of_line': first_line[client_id]}
+        else:
+            first_line[client_id] = line
+
+    for attempt in range(REPLAY_ATTEMPTS):
+        posted = dict(
+            StockMovement.objects.filter(client_id__in=list(first_line)).values_list('client_id', 'pk')
+        )
+        pending = []
+        for client_id, line in first_line.items():
+            if client_id in posted:
+                results[line - 1] = {'line': line, 'status': 'duplicate', 'id': posted[client_id]}
+            else:
+                pending.append(line)
+        if not pending:
+            break
+        try:
+            _, posted_results = post_movements_bulk(
+                [rows[line - 1] for line in pending], atomic=False, performed_by=performed_by
+            )
+        except IntegrityError:
+            if attempt == REPLAY_ATTEMPTS - 1:
+                raise
+            continue
+        for line, result in zip(pending, posted_results):
+            results[line - 1] = {**result, 'line': line}
+        break
+
+    for result in results:
+        if 'of_line' in result:
+            original = results[result.pop('of_line') - 1]
+            if 'id' in original:
+                result['id'] = original['id']
+    return results
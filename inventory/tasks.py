@@ -0,0 +1,113 @@
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def refresh_reorder_candidates():
+    """Rebuild the flagged-materials table from current stock"""
+    from .reorder import refresh_reorder_candidates as refresh  # Import here to avoid loading models at import time
+
+    flagged = refresh()
+    logger.info(f"Reorder candidates refreshed: {flagged} material(s) flagged")
+    return flagged
+
+
+@shared_task
+def take_stock_snapshot():
+    """Store yesterday's end-of-day stock as a checkpoint for as_of queries"""
+    from .history import take_stock_snapshot as snapshot
+
+    rows = snapshot()
+    logger.info(f"Stock snapshot stored with {rows} row(s)")
+    return rows
+
+
+@shared_task
+def refresh_replenishment_plans():
+    """Recompute demand statistics and reorder figures for every material"""
+    from .planning import refresh_replenishment_plans as refresh
+
+    plans = refresh()
+    logger.info(f"Replenishment plans refreshed for {plans} material(s)")
+    return plans
+
+
+@shared_task
+def verify_storage_volumes():
+    """Re-aggregate location and warehouse volumes, alert on and repair drift"""
+    from django.core.mail import mail_admins
+    from .services import find_volume_drift, repair_volume_drift
+
+    locations, warehouses = find_volume_drift()
+    if not locations and not warehouses:
+        logger.info("Storage volumes verified: no drift")
+        return 0
+
+    lines = [
+        f"{kind} {pk}: recorded {recorded}, stock totals {actual}"
+        for kind, rows in (('Location', locations), ('Warehouse', warehouses))
+        for pk, recorded, actual in rows
+    ]
+    logger.error("Storage volume drift found:\n" + "\n".join(lines))
+    mail_admins(
+        f"Storage volume drift in {len(locations)} location(s), {len(warehouses)} warehouse(s)",
+        "\n".join(lines),
+        fail_silently=True
+    )
+    repair_volume_drift(locations, warehouses)
+    return len(locations) + len(warehouses)
+
+
+@shared_task
+def record_warehouse_utilization():
+    """Store the hourly per-type utilization of every warehouse"""
+    from .warehouse_analytics import record_utilization
+
+    rows = record_utilization()
+    logger.info(f"Warehouse utilization recorded with {rows} row(s)")
+    return rows
+
+
+@shared_task
+def refresh_expiry_buckets():
+    """Rebuild the per-day expiry buckets behind the dashboard counters"""
+    from .expiry import refresh_expiry_buckets as refresh
+
+    buckets = refresh()
+    logger.info(f"Expiry buckets refreshed: {buckets} bucket(s)")
+    return buckets
+
+
+@shared_task
+def refresh_material_classification():
+    """Reclassify materials (ABC/XYZ) and rebuild the slotting proposals"""
+    from .classification import refresh_classification
+
+    materials, proposals = refresh_classification()
+    logger.info(f"Materials classified: {materials}, slotting proposals: {proposals}")
+    return materials
+
+
+@shared_task
+def schedule_cycle_counts():
+    """Create today's cycle count list for every active warehouse"""
+    from .cycle_counts import schedule_cycle_count
+    from .models import Warehouse
+
+    warehouse_ids = list(Warehouse.objects.filter(active=True).values_list('pk', flat=True))
+    for warehouse_id in warehouse_ids:
+        schedule_cycle_count(warehouse_id)
+    logger.info(f"Cycle counts scheduled for {len(warehouse_ids)} warehouse(s)")
+    return len(warehouse_ids)
+
+
+@shared_task
+def prune_sync_tombstones():
+    """Delete sync tombstones older than the token retention period"""
+    from .sync import prune_tombstones
+
+    pruned = prune_tombstones()
+    logger.info(f"Sync tombstones pruned: {pruned}")
+    return pruned
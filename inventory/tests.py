@@ -1,3 +1,1463 @@
-from django.test import TestCase
+from contextlib import closing
+import datetime
+import threading
+import uuid
+from io import StringIO
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from .models import (
+    Warehouse, StorageLocation, RawMaterial, Stock, StockMovement, ReorderCandidate,
+    ReplenishmentPlan, CostLayer, MovementDailyRollup, MaterialClassification, SlottingProposal,
+    CycleCount, TransferDocument, ScanCode
+)
+from .classification import refresh_classification
+from .cycle_counts import schedule_cycle_count
+from .expiry import refresh_expiry_buckets
+from .history import day_end, stock_as_of, take_stock_snapshot
+from .planning import HOLDING_RATE, ORDER_COST, refresh_replenishment_plans
+from .putaway import free_capacity_index
+from .reorder import refresh_reorder_candidates
+from .rollups import rebuild_rollups
+from .services import post_movement, post_movements_bulk
+from .tasks import verify_storage_volumes
+from .warehouse_analytics import record_utilization
+
+
+class InventoryTestMixin:
+    def create_inventory(self):
+        self.warehouse = Warehouse.objects.create(
+            name='Main Yard',
+            code='WH1',
+            location='Nairobi',
+            capacity=10000
+        )
+        self.location = StorageLocation.objects.create(
+            warehouse=self.warehouse,
+            name='Bay A',
+            location_type='floor',
+            capacity=5000
+        )
+        self.other_location = StorageLocation.objects.create(
+            warehouse=self.warehouse,
+            name='Bay B',
+            location_type='floor',
+            capacity=5000
+        )
+        self.material = RawMaterial.objects.create(
+            name='Cement',
+            code='CEM-50',
+            description='50kg cement bag',
+            unit='pcs',
+            unit_price=Decimal('750.00'),
+            minimum_stock=20,
+            maximum_stock=2000,
+            reorder_point=50,
+            lead_time=7,
+            volume_per_unit=Decimal('0.040')
+        )
+
+
+class OnHandTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.create_inventory()
+
+    def test_stock_writes_maintain_on_hand(self):
+        stock = Stock.objects.create(
+            material=self.material, location=self.location,
+            quantity=100, batch_number='B1'
+        )
+        Stock.objects.create(
+            material=self.material, location=self.other_location,
+            quantity=40, batch_number='B2'
+        )
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 140)
+
+        stock.quantity = 70
+        stock.save()
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 110)
+
+        stock.delete()
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 40)
+
+    def test_movements_maintain_on_hand(self):
+        StockMovement.objects.create(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=60, batch_number='B1',
+            reference_number='R-1'
+        )
+        StockMovement.objects.create(
+            material=self.material, source_location=self.location,
+            destination_location=self.other_location,
+            movement_type='transfer', quantity=20, batch_number='B1',
+            reference_number='T-1'
+        )
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 60)
+        self.assertEqual(self.material.current_stock, 60)
+
+    def test_reconcile_stock_repairs_drift(self):
+        Stock.objects.create(
+            material=self.material, location=self.location,
+            quantity=100, batch_number='B1'
+        )
+        RawMaterial.objects.filter(pk=self.material.pk).update(on_hand=7)
+
+        out = StringIO()
+        call_command('reconcile_stock', '--dry-run', stdout=out)
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 7)
+
+        call_command('reconcile_stock', stdout=out)
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 100)
+
+
+class MovementPostingTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.create_inventory()
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=100, batch_number='B1',
+            reference_number='R-1'
+        )
+
+    def test_issue_more_than_available_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            post_movement(
+                material=self.material, source_location=self.location,
+                movement_type='issue', quantity=101, batch_number='B1',
+                reference_number='I-1'
+            )
+        self.assertFalse(StockMovement.objects.filter(reference_number='I-1').exists())
+        self.assertEqual(Stock.objects.get(batch_number='B1').quantity, 100)
+
+    def test_adjustment_direction_follows_location(self):
+        post_movement(
+            material=self.material, source_location=self.location,
+            movement_type='adjustment', quantity=30, batch_number='B1',
+            reference_number='A-1'
+        )
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='adjustment', quantity=5, batch_number='B1',
+            reference_number='A-2'
+        )
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 75)
+
+    def test_issuing_everything_removes_the_stock_row(self):
+        post_movement(
+            material=self.material, source_location=self.location,
+            movement_type='issue', quantity=100, batch_number='B1',
+            reference_number='I-1'
+        )
+        self.assertFalse(Stock.objects.exists())
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.current_volume, 0)
+
+
+class BulkMovementTests(InventoryTestMixin, APITestCase):
+    url = '/api/inventory/movements/bulk/'
+
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='clerk', password='testpass')
+        self.client.force_authenticate(user=self.user)
+
+    def receipt(self, reference, quantity, batch='B1'):
+        return {
+            'material': self.material.pk,
+            'destination_location': self.location.pk,
+            'movement_type': 'receipt',
+            'quantity': quantity,
+            'batch_number': batch,
+            'reference_number': reference,
+        }
+
+    def test_atomic_mode_rejects_whole_file(self):
+        lines = [
+            self.receipt('R-1', 10),
+            {**self.receipt('R-2', 5), 'movement_type': 'issue',
+             'destination_location': None, 'source_location': self.other_location.pk},
+        ]
+        response = self.client.post(self.url, lines, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['results'][1]['status'], 'error')
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_partial_mode_commits_valid_lines(self):
+        lines = [
+            self.receipt('R-1', 10),
+            self.receipt('R-1', 10),
+            {**self.receipt('I-1', 4), 'movement_type': 'issue',
+             'destination_location': None, 'source_location': self.location.pk},
+        ]
+        response = self.client.post(f'{self.url}?mode=partial', lines, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['posted', 'error', 'posted']
+        )
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 6)
+        self.assertEqual(Stock.objects.get().quantity, 6)
+
+    def test_malformed_json_lines_are_reported_per_line(self):
+        lines = [
+            {**self.receipt('R-1', 10), 'batch_number': 123},
+            {**self.receipt('R-2', 10), 'movement_type': 5},
+            [1, 2],
+            'R-3',
+        ]
+        response = self.client.post(f'{self.url}?mode=partial', lines, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['posted', 'error', 'error', 'error'])
+        self.assertEqual(results[1]['errors'], ["Unknown movement type '5'"])
+        self.assertEqual(results[2]['errors'], ["Each line must be an object of movement fields"])
+        self.assertEqual(Stock.objects.get().batch_number, '123')
+
+    def test_csv_upload(self):
+        body = (
+            'material,movement_type,quantity,batch_number,reference_number,destination_location,expiry_date\n'
+            + ''.join(
+                f'{self.material.pk},receipt,5,B{n % 3},R-{n},{self.location.pk},2030-01-01\n'
+                for n in range(30)
+            )
+        )
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['posted'], 30)
+        self.assertEqual(Stock.objects.count(), 3)
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 150)
+
+    def test_malformed_csv_is_rejected(self):
+        header = b'material,movement_type,quantity,batch_number,reference_number,destination_location\n'
+        for body in (
+            header + f'{self.material.pk},receipt,5,B1,R-1,{self.location.pk}\n'.encode() + b'\xff\xfe,receipt\n',
+            header + f'{self.material.pk},receipt,5,B1,"{"x" * 200000}",{self.location.pk}\n'.encode(),
+        ):
+            response = self.client.post(self.url, body, content_type='text/csv')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('Malformed CSV file', response.data['error'][0])
+        self.assertFalse(StockMovement.objects.exists())
+
+
+class ReorderCandidateTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='planner', password='testpass')
+        self.client.force_authenticate(user=self.user)
+
+    def test_movements_flag_and_clear_materials(self):
+        candidate = ReorderCandidate.objects.get(material=self.material)
+        self.assertEqual(candidate.severity, 'critical')
+
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=45, batch_number='B1',
+            reference_number='R-1'
+        )
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.severity, 'reorder')
+        self.assertEqual(candidate.suggested_quantity, 1955)
+
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=100, batch_number='B1',
+            reference_number='R-2'
+        )
+        self.assertFalse(ReorderCandidate.objects.exists())
+
+    def test_refresh_rebuilds_from_stock_records(self):
+        Stock.objects.create(
+            material=self.material, location=self.location,
+            quantity=500, batch_number='B1'
+        )
+        ReorderCandidate.objects.all().delete()
+        RawMaterial.objects.filter(pk=self.material.pk).update(reorder_point=600)
+
+        self.assertEqual(refresh_reorder_candidates(), 1)
+        response = self.client.get('/api/inventory/stock/low_stock/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['material_code'], 'CEM-50')
+        self.assertEqual(response.data[0]['on_hand'], 500)
+
+
+class PutawayTests(InventoryTestMixin, APITestCase):
+    url = '/api/inventory/locations/putaway/'
+
+    def setUp(self):
+        self.create_inventory()
+        self.cold = StorageLocation.objects.create(
+            warehouse=self.warehouse, name='Cooler', location_type='cold',
+            capacity=10, temperature_controlled=True
+        )
+        StorageLocation.objects.filter(pk=self.location.pk).update(capacity=6)
+        StorageLocation.objects.filter(pk=self.other_location.pk).update(capacity=4)
+        free_capacity_index.rebuild()
+        self.user = User.objects.create_user(username='receiver', password='testpass')
+        self.client.force_authenticate(user=self.user)
+
+    def test_plan_splits_across_largest_bins(self):
+        response = self.client.post(self.url, {
+            'material': self.material.pk,
+            'quantity': 200,
+            'warehouse': self.warehouse.pk,
+            'location_types': ['floor'],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        plan = [(line['location_id'], line['quantity']) for line in response.data['plan']]
+        self.assertEqual(plan, [(self.location.pk, 150), (self.other_location.pk, 50)])
+        self.assertEqual(response.data['unplaced_quantity'], 0)
+
+    def test_index_yields_each_location_once_after_volume_returns(self):
+        # Free volume 6 -> 3 -> 6 leaves two heap entries with the same volume
+        for capacity in (3, 6):
+            StorageLocation.objects.filter(pk=self.location.pk).update(capacity=capacity)
+            free_capacity_index.refresh([self.location.pk])
+        with closing(free_capacity_index.largest(self.warehouse.pk, ['floor'])) as locations:
+            self.assertEqual(
+                [location_id for location_id, _ in locations], [self.location.pk, self.other_location.pk]
+            )
+
+    def test_plan_follows_posted_movements(self):
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=100, batch_number='B1',
+            reference_number='R-1'
+        )
+        response = self.client.post(self.url, {
+            'material': self.material.pk,
+            'quantity': 500,
+            'warehouse': self.warehouse.pk,
+            'temperature_controlled': False,
+        }, format='json')
+        plan = [(line['location_id'], line['quantity']) for line in response.data['plan']]
+        self.assertEqual(plan, [(self.other_location.pk, 100), (self.location.pk, 50)])
+        self.assertEqual(response.data['unplaced_quantity'], 350)
+
+
+class StockHistoryTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='auditor', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.today = timezone.localdate()
+        self.post('R-1', 'receipt', 100, days_ago=3)
+        self.post('I-1', 'issue', 30, days_ago=2)
+        self.post('T-1', 'transfer', 20, days_ago=1)
+        self.post('R-2', 'receipt', 50, days_ago=0)
+
+    def post(self, reference, movement_type, quantity, days_ago):
+        movement = post_movement(
+            material=self.material,
+            source_location=self.location if movement_type in ('issue', 'transfer') else None,
+            destination_location=(
+                self.other_location if movement_type == 'transfer'
+                else None if movement_type == 'issue' else self.location
+            ),
+            movement_type=movement_type, quantity=quantity, batch_number='B1',
+            reference_number=reference
+        )
+        moment = timezone.now() - datetime.timedelta(days=days_ago)
+        StockMovement.objects.filter(pk=movement.pk).update(created_at=moment)
+
+    def day(self, days_ago):
+        return self.today - datetime.timedelta(days=days_ago)
+
+    def test_reconstruction_matches_with_and_without_snapshots(self):
+        expected = {
+            3: {(self.material.pk, self.location.pk, 'B1'): 100},
+            2: {(self.material.pk, self.location.pk, 'B1'): 70},
+            1: {(self.material.pk, self.location.pk, 'B1'): 50,
+                (self.material.pk, self.other_location.pk, 'B1'): 20},
+        }
+        for days_ago, balances in expected.items():
+            self.assertEqual(stock_as_of(day_end(self.day(days_ago))), balances)
+
+        for days_ago in (3, 2, 1):
+            take_stock_snapshot(self.day(days_ago))
+        Stock.objects.all().delete()  # Snapshots alone must be enough now
+        self.assertEqual(stock_as_of(day_end(self.day(1))), expected[1])
+        self.assertEqual(stock_as_of(day_end(self.day(2))), expected[2])
+
+    def test_as_of_endpoints(self):
+        as_of = self.day(2).isoformat()
+        response = self.client.get(f'/api/inventory/stock/?as_of={as_of}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['quantity'], 70)
+
+        response = self.client.get(f'/api/inventory/materials/{self.material.pk}/?as_of={as_of}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['current_stock'], 70)
+        self.assertEqual(response.data['stock_value'], Decimal('52500.00'))
+
+        response = self.client.get('/api/inventory/stock/?as_of=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f'/api/inventory/stock/?as_of={as_of}&location=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_replay_is_bounded_by_the_nearest_snapshot(self):
+        take_stock_snapshot(self.day(2))
+        # Undone from the snapshot after it rather than from today's stock
+        StockMovement.objects.filter(reference_number='R-1').update(
+            created_at=timezone.now() - datetime.timedelta(days=40)
+        )
+        self.assertEqual(stock_as_of(day_end(self.day(10))), {(self.material.pk, self.location.pk, 'B1'): 100})
+
+        response = self.client.get('/api/inventory/stock/', {'as_of': self.day(60).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/inventory/materials/valuation/', {'as_of': self.day(60).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AllocationTests(InventoryTestMixin, APITestCase):
+    url = '/api/inventory/movements/allocate/'
+
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='picker', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        today = timezone.localdate()
+        # (location, batch, quantity, expiry) in receipt order
+        for number, (location, batch, quantity, expiry) in enumerate([
+            (self.location, 'OLD', 30, None),
+            (self.other_location, 'LATE', 40, today + datetime.timedelta(days=60)),
+            (self.location, 'SOON', 25, today + datetime.timedelta(days=5)),
+            (self.other_location, 'GONE', 50, today - datetime.timedelta(days=1)),
+        ]):
+            post_movement(
+                material=self.material,
+                destination_location=location,
+                movement_type='receipt',
+                quantity=quantity,
+                batch_number=batch,
+                reference_number=f'R-{number}'
+            )
+            Stock.objects.filter(batch_number=batch).update(
+                expiry_date=expiry,
+                created_at=timezone.now() - datetime.timedelta(days=10 - number)
+            )
+
+    def allocate(self, quantity, strategy='fefo', reference='PICK-1'):
+        return self.client.post(self.url, {
+            'material': self.material.pk,
+            'quantity': quantity,
+            'warehouse': self.warehouse.pk,
+            'strategy': strategy,
+            'reference_number': reference,
+        }, format='json')
+
+    def test_fefo_takes_earliest_expiry_and_skips_expired(self):
+        response = self.allocate(80)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [(line['batch_number'], line['quantity'], line['reference_number']) for line in response.data],
+            [('SOON', 25, 'PICK-1-1'), ('LATE', 40, 'PICK-1-2'), ('OLD', 15, 'PICK-1-3')]
+        )
+        self.assertFalse(Stock.objects.filter(batch_number='SOON').exists())
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 145 - 80)
+
+    def test_transferred_batches_keep_their_expiry(self):
+        soon = timezone.localdate() + datetime.timedelta(days=5)
+        post_movement(
+            material=self.material, source_location=self.location, destination_location=self.other_location,
+            movement_type='transfer', quantity=10, batch_number='SOON', reference_number='T-1'
+        )
+        post_movements_bulk([{
+            'material': self.material.pk, 'movement_type': 'transfer', 'quantity': 10, 'batch_number': 'LATE',
+            'reference_number': 'T-2', 'source_location': self.other_location.pk,
+            'destination_location': self.location.pk,
+        }])
+        self.assertEqual(Stock.objects.get(batch_number='SOON', location=self.other_location).expiry_date, soon)
+        self.assertEqual(
+            Stock.objects.get(batch_number='LATE', location=self.location).expiry_date,
+            soon + datetime.timedelta(days=55)
+        )
+
+        response = self.allocate(30)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [(line['batch_number'], line['quantity']) for line in response.data],
+            [('SOON', 15), ('SOON', 10), ('LATE', 5)]
+        )
+
+    def test_fifo_takes_oldest_first(self):
+        response = self.allocate(50, strategy='fifo')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [(line['batch_number'], line['quantity']) for line in response.data],
+            [('OLD', 30), ('LATE', 20)]
+        )
+
+    def test_shortage_posts_nothing(self):
+        response = self.allocate(96)  # 95 unexpired units on hand
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(StockMovement.objects.filter(movement_type='issue').count(), 0)
+        self.assertEqual(Stock.objects.aggregate(total=Sum('quantity'))['total'], 145)
+
+
+class ReplenishmentPlanTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='planner', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.idle = RawMaterial.objects.create(
+            name='Sand', code='SND', description='River sand', unit='kg',
+            unit_price=Decimal('2.00'), maximum_stock=1000, reorder_point=100,
+            lead_time=3, volume_per_unit=Decimal('0.001')
+        )
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=1000, batch_number='B1',
+            reference_number='R-1'
+        )
+        # 10 units three days ago, 20 yesterday, 30 today over a 5-day window
+        for days_ago, quantity in [(3, 10), (1, 20), (0, 30)]:
+            movement = post_movement(
+                material=self.material, source_location=self.location,
+                movement_type='issue', quantity=quantity, batch_number='B1',
+                reference_number=f'I-{days_ago}'
+            )
+            StockMovement.objects.filter(pk=movement.pk).update(
+                created_at=timezone.now() - datetime.timedelta(days=days_ago)
+            )
+        rebuild_rollups()
+
+    def test_refresh_computes_demand_statistics(self):
+        today = timezone.localdate()
+        self.assertEqual(refresh_replenishment_plans(window_days=5, today=today), 2)
+
+        plan = ReplenishmentPlan.objects.get(material=self.material)
+        self.assertAlmostEqual(plan.avg_daily_demand, 12.0)
+        self.assertAlmostEqual(plan.demand_std, 13.0384, places=3)
+        self.assertEqual(plan.on_hand, 940)
+        # ceil(1.645 * 13.04 * sqrt(7)) safety stock on top of 84 lead-time units
+        self.assertEqual(plan.safety_stock, 57)
+        self.assertEqual(plan.reorder_point, 84 + 57)
+        eoq = (2 * 12 * 365 * ORDER_COST / (750 * HOLDING_RATE)) ** 0.5
+        self.assertEqual(plan.reorder_quantity, -(-eoq // 1))
+        self.assertEqual(plan.stockout_date, today + datetime.timedelta(days=78))
+
+        idle = ReplenishmentPlan.objects.get(material=self.idle)
+        self.assertEqual((idle.avg_daily_demand, idle.reorder_quantity), (0, 0))
+        self.assertIsNone(idle.stockout_date)
+
+    def test_slow_movers_have_no_stockout_date(self):
+        RawMaterial.objects.filter(pk=self.idle.pk).update(on_hand=50000)
+        MovementDailyRollup.objects.create(
+            date=timezone.localdate(), material=self.idle, location=self.location,
+            movement_type='issue', count=1, quantity=1
+        )
+        self.assertEqual(refresh_replenishment_plans(), 2)
+        plan = ReplenishmentPlan.objects.get(material=self.idle)
+        self.assertAlmostEqual(plan.days_of_stock, 4500000.0)
+        self.assertIsNone(plan.stockout_date)
+        self.assertIsNotNone(ReplenishmentPlan.objects.get(material=self.material).stockout_date)
+
+    def test_replenishment_endpoint(self):
+        refresh_replenishment_plans(window_days=5)
+        response = self.client.get('/api/inventory/materials/replenishment/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [plan['material_code'] for plan in response.data['results']],
+            ['CEM-50', 'SND']
+        )
+        response = self.client.get(
+            '/api/inventory/materials/replenishment/',
+            {'stockout_before': timezone.localdate().isoformat()}
+        )
+        self.assertEqual(response.data['count'], 0)
+
+        response = self.client.get(f'/api/inventory/materials/{self.material.pk}/stock_analysis/')
+        self.assertEqual(response.data['replenishment']['reorder_point'], 141)
+
+
+class QueryCountTests(InventoryTestMixin, APITestCase):
+    """Serializing more rows must not cost more queries"""
+
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='viewer', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.expiry = timezone.localdate() + datetime.timedelta(days=10)
+        self.receipts = 0
+
+    def receive(self, count, material=None):
+        for _ in range(count):
+            self.receipts += 1
+            post_movement(
+                material=material or self.material,
+                destination_location=[self.location, self.other_location][self.receipts % 2],
+                movement_type='receipt', quantity=5, batch_number=f'B{self.receipts}',
+                reference_number=f'R-{self.receipts}'
+            )
+        Stock.objects.update(expiry_date=self.expiry)
+
+    def assertConstantQueries(self, url, expected):
+        # ``expected`` includes the audit log row written for every request
+        self.receive(1)
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+        self.receive(8)
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_stock_endpoints(self):
+        self.assertConstantQueries('/api/inventory/stock/', 3)
+        self.assertConstantQueries('/api/inventory/stock/expiring_soon/', 2)
+        self.assertConstantQueries(f'/api/inventory/locations/{self.location.pk}/stock_list/', 3)
+        self.assertConstantQueries('/api/inventory/movements/', 3)
+
+    def test_material_detail(self):
+        other = RawMaterial.objects.create(
+            name='Sand', code='SND', description='River sand', unit='kg',
+            unit_price=Decimal('2.00'), maximum_stock=1000, reorder_point=100,
+            lead_time=3, volume_per_unit=Decimal('0.001')
+        )
+        self.receive(6, material=other)
+        response = self.assertConstantQueries(f'/api/inventory/materials/{self.material.pk}/', 4)
+        self.assertEqual(len(response.data['stock_by_location']), 9)
+        self.assertEqual(
+            [movement['reference'] for movement in response.data['recent_movements']],
+            ['R-15', 'R-14', 'R-13', 'R-12', 'R-11']
+        )
+
+
+class ValuationTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='accountant', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.references = 0
+
+    def post(self, movement_type, quantity, unit_cost=None, location=None, destination=None):
+        self.references += 1
+        location = location or self.location
+        fields = {
+            'material': self.material, 'movement_type': movement_type, 'quantity': quantity,
+            'batch_number': 'B1', 'reference_number': f'M-{self.references}', 'unit_cost': unit_cost,
+        }
+        if movement_type in ('receipt', 'return'):
+            fields['destination_location'] = location
+        else:
+            fields['source_location'] = location
+            fields['destination_location'] = destination
+        return post_movement(**fields)
+
+    def assertValue(self, expected):
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.stock_value, Decimal(expected))
+
+    def test_weighted_average(self):
+        self.post('receipt', 100, Decimal('10'))
+        self.post('receipt', 100, Decimal('20'))
+        issue = self.post('issue', 50)
+        self.assertEqual((issue.unit_cost, issue.value), (Decimal('15'), Decimal('-750')))
+        transfer = self.post('transfer', 20, destination=self.other_location)
+        self.assertEqual(transfer.value, 0)
+        self.assertValue('2250.00')
+        self.post('issue', 130)
+        self.post('issue', 20, location=self.other_location)
+        self.assertValue('0')
+
+    def test_fifo_layers(self):
+        self.material.valuation_method = 'fifo'
+        self.material.save()
+        self.post('receipt', 100, Decimal('10'))
+        self.post('receipt', 100, Decimal('20'))
+        issue = self.post('issue', 150)
+        self.assertEqual(issue.value, Decimal('-2000'))
+        self.assertValue('1000.00')
+        self.assertEqual(
+            list(CostLayer.objects.values_list('unit_cost', 'remaining')),
+            [(Decimal('20'), 50)]
+        )
+        self.post('issue', 50)
+        self.assertValue('0')
+        self.assertFalse(CostLayer.objects.exists())
+
+    def test_switching_to_fifo_issues_untracked_stock_first(self):
+        self.post('receipt', 10, Decimal('5'))
+        self.material.valuation_method = 'fifo'
+        self.material.save()
+        self.post('receipt', 10, Decimal('8'))
+        self.assertEqual(self.post('issue', 15).value, Decimal('-90'))
+        self.assertValue('40.00')
+
+    def test_bulk_posting_values_lines_in_order(self):
+        committed, _ = post_movements_bulk([
+            {'material': self.material.pk, 'movement_type': 'receipt', 'quantity': 10,
+             'unit_cost': '4.50', 'batch_number': 'B1', 'reference_number': 'R-1',
+             'destination_location': self.location.pk},
+            {'material': self.material.pk, 'movement_type': 'issue', 'quantity': 4,
+             'batch_number': 'B1', 'reference_number': 'I-1', 'source_location': self.location.pk},
+        ])
+        self.assertTrue(committed)
+        self.assertEqual(StockMovement.objects.get(reference_number='I-1').value, Decimal('-18'))
+        self.assertValue('27.00')
+
+    def test_stock_record_edits_post_adjustments(self):
+        self.post('receipt', 100, Decimal('10'))
+        stock = Stock.objects.get()
+        url = f'/api/inventory/stock/{stock.pk}/'
+        response = self.client.patch(url, {'quantity': 80, 'notes': 'Recounted'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual((response.data['quantity'], response.data['notes']), (80, 'Recounted'))
+        adjustment = StockMovement.objects.get(movement_type='adjustment')
+        self.assertEqual((adjustment.source_location_id, adjustment.quantity, adjustment.value), (self.location.pk, 20, Decimal('-200')))
+        self.assertValue('800.00')
+        self.assertEqual(self.material.on_hand, 80)
+
+        response = self.client.patch(url, {'location': self.other_location.pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post('/api/inventory/stock/', {
+            'material': self.material.pk, 'location': self.other_location.pk, 'batch_number': 'B2', 'quantity': 5
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 85)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Stock.objects.filter(pk=stock.pk).exists())
+        self.assertValue('50.00')
+        self.assertEqual(self.material.on_hand, 5)
+        self.assertEqual(StockMovement.objects.filter(movement_type='adjustment').count(), 3)
+
+    def test_period_end_report(self):
+        self.post('receipt', 100, Decimal('10'))
+        StockMovement.objects.update(created_at=timezone.now() - datetime.timedelta(days=3))
+        self.post('issue', 40)
+        self.post('receipt', 10, Decimal('30'))
+        yesterday = (timezone.localdate() - datetime.timedelta(days=1)).isoformat()
+
+        response = self.client.get('/api/inventory/materials/valuation/', {'as_of': yesterday})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_value'], Decimal('1000'))
+        self.assertEqual(response.data['materials'][0]['quantity'], 100)
+
+        response = self.client.get('/api/inventory/materials/valuation/')
+        self.assertEqual(response.data['materials'][0]['quantity'], 70)
+        self.assertEqual(response.data['total_value'], Decimal('900'))
+
+
+class StockMatrixTests(InventoryTestMixin, APITestCase):
+    url = '/api/inventory/stock-matrix/'
+
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='planner', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.yard = Warehouse.objects.create(name='Second Yard', code='WH2', location='Mombasa', capacity=5000)
+        self.yard_bay = StorageLocation.objects.create(
+            warehouse=self.yard, name='Bay C', location_type='floor', capacity=5000
+        )
+
+    def receive(self, location, quantity, reference):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movement(
+                material=self.material, destination_location=location,
+                movement_type='receipt', quantity=quantity, batch_number=reference,
+                reference_number=reference
+            )
+
+    def test_matrix_sums_locations_per_warehouse(self):
+        self.receive(self.location, 10, 'R-1')
+        self.receive(self.other_location, 5, 'R-2')
+        self.receive(self.yard_bay, 7, 'R-3')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['warehouses']['code'], ['WH1', 'WH2'])
+        self.assertEqual(response.data['cells'], {
+            'material': [self.material.pk, self.material.pk],
+            'warehouse': [self.warehouse.pk, self.yard.pk],
+            'quantity': [15, 7],
+        })
+
+    def test_etag_changes_only_when_stock_moves(self):
+        self.receive(self.location, 10, 'R-1')
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.receive(self.location, 10, 'R-2')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['cells']['quantity'], [20])
+
+
+class VolumeAccountingTests(InventoryTestMixin, TestCase):
+    def setUp(self):
+        self.create_inventory()
+
+    def assertVolumes(self, location, other_location, warehouse):
+        for obj, expected in (
+            (self.location, location), (self.other_location, other_location), (self.warehouse, warehouse)
+        ):
+            obj.refresh_from_db()
+            self.assertEqual(obj.current_volume, Decimal(expected))
+
+    def test_stock_writes_apply_exact_deltas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stock = Stock.objects.create(
+                material=self.material, location=self.location, quantity=25, batch_number='B1'
+            )
+        self.assertVolumes('1.000', '0', '1.000')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.quantity = 10
+            stock.location = self.other_location
+            stock.save()
+        self.assertVolumes('0', '0.400', '0.400')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.delete()
+        self.assertVolumes('0', '0', '0')
+
+    def test_transfer_moves_volume_between_locations(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movement(
+                material=self.material, destination_location=self.location,
+                movement_type='receipt', quantity=30, batch_number='B1', reference_number='R-1'
+            )
+            post_movement(
+                material=self.material, source_location=self.location,
+                destination_location=self.other_location, movement_type='transfer',
+                quantity=5, batch_number='B1', reference_number='T-1'
+            )
+        self.assertVolumes('1.000', '0.200', '1.200')
+
+    def test_verifier_repairs_drift(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movement(
+                material=self.material, destination_location=self.location,
+                movement_type='receipt', quantity=30, batch_number='B1', reference_number='R-1'
+            )
+        self.assertEqual(verify_storage_volumes(), 0)
+
+        StorageLocation.objects.filter(pk=self.location.pk).update(current_volume=7)
+        Warehouse.objects.filter(pk=self.warehouse.pk).update(current_volume=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(verify_storage_volumes(), 2)
+        self.assertVolumes('1.200', '0', '1.200')
+
+
+class WarehouseUtilizationTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='manager', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.cold = StorageLocation.objects.create(
+            warehouse=self.warehouse, name='Chiller', location_type='cold', capacity=100
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movement(
+                material=self.material, destination_location=self.location,
+                movement_type='receipt', quantity=1000, batch_number='B1', reference_number='R-1'
+            )
+
+    def test_storage_analysis_groups_in_sql(self):
+        url = f'/api/inventory/warehouses/{self.warehouse.pk}/storage_analysis/'
+        # warehouse, per-type rollup, available locations and the audit log row
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_utilized'], Decimal('40'))
+        self.assertEqual(response.data['utilization_by_type']['floor'], {
+            'capacity': 10000, 'utilized': Decimal('40'), 'free': Decimal('9960'), 'location_count': 2
+        })
+        self.assertEqual(
+            [row['location'] for row in response.data['available_locations']],
+            ['Bay B', 'Bay A', 'Chiller']
+        )
+
+    def test_hourly_history(self):
+        earlier = timezone.now() - datetime.timedelta(hours=1)
+        self.assertEqual(record_utilization(now=earlier), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movement(
+                material=self.material, source_location=self.location,
+                movement_type='issue', quantity=500, batch_number='B1', reference_number='I-1'
+            )
+        record_utilization()
+
+        response = self.client.get(f'/api/inventory/warehouses/{self.warehouse.pk}/utilization_history/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        history = response.data['history']
+        self.assertEqual([point['used_volume'] for point in history], [Decimal('40'), Decimal('20')])
+        self.assertEqual(history[0]['capacity'], 10100)
+        self.assertEqual(history[1]['by_type']['cold']['used_volume'], 0)
+
+
+class ExpiryTests(InventoryTestMixin, APITestCase):
+    url = '/api/inventory/stock/expiring_soon/'
+
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='quality', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        yard = Warehouse.objects.create(name='Second Yard', code='WH2', location='Mombasa', capacity=5000)
+        self.yard_bay = StorageLocation.objects.create(
+            warehouse=yard, name='Bay C', location_type='floor', capacity=5000
+        )
+        self.yard = yard
+        today = timezone.localdate()
+        for batch, location, days, quantity in [
+            ('E5', self.location, 5, 10),
+            ('E20', self.other_location, 20, 20),
+            ('E60', self.yard_bay, 60, 30),
+            ('E5B', self.yard_bay, 5, 40),
+            ('OLD', self.location, -1, 50),
+            ('NONE', self.location, None, 60),
+        ]:
+            Stock.objects.create(
+                material=self.material, location=location, quantity=quantity, batch_number=batch,
+                expiry_date=today + datetime.timedelta(days=days) if days is not None else None
+            )
+
+    def test_feed_pages_by_expiry_with_cursor(self):
+        batches = []
+        response = self.client.get(self.url, {'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            batches += [row['batch_number'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(batches, ['E5', 'E5B', 'E20', 'E60'])
+
+        response = self.client.get(self.url, {'days': 30, 'warehouse': self.yard.pk})
+        self.assertEqual([row['batch_number'] for row in response.data['results']], ['E5B'])
+
+    def test_nightly_buckets_back_counters(self):
+        self.assertEqual(refresh_expiry_buckets(), 4)
+        response = self.client.get('/api/inventory/stock/expiry_summary/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(window['days'], window['batch_count'], window['quantity']) for window in response.data['windows']],
+            [(7, 2, 50), (30, 3, 70), (90, 4, 100)]
+        )
+        response = self.client.get('/api/inventory/stock/expiry_summary/', {'warehouse': self.yard.pk})
+        self.assertEqual(response.data['windows'][2]['quantity'], 70)
+
+        response = self.client.get('/api/inventory/stock/expiry_summary/', {'warehouse': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MovementRollupTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='analyst', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=100, batch_number='B1', reference_number='R-1'
+        )
+        post_movements_bulk([
+            {'material': self.material.pk, 'movement_type': movement_type, 'quantity': quantity,
+             'batch_number': 'B1', 'reference_number': reference, 'source_location': self.location.pk}
+            for movement_type, quantity, reference in [('issue', 10, 'I-1'), ('issue', 15, 'I-2')]
+        ])
+        post_movement(
+            material=self.material, source_location=self.location,
+            destination_location=self.other_location, movement_type='transfer',
+            quantity=5, batch_number='B1', reference_number='T-1'
+        )
+
+    def rollup(self):
+        return sorted(MovementDailyRollup.objects.values_list(
+            'date', 'material_id', 'location_id', 'movement_type', 'count', 'quantity'
+        ))
+
+    def test_posting_maintains_rollup_and_backfill_matches(self):
+        today = timezone.localdate()
+        expected = sorted([
+            (today, self.material.pk, self.location.pk, 'issue', 2, 25),
+            (today, self.material.pk, self.location.pk, 'receipt', 1, 100),
+            (today, self.material.pk, self.location.pk, 'transfer', 1, 5),
+        ])
+        self.assertEqual(self.rollup(), expected)
+
+        MovementDailyRollup.objects.all().delete()
+        out = StringIO()
+        call_command('backfill_movement_rollups', stdout=out)
+        self.assertIn('Wrote 3 rollup row(s)', out.getvalue())
+        self.assertEqual(self.rollup(), expected)
+
+    def test_analyses_read_rollup(self):
+        with self.assertNumQueries(4):  # total, by type, by material and the audit log row
+            response = self.client.get('/api/inventory/movements/movement_analysis/')
+        self.assertEqual(response.data['total_movements'], 4)
+        self.assertEqual(
+            [(row['movement_type'], row['count'], row['total_quantity']) for row in response.data['by_type']],
+            [('issue', 2, 25), ('receipt', 1, 100), ('transfer', 1, 5)]
+        )
+        response = self.client.get(f'/api/inventory/materials/{self.material.pk}/stock_analysis/')
+        self.assertEqual(response.data['consumption_90d'], 25)
+
+
+class ClassificationTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='analyst', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.sand = RawMaterial.objects.create(
+            name='Sand', code='SND', description='River sand', unit='kg',
+            unit_price=Decimal('2.00'), maximum_stock=1000, reorder_point=100,
+            lead_time=3, volume_per_unit=Decimal('0.001')
+        )
+        self.idle = RawMaterial.objects.create(
+            name='Lime', code='LIM', description='Hydrated lime', unit='kg',
+            unit_price=Decimal('30.00'), maximum_stock=1000, reorder_point=100,
+            lead_time=3, volume_per_unit=Decimal('0.001')
+        )
+        StorageLocation.objects.filter(pk=self.location.pk).update(accessibility_rank=5)
+        self.dock = StorageLocation.objects.create(
+            warehouse=self.warehouse, name='Dock Bay', location_type='floor',
+            capacity=5000, accessibility_rank=1
+        )
+        for material, quantity in [(self.material, 100), (self.sand, 500)]:
+            post_movement(
+                material=material, destination_location=self.location,
+                movement_type='receipt', quantity=quantity, batch_number='B1',
+                reference_number=f'R-{material.code}'
+            )
+        # Cement: 10 a week ago and 10 today; sand: 50 today only
+        post_movement(
+            material=self.material, source_location=self.location,
+            movement_type='issue', quantity=10, batch_number='B1', reference_number='I-1'
+        )
+        MovementDailyRollup.objects.filter(movement_type='issue').update(
+            date=timezone.localdate() - datetime.timedelta(days=8)
+        )
+        for material, quantity in [(self.material, 10), (self.sand, 50)]:
+            post_movement(
+                material=material, source_location=self.location,
+                movement_type='issue', quantity=quantity, batch_number='B1',
+                reference_number=f'I-2-{material.code}'
+            )
+
+    def test_refresh_classifies_and_proposes_moves(self):
+        self.assertEqual(refresh_classification(window_days=14), (3, 1))
+
+        cement = MaterialClassification.objects.get(material=self.material)
+        self.assertEqual((cement.abc_class, cement.xyz_class), ('A', 'X'))
+        self.assertEqual((cement.issued_quantity, cement.pick_count), (20, 2))
+        self.assertEqual(cement.consumption_value, Decimal('15000.00'))
+        sand = MaterialClassification.objects.get(material=self.sand)
+        self.assertEqual((sand.abc_class, sand.xyz_class), ('C', 'Z'))
+        idle = MaterialClassification.objects.get(material=self.idle)
+        self.assertEqual((idle.abc_class, idle.xyz_class, idle.demand_cv), ('C', 'Z', None))
+
+        proposal = SlottingProposal.objects.get()
+        self.assertEqual(
+            (proposal.material_id, proposal.from_location_id, proposal.to_location_id, proposal.quantity),
+            (self.material.pk, self.location.pk, self.dock.pk, 80)
+        )
+
+    def test_endpoints(self):
+        refresh_classification(window_days=14)
+        response = self.client.get('/api/inventory/materials/classification/', {'abc_class': 'a'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['material_code'] for row in response.data['results']], ['CEM-50'])
+
+        response = self.client.get('/api/inventory/locations/slotting/', {'warehouse': self.warehouse.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['to_location_name'], 'Dock Bay')
+
+
+class CycleCountTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='counter', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        for location, batch, quantity in [(self.location, 'B1', 100), (self.other_location, 'B2', 50)]:
+            post_movement(
+                material=self.material, destination_location=location,
+                movement_type='receipt', quantity=quantity, batch_number=batch,
+                reference_number=f'R-{batch}'
+            )
+
+    def test_schedule_picks_due_batches(self):
+        # Unclassified materials are counted like C items, every 180 days
+        Stock.objects.filter(batch_number='B2').update(
+            last_counted_at=timezone.now() - datetime.timedelta(days=10)
+        )
+        count = schedule_cycle_count(self.warehouse.pk)
+        self.assertEqual(list(count.lines.values_list('batch_number', 'expected_quantity')), [('B1', 100)])
+        self.assertEqual(schedule_cycle_count(self.warehouse.pk), count)
+
+        MaterialClassification.objects.create(
+            material=self.material, abc_class='A', xyz_class='X', issued_quantity=0,
+            consumption_value=0, value_share=1, pick_count=0, window_days=365,
+            computed_at=timezone.now()
+        )
+        Stock.objects.filter(batch_number='B2').update(
+            last_counted_at=timezone.now() - datetime.timedelta(days=40)
+        )
+        later = schedule_cycle_count(self.warehouse.pk, timezone.localdate() + datetime.timedelta(days=1))
+        # B1 is still on the open list, B2 is now overdue as an A item
+        self.assertEqual(list(later.lines.values_list('batch_number', flat=True)), ['B2'])
+
+    def test_batches_at_a_counted_location_are_not_due(self):
+        StorageLocation.objects.filter(pk=self.other_location.pk).update(
+            last_counted_at=timezone.now() - datetime.timedelta(days=10)
+        )
+        count = schedule_cycle_count(self.warehouse.pk)
+        self.assertEqual(list(count.lines.values_list('batch_number', flat=True)), ['B1'])
+
+        # A count of the batch itself wins over the location's
+        Stock.objects.filter(batch_number='B2').update(
+            last_counted_at=timezone.now() - datetime.timedelta(days=200)
+        )
+        later = schedule_cycle_count(self.warehouse.pk, timezone.localdate() + datetime.timedelta(days=1))
+        self.assertEqual(list(later.lines.values_list('batch_number', flat=True)), ['B2'])
+
+    def test_submit_and_reconcile_post_variances(self):
+        response = self.client.post(
+            '/api/inventory/cycle-counts/schedule/', {'warehouse': self.warehouse.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        count_id = response.data['id']
+        lines = {line['batch_number']: line['id'] for line in response.data['lines']}
+
+        response = self.client.post(f'/api/inventory/cycle-counts/{count_id}/submit/', {'counts': [
+            {'line': lines['B1'], 'counted_quantity': 96},
+            {'line': lines['B2'], 'counted_quantity': 50},
+        ]}, format='json')
+        self.assertEqual(response.data['updated'], 2)
+        # Received after the count; it is not part of the variance
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=10, batch_number='B1', reference_number='R-B1-2'
+        )
+
+        response = self.client.post(f'/api/inventory/cycle-counts/{count_id}/reconcile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['variances'], response.data['net_adjustment']), (1, -4))
+
+        adjustment = StockMovement.objects.get(movement_type='adjustment')
+        self.assertEqual((adjustment.source_location_id, adjustment.quantity), (self.location.pk, 4))
+        self.assertEqual(Stock.objects.get(batch_number='B1').quantity, 106)
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 156)
+        self.assertFalse(Stock.objects.filter(last_counted_at__isnull=True).exists())
+        count = CycleCount.objects.get(pk=count_id)
+        self.assertEqual(count.status, 'reconciled')
+        self.assertEqual(count.lines.get(batch_number='B1').adjustment, adjustment)
+
+        response = self.client.post(f'/api/inventory/cycle-counts/{count_id}/reconcile/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_counting_a_batch_empty_stamps_its_location(self):
+        count = schedule_cycle_count(self.warehouse.pk)
+        line = count.lines.get(batch_number='B2')
+        response = self.client.post(f'/api/inventory/cycle-counts/{count.pk}/submit/', {'counts': [
+            {'line': line.pk, 'counted_quantity': 0},
+        ]}, format='json')
+        self.assertEqual(response.data['updated'], 1)
+        response = self.client.post(f'/api/inventory/cycle-counts/{count.pk}/reconcile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['net_adjustment'], -50)
+
+        self.assertFalse(Stock.objects.filter(batch_number='B2').exists())
+        self.other_location.refresh_from_db()
+        self.location.refresh_from_db()
+        self.assertIsNotNone(self.other_location.last_counted_at)
+        # Uncounted lines leave their location alone
+        self.assertIsNone(self.location.last_counted_at)
+        line.refresh_from_db()
+        self.assertEqual((line.counted_quantity, line.variance), (0, -50))
+
+
+class TransferDocumentTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='dispatcher', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.site = Warehouse.objects.create(name='Site Store', code='WH2', location='Thika', capacity=5000)
+        self.site_location = StorageLocation.objects.create(
+            warehouse=self.site, name='Site Bay', location_type='floor', capacity=5000
+        )
+        post_movements_bulk([
+            {'material': self.material.pk, 'movement_type': 'receipt', 'quantity': 100,
+             'batch_number': f'B{number}', 'reference_number': f'R-{number}',
+             'destination_location': self.location.pk}
+            for number in range(1, 7)
+        ])
+
+    def transfer(self, document_number, batches, quantity=40, destination=None):
+        return self.client.post('/api/inventory/transfers/', {
+            'document_number': document_number,
+            'source_warehouse': self.warehouse.pk,
+            'destination_warehouse': self.site.pk,
+            'lines': [
+                {'material': self.material.pk, 'source_location': self.location.pk,
+                 'destination_location': destination or self.site_location.pk,
+                 'batch_number': batch, 'quantity': quantity}
+                for batch in batches
+            ],
+        }, format='json')
+
+    def test_posts_all_lines_in_constant_queries(self):
+        # The first transfer of the day creates its rollup row
+        self.transfer('TD-0', ['B6'])
+        with CaptureQueriesContext(connection) as single:
+            response = self.transfer('TD-1', ['B1'])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as many:
+            response = self.transfer('TD-2', ['B2', 'B3', 'B4', 'B5'])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(single), len(many))
+
+        document = TransferDocument.objects.get(document_number='TD-2')
+        self.assertEqual(
+            [(line.batch_number, line.movement.reference_number) for line in document.lines.all()],
+            [('B2', 'TD-2-1'), ('B3', 'TD-2-2'), ('B4', 'TD-2-3'), ('B5', 'TD-2-4')]
+        )
+        self.assertEqual(Stock.objects.filter(location=self.site_location).aggregate(
+            total=Sum('quantity'))['total'], 240)
+        self.site_location.refresh_from_db()
+        self.assertEqual(self.site_location.current_volume, Decimal('9.600'))
+        self.material.refresh_from_db()
+        self.assertEqual(self.material.on_hand, 600)
+
+    def test_failed_line_rejects_document(self):
+        response = self.transfer('TD-1', ['B1', 'B2'], quantity=150)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['rejected'], 2)
+
+        # Lines posting into the wrong warehouse are rolled back too
+        response = self.transfer('TD-1', ['B1'], destination=self.other_location.pk)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('not in warehouse', response.data['results'][0]['errors'][0])
+        self.assertFalse(TransferDocument.objects.exists())
+        self.assertFalse(StockMovement.objects.filter(movement_type='transfer').exists())
+        self.assertEqual(Stock.objects.get(batch_number='B1').location, self.location)
+
+
+class ScanLookupTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_inventory()
+        self.user = User.objects.create_user(username='picker', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.location.barcode = 'LOC-A'
+        self.location.save()
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=100, batch_number='B1', reference_number='R-1'
+        )
+        post_movements_bulk([{
+            'material': self.material.pk, 'movement_type': 'receipt', 'quantity': 20,
+            'batch_number': 'B2', 'reference_number': 'R-2', 'destination_location': self.other_location.pk
+        }])
+
+    def scan(self, code):
+        return self.client.get(f'/api/inventory/scan/{code}/')
+
+    def test_resolves_every_kind_of_code(self):
+        match = self.scan('CEM-50').data['matches'][0]
+        self.assertEqual((match['kind'], match['material']['on_hand']), ('material', 120))
+        match = self.scan('B2').data['matches'][0]
+        self.assertEqual((match['kind'], match['batch']['quantity']), ('batch', 20))
+        self.assertEqual(match['batch']['location']['name'], 'Bay B')
+        match = self.scan('R-1').data['matches'][0]
+        self.assertEqual((match['kind'], match['movement']['quantity']), ('movement', 100))
+        match = self.scan('LOC-A').data['matches'][0]
+        self.assertEqual((match['kind'], match['location']['current_volume']), ('location', Decimal('4.000')))
+        self.assertEqual(self.scan('NOPE').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_one_query_then_cached_until_stock_changes(self):
+        # Each request also writes its audit log row
+        with self.assertNumQueries(2):
+            self.scan('B1')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.scan('B1').data['matches'][0]['batch']['quantity'], 100)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movement(
+                material=self.material, source_location=self.location,
+                movement_type='issue', quantity=30, batch_number='B1', reference_number='I-1'
+            )
+        self.assertEqual(self.scan('B1').data['matches'][0]['batch']['quantity'], 70)
+
+        # Emptied batches drop out of the index with their stock row
+        post_movement(
+            material=self.material, source_location=self.location,
+            movement_type='issue', quantity=70, batch_number='B1', reference_number='I-2'
+        )
+        self.assertFalse(ScanCode.objects.filter(code='B1').exists())
+
+    def test_rebuild_matches_maintained_index(self):
+        maintained = sorted(ScanCode.objects.values_list('code', 'kind'))
+        ScanCode.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_scan_index', stdout=out)
+        self.assertIn(f'Indexed {len(maintained)} scan code(s)', out.getvalue())
+        self.assertEqual(sorted(ScanCode.objects.values_list('code', 'kind')), maintained)
+
+
+class SyncTests(InventoryTestMixin, APITestCase):
+    def setUp(self):
+        self.create_inventory()
+        self.user = User.objects.create_user(username='tablet', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=100, batch_number='B1', reference_number='R-1'
+        )
+        # Everything so far was synced long ago, outside the re-read overlap
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        for model in (Warehouse, StorageLocation, RawMaterial, Stock):
+            model.objects.update(updated_at=an_hour_ago)
+
+    def sync(self, token=None, limit=2):
+        changes, deleted, pages = {}, {}, 0
+        more = True
+        while more:
+            params = {'limit': limit, **({'token': token} if token else {})}
+            response = self.client.get('/api/inventory/sync/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            for label, page in response.data['changes'].items():
+                changes.setdefault(label, []).extend(
+                    dict(zip(page['fields'], row)) for row in page['rows']
+                )
+            for label, ids in response.data['deleted'].items():
+                deleted.setdefault(label, []).extend(ids)
+            token, more = response.data['token'], response.data['more']
+            pages += 1
+        return changes, deleted, token, pages
+
+    def test_full_then_delta_sync(self):
+        changes, deleted, token, pages = self.sync()
+        self.assertEqual(
+            {label: len(rows) for label, rows in changes.items()},
+            {'inventory.warehouse': 1, 'inventory.storagelocation': 2, 'inventory.rawmaterial': 1, 'inventory.stock': 1}
+        )
+        self.assertEqual((deleted, pages), ({}, 3))
+        self.assertNotIn('on_hand', changes['inventory.rawmaterial'][0])
+
+        post_movement(
+            material=self.material, source_location=self.location,
+            movement_type='issue', quantity=30, batch_number='B1', reference_number='I-1'
+        )
+        removed = self.other_location.pk
+        self.other_location.delete()
+        changes, deleted, token, pages = self.sync(token)
+        self.assertEqual(list(changes), ['inventory.stock'])
+        self.assertEqual(changes['inventory.stock'][0]['quantity'], 70)
+        self.assertEqual(deleted, {'inventory.storagelocation': [removed]})
+
+    def test_rejects_forged_token(self):
+        response = self.client.get('/api/inventory/sync/', {'token': 'not-a-token'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_replay_is_idempotent(self):
+        first, second = str(uuid.uuid4()), str(uuid.uuid4())
+        queue = [
+            {'client_id': first, 'material': self.material.pk, 'movement_type': 'issue', 'quantity': 10,
+             'batch_number': 'B1', 'reference_number': 'T1-1', 'source_location': self.location.pk},
+            {'client_id': first, 'material': self.material.pk, 'movement_type': 'issue', 'quantity': 10,
+             'batch_number': 'B1', 'reference_number': 'T1-1', 'source_location': self.location.pk},
+            {'client_id': second, 'material': self.material.pk, 'movement_type': 'issue', 'quantity': 500,
+             'batch_number': 'B1', 'reference_number': 'T1-2', 'source_location': self.location.pk},
+            {'client_id': 'oops', 'material': self.material.pk},
+            'not a movement',
+            None,
+        ]
+        response = self.client.post('/api/inventory/sync/movements/', {'movements': queue}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['posted', 'duplicate', 'error', 'error', 'error', 'error']
+        )
+        posted_id = response.data['results'][0]['id']
+        self.assertEqual(response.data['results'][1]['id'], posted_id)
+
+        # The response was lost; the tablet uploads the same queue again
+        response = self.client.post('/api/inventory/sync/movements/', {'movements': queue[:1]}, format='json')
+        self.assertEqual(response.data['results'][0], {'line': 1, 'status': 'duplicate', 'id': posted_id})
+        self.assertEqual(Stock.objects.get(batch_number='B1').quantity, 90)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentPostingTests(InventoryTestMixin, TransactionTestCase):
+    """Hammer one batch from several threads; needs a backend with row locks"""
+
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 40
+    INITIAL_QUANTITY = 200
+
+    def setUp(self):
+        self.create_inventory()
+        post_movement(
+            material=self.material, destination_location=self.location,
+            movement_type='receipt', quantity=self.INITIAL_QUANTITY,
+            batch_number='B1', reference_number='R-0'
+        )
+
+    def _issue_worker(self, worker, results):
+        try:
+            for attempt in range(self.ATTEMPTS_PER_THREAD):
+                try:
+                    post_movement(
+                        material_id=self.material.pk,
+                        source_location_id=self.location.pk,
+                        movement_type='issue', quantity=1, batch_number='B1',
+                        reference_number=f'I-{worker}-{attempt}'
+                    )
+                    results.append('posted')
+                except ValidationError:
+                    results.append('rejected')
+        finally:
+            connection.close()
+
+    def test_concurrent_issues_never_lose_updates(self):
+        results = []
+        threads = [
+            threading.Thread(target=self._issue_worker, args=(worker, results))
+            for worker in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        attempts = self.THREADS * self.ATTEMPTS_PER_THREAD
+        self.assertEqual(len(results), attempts)
+        self.assertEqual(results.count('posted'), self.INITIAL_QUANTITY)
+
+        issued = StockMovement.objects.filter(movement_type='issue').aggregate(
+            total=Sum('quantity')
+        )['total']
+        remaining = Stock.objects.aggregate(total=Sum('quantity'))['total'] or 0
+        self.material.refresh_from_db()
+        self.assertEqual(issued, self.INITIAL_QUANTITY)
+        self.assertEqual(remaining, 0)
+        self.assertEqual(self.material.on_hand, remaining)
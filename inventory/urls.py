@@ -9,6 +9,12 @@ router.register(r'locations', views.StorageLocationViewSet)
 router.register(r'materials', views.RawMaterialViewSet)
 router.register(r'stock', views.StockViewSet)
 router.register(r'movements', views.StockMovementViewSet)
+router.register(r'cycle-counts', views.CycleCountViewSet)
+router.register(r'transfers', views.TransferDocumentViewSet)
+router.register(r'reservations', views.MaterialReservationViewSet)
+router.register(r'scan', views.ScanViewSet, basename='scan')
+router.register(r'sync', views.SyncViewSet, basename='sync')
+router.register(r'stock-matrix', views.StockMatrixViewSet, basename='stock-matrix')
 
 urlpatterns = [
     path('', include(router.urls)),
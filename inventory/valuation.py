@@ -0,0 +1,178 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from django.db.models import Sum
+from django.utils import timezone
+from .models import CostLayer, RawMaterial, StockMovement
+
+CENT = Decimal('0.01')
+UNIT_COST_PLACES = Decimal('0.0001')
+
+
+def _money(amount):
+    return Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _unit_cost(amount, quantity):
+    return (Decimal(amount) / quantity).quantize(UNIT_COST_PLACES, rounding=ROUND_HALF_UP)
+
+
+class MaterialLedger:
+    """
+    Running quantity and value of one locked material while movements post.
+
+    FIFO materials also carry their open cost layers, oldest first. Stock on
+    hand that no layer accounts for (held before the material switched to
+    FIFO) is treated as the oldest layer, valued at whatever value is left
+    over, so switching methods needs no rebuild.
+    """
+
+    def __init__(self, material):
+        self.material = material
+        self.quantity = material.on_hand
+        self.value = material.inventory_value
+        self.layers = []
+        self.new_layers = []
+        self.changed_layers = {}
+        self.emptied_layers = []
+        if material.valuation_method == 'fifo':
+            self.layers = list(
+                CostLayer.objects.select_for_update()
+                .filter(material=material, remaining__gt=0)
+                .order_by('received_at', 'pk')
+            )
+
+    def average_cost(self):
+        if self.quantity > 0:
+            return _unit_cost(self.value, self.quantity)
+        return Decimal(self.material.unit_price)
+
+    def receive(self, movement, quantity):
+        unit_cost = movement.unit_cost
+        if unit_cost is None:
+            unit_cost = (
+                self.material.unit_price if movement.movement_type == 'receipt'
+                else self.average_cost()
+            )
+        unit_cost = Decimal(unit_cost)
+        amount = _money(unit_cost * quantity)
+        if self.material.valuation_method == 'fifo':
+            layer = CostLayer(
+                material=self.material,
+                reference_number=movement.reference_number,
+                unit_cost=unit_cost,
+                quantity=quantity,
+                remaining=quantity,
+                received_at=timezone.now()
+            )
+            self.layers.append(layer)
+            self.new_layers.append(layer)
+        self.quantity += quantity
+        self.value += amount
+        return unit_cost, amount
+
+    def _fifo_cost(self, quantity):
+        untracked = self.quantity - sum(layer.remaining for layer in self.layers)
+        untracked_value = self.value - sum(
+            _money(layer.unit_cost * layer.remaining) for layer in self.layers
+        )
+        cost = Decimal(0)
+        needed = quantity
+        if untracked > 0:
+            take = min(untracked, needed)
+            cost += untracked_value if take == untracked else _money(untracked_value * take / untracked)
+            needed -= take
+        while needed and self.layers:
+            layer = self.layers[0]
+            take = min(layer.remaining, needed)
+            cost += _money(layer.unit_cost * take)
+            layer.remaining -= take
+            needed -= take
+            if layer.remaining == 0:
+                self.layers.pop(0)
+                if layer.pk:
+                    self.changed_layers.pop(layer.pk, None)
+                    self.emptied_layers.append(layer.pk)
+                else:
+                    self.new_layers.remove(layer)
+            elif layer.pk:
+                self.changed_layers[layer.pk] = layer
+        return cost
+
+    def issue(self, quantity):
+        if quantity >= self.quantity:
+            # Issuing everything takes the whole value, rounding residue included
+            cost = self.value
+            self.emptied_layers.extend(layer.pk for layer in self.layers if layer.pk)
+            self.layers, self.new_layers, self.changed_layers = [], [], {}
+        elif self.material.valuation_method == 'fifo':
+            cost = self._fifo_cost(quantity)
+        else:
+            cost = _money(self.value * quantity / self.quantity)
+        self.quantity -= quantity
+        self.value -= cost
+        return _unit_cost(cost, quantity), -cost
+
+    def save(self):
+        RawMaterial.objects.filter(pk=self.material.pk).update(inventory_value=self.value)
+        if self.emptied_layers:
+            CostLayer.objects.filter(pk__in=self.emptied_layers).delete()
+        if self.changed_layers:
+            CostLayer.objects.bulk_update(list(self.changed_layers.values()), ['remaining'])
+        if self.new_layers:
+            CostLayer.objects.bulk_create(self.new_layers)
+
+
+def value_movements(postings):
+    """
+    Cost ``(movement, net quantity)`` postings and update material valuations.
+
+    Must run inside the posting transaction, before on_hand is changed. Each
+    touched material row is locked in primary-key order, so the work is
+    proportional to the movements posted, not to the material's history.
+    Sets ``unit_cost`` and ``value`` on each unsaved movement.
+    """
+    material_ids = sorted({movement.material_id for movement, net in postings if net})
+    ledgers = {
+        material.pk: MaterialLedger(material)
+        for material in RawMaterial.objects.select_for_update()
+        .filter(pk__in=material_ids).order_by('pk')
+    }
+    for movement, net in postings:
+        if not net:
+            movement.value = Decimal(0)
+            continue
+        ledger = ledgers[movement.material_id]
+        if net > 0:
+            movement.unit_cost, movement.value = ledger.receive(movement, net)
+        else:
+            movement.unit_cost, movement.value = ledger.issue(-net)
+    for ledger in ledgers.values():
+        ledger.save()
+
+
+def valuation_as_of(moment, material_ids=None):
+    """
+    Per-material (quantity, value) at ``moment``.
+
+    Works back from the maintained inventory values by undoing the value of
+    movements posted since, so a month-end report only reads the movements
+    made after month end.
+    """
+    from .history import material_totals_as_of  # history imports services, which imports this module
+
+    materials = RawMaterial.objects.all()
+    if material_ids is not None:
+        materials = materials.filter(pk__in=material_ids)
+    current = dict(materials.values_list('pk', 'inventory_value'))
+
+    later = StockMovement.objects.filter(created_at__gte=moment, value__isnull=False)
+    if material_ids is not None:
+        later = later.filter(material_id__in=material_ids)
+    undo = defaultdict(Decimal, later.values('material_id').annotate(total=Sum('value')).values_list(
+        'material_id', 'total'
+    ))
+    quantities = material_totals_as_of(moment, material_ids)
+    return {
+        material_id: (quantities.get(material_id, 0), value - undo[material_id])
+        for material_id, value in current.items()
+    }
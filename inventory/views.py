@@ -2,23 +2,86 @@ from django.shortcuts import render
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Sum, F, Q, Count
+from django.db.models import Sum, F, Q, Count, Prefetch, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from .models import (
     Supplier, Warehouse, StorageLocation,
-    RawMaterial, Stock, StockMovement
+    RawMaterial, Stock, StockMovement, ReorderCandidate, ReplenishmentPlan,
+    MovementDailyRollup, MaterialClassification, SlottingProposal, CycleCount, CycleCountLine,
+    TransferDocument, TransferDocumentLine, MaterialReservation
 )
+from .changes import current_version
+from .cycle_counts import reconcile_cycle_count, record_counts, schedule_cycle_count
+from .expiry import expiring_stock, expiry_counters
+from .history import parse_as_of, stock_as_of, warehouse_location_ids
+from .putaway import suggest_putaway
+from .scanning import resolve_scan
+from .sync import SYNC_MAX_PAGE_SIZE, SYNC_PAGE_SIZE, InvalidToken, replay_movements, sync_changes
+from .services import (
+    allocate_issue, delete_stock_record, post_movements_bulk, post_transfer_document, save_stock_edit
+)
+from .valuation import valuation_as_of
+from .warehouse_analytics import available_locations, utilization_by_type, utilization_history
 from .serializers import (
     SupplierSerializer, WarehouseSerializer, WarehouseDetailSerializer,
     StorageLocationSerializer, RawMaterialSerializer, RawMaterialDetailSerializer,
-    StockSerializer, StockMovementSerializer
+    StockSerializer, StockMovementSerializer, ReorderCandidateSerializer,
+    PutawayRequestSerializer, AllocationRequestSerializer, ReplenishmentPlanSerializer,
+    MaterialClassificationSerializer, SlottingProposalSerializer,
+    CycleCountSerializer, CycleCountDetailSerializer, CycleCountScheduleSerializer,
+    CountSubmissionSerializer, TransferDocumentSerializer, TransferRequestSerializer,
+    MaterialReservationSerializer
 )
+import csv
+import datetime
 import logging
+from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
+AS_OF_PARAMETER = OpenApiParameter(
+    name="as_of",
+    description=(
+        "Rebuild quantities as they were at this point in time from the movement "
+        "ledger (YYYY-MM-DD for the end of that day, or an ISO datetime)"
+    ),
+    required=False,
+    type=str
+)
+
+class ExpiryCursorPagination(CursorPagination):
+    """Keyset pages over the expiry index, stable while stock changes"""
+    ordering = ('expiry_date', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+# Movements shown on the material detail page
+RECENT_MOVEMENTS = 5
+
+
+def recent_movements(limit):
+    """
+    The latest ``limit`` movements of every material, for a Prefetch.
+
+    A row number over each material's movements keeps the window in SQL, so
+    prefetching for many materials is still one query.
+    """
+    return StockMovement.objects.annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=[F('material_id')],
+            order_by=[F('created_at').desc(), F('pk').desc()]
+        )
+    ).filter(position__lte=limit).order_by('material_id', 'position')
+
 # Create your views here.
 
 @extend_schema_view(
@@ -107,7 +170,9 @@ class WarehouseViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         logger.debug("Fetching warehouses queryset")
-        queryset = Warehouse.objects.all()
+        queryset = Warehouse.objects.select_related('manager')
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related('storage_locations')
         location = self.request.query_params.get('location', None)
         if location:
             logger.info(f"Filtering warehouses by location: {location}")
@@ -129,6 +194,7 @@ class WarehouseViewSet(viewsets.ModelViewSet):
                         "properties": {
                             "capacity": {"type": "number"},
                             "utilized": {"type": "number"},
+                            "free": {"type": "number"},
                             "location_count": {"type": "integer"}
                         }
                     }
@@ -153,36 +219,29 @@ class WarehouseViewSet(viewsets.ModelViewSet):
         logger.info(f"Generating storage analysis for warehouse {pk}")
         try:
             warehouse = self.get_object()
-            locations = warehouse.storage_locations.all()
+            by_type = utilization_by_type([warehouse.pk])
 
             analysis = {
                 'total_capacity': warehouse.capacity,
-                'total_utilized': sum(loc.current_volume for loc in locations),
-                'utilization_by_type': {},
-                'available_locations': []
-            }
-
-            # Analyze utilization by location type
-            for loc in locations:
-                if loc.location_type not in analysis['utilization_by_type']:
-                    analysis['utilization_by_type'][loc.location_type] = {
-                        'capacity': 0,
-                        'utilized': 0,
-                        'location_count': 0
+                'total_utilized': warehouse.current_volume,
+                'utilization_by_type': {
+                    row['location_type']: {
+                        'capacity': row['capacity'],
+                        'utilized': row['used'],
+                        'free': row['free'],
+                        'location_count': row['location_count']
                     }
-                
-                type_stats = analysis['utilization_by_type'][loc.location_type]
-                type_stats['capacity'] += loc.capacity
-                type_stats['utilized'] += loc.current_volume
-                type_stats['location_count'] += 1
-
-                # Check for available space
-                if loc.current_volume < loc.capacity:
-                    analysis['available_locations'].append({
-                        'location': loc.name,
-                        'type': loc.location_type,
-                        'available_space': loc.capacity - loc.current_volume
-                    })
+                    for row in by_type
+                },
+                'available_locations': [
+                    {
+                        'location': row['name'],
+                        'type': row['location_type'],
+                        'available_space': row['available_space']
+                    }
+                    for row in available_locations(warehouse.pk)
+                ]
+            }
 
             logger.info(f"Successfully generated storage analysis for warehouse {pk}")
             return Response(analysis)
@@ -193,6 +252,36 @@ class WarehouseViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @extend_schema(
+        summary="Get warehouse utilization history",
+        description=(
+            "Returns the hourly utilization snapshots of the warehouse, oldest first, "
+            "with totals and a breakdown by location type"
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="days",
+                description="Number of days of history to return (default 7)",
+                required=False,
+                type=int
+            )
+        ]
+    )
+    @action(detail=True)
+    def utilization_history(self, request, pk=None):
+        """Get hourly utilization history"""
+        try:
+            days = int(request.query_params.get('days', 7))
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        warehouse = self.get_object()
+        since = timezone.now() - datetime.timedelta(days=days)
+        return Response({
+            'warehouse': warehouse.pk,
+            'capacity': warehouse.capacity,
+            'history': utilization_history(warehouse.pk, since)
+        })
+
 @extend_schema_view(
     list=extend_schema(
         summary="List all storage locations",
@@ -236,7 +325,7 @@ class StorageLocationViewSet(viewsets.ModelViewSet):
         logger.info(f"Fetching stock list for location {pk}")
         try:
             location = self.get_object()
-            stocks = location.stock_records.all()
+            stocks = location.stock_records.select_related('material', 'location')
             logger.info(f"Successfully fetched stock list for location {pk}")
             return Response(StockSerializer(stocks, many=True).data)
         except Exception as e:
@@ -246,10 +335,81 @@ class StorageLocationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @extend_schema(
+        summary="Suggest putaway locations",
+        description=(
+            "Returns a ranked plan of storage locations for receiving a quantity of a "
+            "material into a warehouse, split across locations when no single one has room"
+        ),
+        request=PutawayRequestSerializer
+    )
+    @action(detail=False, methods=['post'])
+    def putaway(self, request):
+        """Suggest where to store incoming material"""
+        serializer = PutawayRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        material = data['material']
+        logger.info(
+            f"Suggesting putaway for {data['quantity']} of material {material.pk} "
+            f"in warehouse {data['warehouse'].pk}"
+        )
+        try:
+            suggestion = suggest_putaway(
+                material,
+                data['quantity'],
+                data['warehouse'].pk,
+                location_types=data.get('location_types') or None,
+                temperature_controlled=data.get('temperature_controlled')
+            )
+            return Response({
+                'material': material.pk,
+                'quantity': data['quantity'],
+                'warehouse': data['warehouse'].pk,
+                'volume_per_unit': material.volume_per_unit,
+                **suggestion
+            })
+        except Exception as e:
+            logger.error(f"Error suggesting putaway: {str(e)}")
+            return Response(
+                {'error': 'Error suggesting putaway'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @extend_schema(
+        summary="Get slotting proposals",
+        description=(
+            "Returns the moves proposed by the nightly classification job to bring "
+            "A-class materials into the most accessible locations, most accessible "
+            "targets first"
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="warehouse",
+                description="Filter by warehouse ID",
+                required=False,
+                type=int
+            )
+        ],
+        responses={200: SlottingProposalSerializer(many=True)}
+    )
+    @action(detail=False, methods=['get'])
+    def slotting(self, request):
+        """Get the stored slotting proposals"""
+        proposals = SlottingProposal.objects.select_related('material', 'from_location', 'to_location')
+        warehouse = request.query_params.get('warehouse', None)
+        if warehouse:
+            proposals = proposals.filter(to_location__warehouse_id=warehouse)
+        page = self.paginate_queryset(proposals)
+        if page is not None:
+            return self.get_paginated_response(SlottingProposalSerializer(page, many=True).data)
+        return Response(SlottingProposalSerializer(proposals, many=True).data)
+
 @extend_schema_view(
     list=extend_schema(
         summary="List all raw materials",
-        description="Returns a list of all raw materials with optional filtering"
+        description="Returns a list of all raw materials with optional filtering",
+        parameters=[AS_OF_PARAMETER]
     ),
     create=extend_schema(
         summary="Create a new raw material",
@@ -257,7 +417,8 @@ class StorageLocationViewSet(viewsets.ModelViewSet):
     ),
     retrieve=extend_schema(
         summary="Get a specific raw material",
-        description="Returns the details of a specific raw material"
+        description="Returns the details of a specific raw material",
+        parameters=[AS_OF_PARAMETER]
     )
 )
 class RawMaterialViewSet(viewsets.ModelViewSet):
@@ -277,12 +438,81 @@ class RawMaterialViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         logger.debug("Fetching raw materials queryset")
         queryset = RawMaterial.objects.all()
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'stock_records',
+                    queryset=Stock.objects.select_related('location__warehouse')
+                ),
+                Prefetch(
+                    'movements',
+                    queryset=recent_movements(RECENT_MOVEMENTS),
+                    to_attr='recent_movement_list'
+                )
+            )
         category = self.request.query_params.get('category', None)
         if category:
             logger.info(f"Filtering raw materials by category: {category}")
             queryset = queryset.filter(category=category)
         return queryset
 
+    def _apply_as_of(self, items, moment):
+        """Replace current stock figures with the ones at ``moment``"""
+        material_ids = [item['id'] for item in items]
+        balances = stock_as_of(moment, material_ids=material_ids)
+        values = valuation_as_of(moment, material_ids=material_ids)
+        totals = {}
+        for (material_id, _, _), quantity in balances.items():
+            totals[material_id] = totals.get(material_id, 0) + quantity
+        for item in items:
+            item['as_of'] = moment
+            item['current_stock'] = totals.get(item['id'], 0)
+            item['stock_value'] = values[item['id']][1]
+            if 'stock_by_location' in item:
+                locations = StorageLocation.objects.select_related('warehouse').in_bulk(
+                    {location_id for material_id, location_id, _ in balances if material_id == item['id']}
+                )
+                item['stock_by_location'] = [
+                    {
+                        'location': str(locations[location_id]),
+                        'quantity': quantity,
+                        'batch_number': batch_number,
+                    }
+                    for (material_id, location_id, batch_number), quantity in sorted(balances.items())
+                    if material_id == item['id'] and location_id in locations
+                ]
+
+    def list(self, request, *args, **kwargs):
+        as_of = request.query_params.get('as_of', None)
+        try:
+            moment = parse_as_of(as_of) if as_of else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = super().list(request, *args, **kwargs)
+        if moment:
+            logger.info(f"Rebuilding material stock as of {moment}")
+            items = response.data['results'] if isinstance(response.data, dict) else response.data
+            try:
+                self._apply_as_of(items, moment)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        as_of = request.query_params.get('as_of', None)
+        try:
+            moment = parse_as_of(as_of) if as_of else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = super().retrieve(request, *args, **kwargs)
+        if moment:
+            logger.info(f"Rebuilding material {kwargs.get('pk')} stock as of {moment}")
+            try:
+                self._apply_as_of([response.data], moment)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return response
+
     @extend_schema(
         summary="Get stock analysis for the material",
         description="Returns analysis of stock levels for the specified material",
@@ -303,19 +533,28 @@ class RawMaterialViewSet(viewsets.ModelViewSet):
             material = self.get_object()
             
             # Calculate consumption rate
-            start_date = request.query_params.get(
-                'start_date',
-                (timezone.now() - timezone.timedelta(days=90)).date()
-            )
+            start_date = request.query_params.get('start_date', None)
+            try:
+                start_date = (
+                    datetime.date.fromisoformat(start_date) if start_date
+                    else timezone.localdate() - datetime.timedelta(days=90)
+                )
+            except ValueError:
+                return Response(
+                    {'error': 'start_date must be YYYY-MM-DD'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            consumption = material.movements.filter(
+            consumption = material.movement_rollups.filter(
                 movement_type='issue',
-                created_at__date__gte=start_date
+                date__gte=start_date
             ).aggregate(
                 total=Sum('quantity')
             )['total'] or 0
             
-            daily_consumption = consumption / 90  # Average daily consumption
+            days = max((timezone.localdate() - start_date).days, 1)
+            daily_consumption = consumption / days  # Average daily consumption
+            plan = ReplenishmentPlan.objects.filter(material=material).first()
             
             analysis = {
                 'current_stock': material.current_stock,
@@ -330,7 +569,8 @@ class RawMaterialViewSet(viewsets.ModelViewSet):
                 ) if daily_consumption > 0 else None,
                 'days_of_stock': round(
                     material.current_stock / daily_consumption
-                ) if daily_consumption > 0 else None
+                ) if daily_consumption > 0 else None,
+                'replenishment': ReplenishmentPlanSerializer(plan).data if plan else None
             }
             
             logger.info(f"Successfully generated stock analysis for material {pk}")
@@ -342,10 +582,138 @@ class RawMaterialViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @extend_schema(
+        summary="Get inventory valuation",
+        description=(
+            "Returns quantity and cost value per active material under its valuation "
+            "method (weighted average or FIFO cost layers), with a grand total. "
+            "Without as_of the maintained current values are read directly."
+        ),
+        parameters=[AS_OF_PARAMETER]
+    )
+    @action(detail=False, methods=['get'])
+    def valuation(self, request):
+        """Get current or period-end inventory valuation"""
+        as_of = request.query_params.get('as_of', None)
+        try:
+            moment = parse_as_of(as_of) if as_of else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        materials = RawMaterial.objects.filter(active=True).order_by('code').values(
+            'id', 'code', 'name', 'unit', 'valuation_method', 'on_hand', 'inventory_value'
+        )
+        if moment:
+            logger.info(f"Generating inventory valuation as of {moment}")
+            try:
+                values = valuation_as_of(moment)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        rows = []
+        for row in materials:
+            quantity, value = (
+                values[row['id']] if moment else (row['on_hand'], row['inventory_value'])
+            )
+            rows.append({
+                'material': row['id'],
+                'code': row['code'],
+                'name': row['name'],
+                'unit': row['unit'],
+                'valuation_method': row['valuation_method'],
+                'quantity': quantity,
+                'value': value,
+                'unit_cost': round(value / quantity, 4) if quantity else None,
+            })
+        return Response({
+            'as_of': moment,
+            'total_value': sum((row['value'] for row in rows), Decimal(0)),
+            'materials': rows,
+        })
+
+    @extend_schema(
+        summary="Get replenishment plans",
+        description=(
+            "Returns demand statistics, safety stock, reorder point, economic order "
+            "quantity and projected stockout date per material, as computed by the "
+            "nightly planning job. Soonest stockouts come first."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="stockout_before",
+                description="Only materials projected to run out on or before this date (YYYY-MM-DD)",
+                required=False,
+                type=str
+            )
+        ],
+        responses={200: ReplenishmentPlanSerializer(many=True)}
+    )
+    @action(detail=False, methods=['get'])
+    def replenishment(self, request):
+        """Get the stored replenishment plans"""
+        plans = ReplenishmentPlan.objects.select_related('material')
+        stockout_before = request.query_params.get('stockout_before', None)
+        if stockout_before:
+            try:
+                plans = plans.filter(stockout_date__lte=datetime.date.fromisoformat(stockout_before))
+            except ValueError:
+                return Response(
+                    {'error': 'stockout_before must be YYYY-MM-DD'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        page = self.paginate_queryset(plans)
+        if page is not None:
+            return self.get_paginated_response(ReplenishmentPlanSerializer(page, many=True).data)
+        return Response(ReplenishmentPlanSerializer(plans, many=True).data)
+
+    @extend_schema(
+        summary="Get ABC/XYZ classification",
+        description=(
+            "Returns each material's ABC class (share of yearly consumption value) and "
+            "XYZ class (variability of weekly demand), as computed by the nightly "
+            "classification job"
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="abc_class",
+                description="Filter by ABC class (A, B or C)",
+                required=False,
+                type=str
+            ),
+            OpenApiParameter(
+                name="xyz_class",
+                description="Filter by XYZ class (X, Y or Z)",
+                required=False,
+                type=str
+            )
+        ],
+        responses={200: MaterialClassificationSerializer(many=True)}
+    )
+    @action(detail=False, methods=['get'])
+    def classification(self, request):
+        """Get the stored material classification"""
+        classifications = MaterialClassification.objects.select_related('material')
+        for field in ('abc_class', 'xyz_class'):
+            value = request.query_params.get(field, None)
+            if value:
+                classifications = classifications.filter(**{field: value.upper()})
+        page = self.paginate_queryset(classifications)
+        if page is not None:
+            return self.get_paginated_response(MaterialClassificationSerializer(page, many=True).data)
+        return Response(MaterialClassificationSerializer(classifications, many=True).data)
+
 @extend_schema_view(
     list=extend_schema(
         summary="List all stock",
-        description="Returns a list of all stock with optional filtering"
+        description="Returns a list of all stock with optional filtering",
+        parameters=[
+            AS_OF_PARAMETER,
+            OpenApiParameter(
+                name="warehouse",
+                description="Filter by warehouse ID",
+                required=False,
+                type=int
+            )
+        ]
     ),
     create=extend_schema(
         summary="Create new stock",
@@ -367,7 +735,7 @@ class StockViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         logger.debug("Fetching stock queryset")
-        queryset = Stock.objects.all()
+        queryset = Stock.objects.select_related('material', 'location')
         material = self.request.query_params.get('material', None)
         location = self.request.query_params.get('location', None)
 
@@ -376,29 +744,127 @@ class StockViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(material__id=material)
         if location:
             logger.info(f"Filtering stock by location: {location}")
-            queryset = queryset.filter(storage_location__id=location)
+            queryset = queryset.filter(location__id=location)
 
         return queryset
 
+    def perform_create(self, serializer):
+        self.save_edit(serializer, Stock(**serializer.validated_data))
+
+    def perform_update(self, serializer):
+        stock = serializer.instance
+        for field, value in serializer.validated_data.items():
+            setattr(stock, field, value)
+        self.save_edit(serializer, stock)
+
+    def save_edit(self, serializer, stock):
+        """Post quantity changes as adjustments; an emptied record is answered as it was left"""
+        try:
+            saved = save_stock_edit(stock, performed_by=self.request.user)
+        except DjangoValidationError as e:
+            raise ValidationError({'detail': e.messages})
+        if saved is None:
+            stock.quantity = 0
+        serializer.instance = saved or stock
+
+    def perform_destroy(self, instance):
+        try:
+            delete_stock_record(instance, performed_by=self.request.user)
+        except DjangoValidationError as e:
+            raise ValidationError({'detail': e.messages})
+
+    def list(self, request, *args, **kwargs):
+        as_of = request.query_params.get('as_of', None)
+        if not as_of:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            moment = parse_as_of(as_of)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        logger.info(f"Rebuilding stock as of {moment}")
+        ids = {}
+        for name in ('material', 'location', 'warehouse'):
+            value = request.query_params.get(name, None)
+            try:
+                ids[name] = int(value) if value else None
+            except ValueError:
+                return Response({'error': f'{name} must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+        location_ids = None
+        if ids['warehouse'] is not None:
+            location_ids = warehouse_location_ids(ids['warehouse'])
+        if ids['location'] is not None:
+            location_ids = {ids['location']} & location_ids if location_ids is not None else {ids['location']}
+
+        try:
+            balances = stock_as_of(
+                moment,
+                material_ids=[ids['material']] if ids['material'] is not None else None,
+                location_ids=location_ids
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        rows = [
+            {
+                'material': material_id,
+                'location': location_id,
+                'batch_number': batch_number,
+                'quantity': quantity,
+                'as_of': moment,
+            }
+            for (material_id, location_id, batch_number), quantity in sorted(balances.items())
+        ]
+
+        page = self.paginate_queryset(rows)
+        page_rows = page if page is not None else rows
+        materials = RawMaterial.objects.in_bulk({row['material'] for row in page_rows})
+        locations = StorageLocation.objects.in_bulk({row['location'] for row in page_rows})
+        for row in page_rows:
+            row['material_name'] = materials[row['material']].name
+            row['unit'] = materials[row['material']].unit
+            row['location_name'] = locations[row['location']].name
+        if page is not None:
+            return self.get_paginated_response(page_rows)
+        return Response(page_rows)
+
     @extend_schema(
         summary="Get list of expiring stock",
-        description="Returns a list of stock items that are expiring soon"
+        description=(
+            "Returns stock items expiring within the given number of days, soonest first. "
+            "Pages are keyset (cursor) paginated: follow the 'next' link to continue."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="days",
+                description="Look-ahead in days (default 90)",
+                required=False,
+                type=int
+            ),
+            OpenApiParameter(
+                name="warehouse",
+                description="Filter by warehouse ID",
+                required=False,
+                type=int
+            )
+        ]
     )
-    @action(detail=False)
+    @action(detail=False, pagination_class=ExpiryCursorPagination)
     def expiring_soon(self, request):
         """Get list of stock expiring soon"""
         logger.info("Checking for expiring stock items")
         try:
             days = int(request.query_params.get('days', 90))
-            expiry_date = timezone.now().date() + timezone.timedelta(days=days)
-            
-            stocks = self.queryset.filter(
-                expiry_date__lte=expiry_date,
-                expiry_date__gte=timezone.now().date()
-            ).order_by('expiry_date')
-            
-            logger.info(f"Found {len(stocks)} expiring stock items")
-            return Response(StockSerializer(stocks, many=True).data)
+            warehouse = request.query_params.get('warehouse', None)
+            warehouse = int(warehouse) if warehouse else None
+        except ValueError:
+            return Response(
+                {'error': 'days and warehouse must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            page = self.paginate_queryset(expiring_stock(days, warehouse_id=warehouse))
+            return self.get_paginated_response(StockSerializer(page, many=True).data)
         except Exception as e:
             logger.error(f"Error checking expiring stock items: {str(e)}")
             return Response(
@@ -406,19 +872,56 @@ class StockViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @extend_schema(
+        summary="Get expiring stock counters",
+        description=(
+            "Returns batches and quantity expiring within 7, 30 and 90 days, read from the "
+            "buckets the nightly expiry job writes"
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="warehouse",
+                description="Filter by warehouse ID",
+                required=False,
+                type=int
+            )
+        ]
+    )
+    @action(detail=False)
+    def expiry_summary(self, request):
+        """Get expiring stock counters for the dashboard"""
+        warehouse = request.query_params.get('warehouse', None)
+        try:
+            warehouse = int(warehouse) if warehouse else None
+        except ValueError:
+            return Response(
+                {'error': 'warehouse must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(expiry_counters(warehouse_id=warehouse))
+
     @extend_schema(
         summary="Get list of low stock",
-        description="Returns a list of stock items that are low"
+        description="Returns materials at or below their reorder point or minimum stock",
+        parameters=[
+            OpenApiParameter(
+                name="severity",
+                description="Filter by severity (reorder, critical)",
+                required=False,
+                type=str
+            )
+        ],
+        responses={200: ReorderCandidateSerializer(many=True)}
     )
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
         logger.info("Checking for low stock items")
         try:
-            low_stock_items = Stock.objects.filter(
-                Q(quantity_on_hand__lte=F('reorder_point')) |
-                Q(quantity_on_hand__lte=F('minimum_stock_level'))
-            )
-            serializer = self.get_serializer(low_stock_items, many=True)
+            candidates = ReorderCandidate.objects.select_related('material')
+            severity = request.query_params.get('severity', None)
+            if severity:
+                candidates = candidates.filter(severity=severity)
+            serializer = ReorderCandidateSerializer(candidates, many=True)
             logger.info(f"Found {len(serializer.data)} low stock items")
             return Response(serializer.data)
         except Exception as e:
@@ -428,6 +931,184 @@ class StockViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class ScanViewSet(viewsets.ViewSet):
+    """
+    Barcode lookup for warehouse handhelds.
+    """
+    lookup_field = 'code'
+    lookup_value_regex = '[^/]+'
+
+    @extend_schema(
+        summary="Resolve a scanned code",
+        description=(
+            "Looks a scanned code up in the scan index: a material code, batch number, "
+            "movement reference number or storage location barcode. Returns every "
+            "matching entity with its current quantities, from one indexed query or the cache."
+        ),
+        responses={200: {
+            "type": "object",
+            "properties": {
+                "code": {"type": "string"},
+                "matches": {"type": "array", "items": {"type": "object"}}
+            }
+        }}
+    )
+    def retrieve(self, request, code=None):
+        matches = resolve_scan(code)
+        if not matches:
+            return Response({'error': f'Unknown code {code}'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'code': code, 'matches': matches})
+
+class SyncViewSet(viewsets.ViewSet):
+    """
+    Delta sync for offline warehouse and shop-floor clients.
+    """
+
+    @extend_schema(
+        summary="Get changes since a sync token",
+        description=(
+            "Returns one page of the inventory and production rows created or updated "
+            "since the token, as field names plus row arrays per model, and the ids "
+            "deleted since then. Without a token every row is sent. Keep calling with "
+            "the returned token while more is true, then store it for the next sync."
+        ),
+        parameters=[
+            OpenApiParameter(name="token", description="Token returned by the previous call", required=False, type=str),
+            OpenApiParameter(
+                name="limit",
+                description=f"Rows per page (default {SYNC_PAGE_SIZE}, at most {SYNC_MAX_PAGE_SIZE})",
+                required=False,
+                type=int
+            )
+        ],
+        responses={200: {
+            "type": "object",
+            "properties": {
+                "changes": {"type": "object"},
+                "deleted": {"type": "object"},
+                "token": {"type": "string"},
+                "more": {"type": "boolean"}
+            }
+        }}
+    )
+    def list(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', SYNC_PAGE_SIZE)), SYNC_MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            changes, deleted, token, more = sync_changes(request.query_params.get('token'), limit)
+        except InvalidToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'changes': changes, 'deleted': deleted, 'token': token, 'more': more})
+
+    @extend_schema(
+        summary="Replay movements queued offline",
+        description=(
+            "Posts stock movements recorded while a client was offline. Each movement "
+            "carries a client_id (UUID); movements already posted under their client_id "
+            "are answered as duplicates with the original id, so uploads can be retried "
+            "safely. Movements are accepted or rejected one by one."
+        ),
+        request={"application/json": {
+            "type": "object",
+            "properties": {"movements": {"type": "array", "items": {"type": "object"}}}
+        }}
+    )
+    @action(detail=False, methods=['post'])
+    def movements(self, request):
+        """Replay queued offline movements"""
+        rows = request.data.get('movements') if isinstance(request.data, dict) else None
+        if not isinstance(rows, list):
+            return Response({'error': 'Expected a list of movements'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            results = replay_movements(rows, performed_by=request.user)
+        except DjangoValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        counts = {
+            state: sum(1 for result in results if result['status'] == state)
+            for state in ('posted', 'duplicate', 'error')
+        }
+        logger.info(f"Replayed offline movements: {counts}")
+        return Response({**counts, 'results': results})
+
+class StockMatrixViewSet(viewsets.ViewSet):
+    """
+    Materials x warehouses stock pivot for the planning screen.
+    """
+
+    @extend_schema(
+        summary="Get the materials x warehouses stock matrix",
+        description=(
+            "Returns stock of every active material in every active warehouse, computed "
+            "with one grouped query. Materials and warehouses are returned as columns; "
+            "cells lists only the non-zero (material, warehouse, quantity) triples as "
+            "three parallel arrays. The response carries an ETag that changes whenever "
+            "stock changes, so a request with If-None-Match is answered with 304 until then."
+        ),
+        responses={200: {
+            "type": "object",
+            "properties": {
+                "version": {"type": "integer"},
+                "materials": {"type": "object"},
+                "warehouses": {"type": "object"},
+                "cells": {"type": "object"}
+            }
+        }}
+    )
+    def list(self, request):
+        # Read the version before the data, so a change made while the matrix
+        # is being built leaves it with an older tag and forces a refetch.
+        version = current_version()
+        etag = quote_etag(f"stock-matrix-{version}")
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        logger.info(f"Building stock matrix at version {version}")
+        materials = list(
+            RawMaterial.objects.filter(active=True).order_by('code')
+            .values_list('pk', 'code', 'name', 'unit')
+        )
+        warehouses = list(
+            Warehouse.objects.filter(active=True).order_by('code').values_list('pk', 'code', 'name')
+        )
+        cells = (
+            Stock.objects.filter(
+                material__active=True,
+                location__warehouse__active=True,
+                quantity__gt=0
+            )
+            .values_list('material_id', 'location__warehouse_id')
+            .annotate(total=Sum('quantity'))
+            .order_by('material_id', 'location__warehouse_id')
+        )
+        cell_columns = {'material': [], 'warehouse': [], 'quantity': []}
+        for material_id, warehouse_id, total in cells:
+            cell_columns['material'].append(material_id)
+            cell_columns['warehouse'].append(warehouse_id)
+            cell_columns['quantity'].append(total)
+
+        response = Response({
+            'version': version,
+            'materials': {
+                'id': [row[0] for row in materials],
+                'code': [row[1] for row in materials],
+                'name': [row[2] for row in materials],
+                'unit': [row[3] for row in materials],
+            },
+            'warehouses': {
+                'id': [row[0] for row in warehouses],
+                'code': [row[1] for row in warehouses],
+                'name': [row[2] for row in warehouses],
+            },
+            'cells': cell_columns,
+        })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 @extend_schema_view(
     list=extend_schema(
         summary="List all stock movements",
@@ -468,9 +1149,17 @@ class StockMovementViewSet(viewsets.ModelViewSet):
             logger.error(f"Error creating stock movement: {str(e)}")
             raise
 
+    def perform_create(self, serializer):
+        try:
+            serializer.save()
+        except DjangoValidationError as e:
+            raise ValidationError({'detail': e.messages})
+
     def get_queryset(self):
         logger.debug("Fetching stock movements queryset")
-        queryset = StockMovement.objects.all()
+        queryset = StockMovement.objects.select_related(
+            'material', 'source_location', 'destination_location', 'performed_by'
+        )
         stock = self.request.query_params.get('stock', None)
         movement_type = self.request.query_params.get('movement_type', None)
 
@@ -505,16 +1194,16 @@ class StockMovementViewSet(viewsets.ModelViewSet):
                 (timezone.now() - timezone.timedelta(days=90)).date()
             )
             
-            movements = self.queryset.filter(created_at__date__gte=start_date)
+            rollups = MovementDailyRollup.objects.filter(date__gte=start_date)
             
             analysis = {
-                'total_movements': movements.count(),
-                'by_type': movements.values('movement_type').annotate(
-                    count=Count('id'),
+                'total_movements': rollups.aggregate(total=Sum('count'))['total'] or 0,
+                'by_type': rollups.values('movement_type').annotate(
+                    count=Sum('count'),
                     total_quantity=Sum('quantity')
-                ),
-                'by_material': movements.values('material__name').annotate(
-                    count=Count('id'),
+                ).order_by('movement_type'),
+                'by_material': rollups.values('material__name').annotate(
+                    count=Sum('count'),
                     total_quantity=Sum('quantity')
                 ).order_by('-total_quantity')[:10]
             }
@@ -527,3 +1216,302 @@ class StockMovementViewSet(viewsets.ModelViewSet):
                 {'error': 'Error generating movement analysis'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+    @extend_schema(
+        summary="Post stock movements in bulk",
+        description=(
+            "Posts thousands of movement lines in one request. Send a JSON array of "
+            "movements (or {\"movements\": [...]}) or a CSV file with Content-Type "
+            "text/csv and a header row using the same field names. Returns one result "
+            "per line."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name="mode",
+                description="'atomic' (default) rejects every line if any line fails; "
+                            "'partial' commits the valid lines",
+                required=False,
+                type=str
+            )
+        ]
+    )
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Post a file of stock movements"""
+        mode = request.query_params.get('mode', 'atomic')
+        if mode not in ('atomic', 'partial'):
+            return Response(
+                {'error': "mode must be 'atomic' or 'partial'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if (request.content_type or '').startswith('text/csv'):
+            stream = request.stream
+            lines = (
+                line.decode('utf-8-sig') for line in iter(stream.readline, b'')
+            ) if stream else iter(())
+            rows = csv.DictReader(lines)
+        else:
+            rows = request.data
+            if isinstance(rows, dict):
+                rows = rows.get('movements')
+            if not isinstance(rows, list):
+                return Response(
+                    {'error': 'Expected a list of movements'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        logger.info(f"Posting bulk stock movements in {mode} mode")
+        try:
+            committed, results = post_movements_bulk(
+                rows,
+                atomic=(mode == 'atomic'),
+                performed_by=request.user
+            )
+        except DjangoValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        except (UnicodeDecodeError, csv.Error) as e:
+            # CSV lines are read as they are parsed, before anything is posted
+            return Response({'error': [f"Malformed CSV file: {e}"]}, status=status.HTTP_400_BAD_REQUEST)
+
+        posted = sum(1 for result in results if result['status'] == 'posted')
+        logger.info(f"Bulk posting finished: {posted} of {len(results)} lines posted")
+        return Response(
+            {
+                'committed': committed,
+                'posted': posted,
+                'rejected': sum(1 for result in results if result['status'] == 'error'),
+                'results': results
+            },
+            status=status.HTTP_201_CREATED if committed else status.HTTP_400_BAD_REQUEST
+        )
+
+    @extend_schema(
+        summary="Allocate and issue stock by batch",
+        description=(
+            "Issues a quantity of a material from a warehouse, picking batches "
+            "first-expired-first-out ('fefo', default) or first-in-first-out ('fifo'). "
+            "One issue movement is posted per batch, numbered <reference_number>-1, -2, ..., "
+            "all in one transaction."
+        ),
+        request=AllocationRequestSerializer,
+        responses={201: StockMovementSerializer(many=True)}
+    )
+    @action(detail=False, methods=['post'])
+    def allocate(self, request):
+        """Issue material across batches in FEFO/FIFO order"""
+        serializer = AllocationRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        logger.info(
+            f"Allocating {data['quantity']} of material {data['material'].pk} "
+            f"from warehouse {data['warehouse'].pk} ({data['strategy']})"
+        )
+        try:
+            movements = allocate_issue(
+                data['material'],
+                data['quantity'],
+                data['warehouse'].pk,
+                data['reference_number'],
+                strategy=data['strategy'],
+                include_expired=data['include_expired'],
+                performed_by=request.user,
+                notes=data['notes']
+            )
+        except DjangoValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        logger.info(f"Allocation {data['reference_number']} posted {len(movements)} movement(s)")
+        return Response(
+            StockMovementSerializer(movements, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+@extend_schema_view(
+    list=extend_schema(
+        summary="List cycle counts",
+        description="Returns the scheduled cycle counts with their line and counted totals"
+    ),
+    retrieve=extend_schema(
+        summary="Get a cycle count",
+        description="Returns a cycle count with the batches to count and their results"
+    )
+)
+class CycleCountViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for cycle counting: scheduling count lists, taking scanner
+    submissions and posting the variances.
+    """
+    queryset = CycleCount.objects.all()
+    serializer_class = CycleCountSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['warehouse', 'status', 'scheduled_for']
+
+    def get_queryset(self):
+        queryset = CycleCount.objects.select_related('warehouse').annotate(
+            line_count=Count('lines'),
+            counted_count=Count('lines', filter=Q(lines__counted_quantity__isnull=False))
+        )
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                Prefetch('lines', queryset=CycleCountLine.objects.select_related('material', 'location'))
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return CycleCountDetailSerializer
+        return CycleCountSerializer
+
+    @extend_schema(
+        summary="Schedule a cycle count",
+        description=(
+            "Creates the count list of a warehouse for a day (today by default) from the "
+            "batches most overdue for counting given their material's ABC class. "
+            "Returns the existing list if the day is already scheduled."
+        ),
+        request=CycleCountScheduleSerializer,
+        responses={201: CycleCountDetailSerializer}
+    )
+    @action(detail=False, methods=['post'])
+    def schedule(self, request):
+        """Schedule a warehouse's count list"""
+        serializer = CycleCountScheduleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        kwargs = {'limit': data['limit']} if 'limit' in data else {}
+        count = schedule_cycle_count(data['warehouse'].pk, data.get('scheduled_for'), **kwargs)
+        logger.info(f"Cycle count {count.pk} scheduled for warehouse {data['warehouse'].pk}")
+        count = self.get_queryset().prefetch_related(
+            Prefetch('lines', queryset=CycleCountLine.objects.select_related('material', 'location'))
+        ).get(pk=count.pk)
+        return Response(CycleCountDetailSerializer(count).data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(
+        summary="Submit counted quantities",
+        description=(
+            "Records scanned quantities for lines of an open cycle count in one write. "
+            "Lines submitted again keep the latest count."
+        ),
+        request=CountSubmissionSerializer
+    )
+    @action(detail=True, methods=['post'])
+    def submit(self, request, pk=None):
+        """Record counted quantities"""
+        count = self.get_object()
+        serializer = CountSubmissionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            updated = record_counts(count, serializer.validated_data['counts'], counted_by=request.user)
+        except DjangoValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info(f"Cycle count {count.pk}: {updated} line(s) counted")
+        return Response({'count': count.pk, 'updated': updated})
+
+    @extend_schema(
+        summary="Reconcile a cycle count",
+        description=(
+            "Compares counted lines with current system quantities and posts every "
+            "variance as an adjustment movement, all in one transaction, then closes "
+            "the count"
+        )
+    )
+    @action(detail=True, methods=['post'])
+    def reconcile(self, request, pk=None):
+        """Post the count variances as adjustments"""
+        count = self.get_object()
+        try:
+            summary = reconcile_cycle_count(count.pk, performed_by=request.user)
+        except DjangoValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info(f"Cycle count {count.pk} reconciled: {summary['variances']} variance(s)")
+        return Response(summary)
+
+
+@extend_schema_view(
+    list=extend_schema(
+        summary="List transfer documents",
+        description="Returns posted multi-line transfer documents"
+    ),
+    retrieve=extend_schema(
+        summary="Get a transfer document",
+        description="Returns a transfer document with its lines and their movements"
+    )
+)
+class TransferDocumentViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for multi-line transfer documents.
+    """
+    queryset = TransferDocument.objects.all()
+    serializer_class = TransferDocumentSerializer
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    search_fields = ['document_number', 'notes']
+    filterset_fields = ['source_warehouse', 'destination_warehouse']
+
+    def get_queryset(self):
+        return TransferDocument.objects.prefetch_related(
+            Prefetch(
+                'lines',
+                queryset=TransferDocumentLine.objects.select_related(
+                    'material', 'source_location', 'destination_location'
+                )
+            )
+        )
+
+    @extend_schema(
+        summary="Post a transfer document",
+        description=(
+            "Validates every line's source quantity and destination capacity against one "
+            "locked snapshot and posts all lines as transfer movements "
+            "(<document_number>-1, -2, ...) in one transaction, or none of them. "
+            "Returns the document, or per-line errors."
+        ),
+        request=TransferRequestSerializer,
+        responses={201: TransferDocumentSerializer}
+    )
+    def create(self, request, *args, **kwargs):
+        serializer = TransferRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        logger.info(f"Posting transfer document {data['document_number']} with {len(data['lines'])} line(s)")
+        try:
+            document, results = post_transfer_document(
+                data['document_number'],
+                data['source_warehouse'].pk,
+                data['destination_warehouse'].pk,
+                data['lines'],
+                performed_by=request.user,
+                notes=data['notes']
+            )
+        except DjangoValidationError as e:
+            return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        if document is None:
+            return Response(
+                {
+                    'committed': False,
+                    'rejected': sum(1 for result in results if result['status'] == 'error'),
+                    'results': results
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        logger.info(f"Transfer document {document.document_number} posted")
+        return Response(
+            {
+                'committed': True,
+                'document': TransferDocumentSerializer(self.get_queryset().get(pk=document.pk)).data,
+                'results': results
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+class MaterialReservationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for the reservation ledger. Reservations are made and released
+    through their owners: production orders and customer order allocations.
+    """
+    queryset = MaterialReservation.objects.select_related('material', 'stock')
+    serializer_class = MaterialReservationSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['material', 'stock', 'status', 'production_order', 'order_item']
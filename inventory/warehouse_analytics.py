@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from .models import StorageLocation, WarehouseUtilizationSnapshot
+
+
+def utilization_by_type(warehouse_ids=None):
+    """
+    Capacity, used and free volume per (warehouse, location type).
+
+    One grouped query over StorageLocation; returns a list of dicts with
+    warehouse_id, location_type, location_count, capacity, used and free.
+    """
+    locations = StorageLocation.objects.all()
+    if warehouse_ids is not None:
+        locations = locations.filter(warehouse_id__in=warehouse_ids)
+    rows = (
+        locations.values('warehouse_id', 'location_type')
+        .annotate(
+            location_count=Count('pk'),
+            total_capacity=Sum('capacity'),
+            used_volume=Sum('current_volume'),
+            free_volume=Sum(
+                F('capacity') - F('current_volume'),
+                filter=Q(current_volume__lt=F('capacity'))
+            )
+        )
+        .order_by('warehouse_id', 'location_type')
+    )
+    return [
+        {
+            'warehouse_id': row['warehouse_id'],
+            'location_type': row['location_type'],
+            'location_count': row['location_count'],
+            'capacity': row['total_capacity'] or 0,
+            'used': row['used_volume'] or 0,
+            'free': row['free_volume'] or 0,
+        }
+        for row in rows
+    ]
+
+
+def available_locations(warehouse_id):
+    """Locations of a warehouse with free space, roomiest first"""
+    return (
+        StorageLocation.objects.filter(warehouse_id=warehouse_id, current_volume__lt=F('capacity'))
+        .annotate(available_space=F('capacity') - F('current_volume'))
+        .order_by('-available_space', 'pk')
+        .values('pk', 'name', 'location_type', 'available_space')
+    )
+
+
+def record_utilization(now=None):
+    """Store the current per-type utilization of every warehouse; returns the row count"""
+    now = now or timezone.now()
+    snapshots = [
+        WarehouseUtilizationSnapshot(
+            warehouse_id=row['warehouse_id'],
+            location_type=row['location_type'],
+            recorded_at=now,
+            location_count=row['location_count'],
+            capacity=row['capacity'],
+            used_volume=row['used']
+        )
+        for row in utilization_by_type()
+    ]
+    with transaction.atomic():
+        WarehouseUtilizationSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
+
+
+def utilization_history(warehouse_id, since):
+    """
+    Utilization of a warehouse per recorded hour since ``since``.
+
+    Returns a list of {recorded_at, capacity, used_volume, by_type}, oldest
+    first, read from the snapshot table in one indexed range query.
+    """
+    series = {}
+    for row in (
+        WarehouseUtilizationSnapshot.objects.filter(warehouse_id=warehouse_id, recorded_at__gte=since)
+        .order_by('recorded_at', 'location_type')
+        .values('recorded_at', 'location_type', 'capacity', 'used_volume')
+    ):
+        point = series.setdefault(row['recorded_at'], {
+            'recorded_at': row['recorded_at'],
+            'capacity': 0,
+            'used_volume': 0,
+            'by_type': {},
+        })
+        point['capacity'] += row['capacity']
+        point['used_volume'] += row['used_volume']
+        point['by_type'][row['location_type']] = {
+            'capacity': row['capacity'],
+            'used_volume': row['used_volume'],
+        }
+    return list(series.values())
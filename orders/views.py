@@ -3,8 +3,11 @@ from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Sum, F, Q
 from django.utils import timezone
+from inventory.reservations import ReservationShortage, release, reserve_to
 from .models import Order, OrderItem, Payment, MaterialRequirement
 from .serializers import (
     OrderListSerializer, OrderDetailSerializer,
@@ -14,6 +17,9 @@ from .serializers import (
 
 # Create your views here.
 
+# Customer orders whose allocations no longer hold material back
+CLOSED_ORDER_STATUSES = ('completed', 'delivered', 'cancelled')
+
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
@@ -68,10 +74,15 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        order.status = new_status
-        if new_status == 'delivered':
-            order.actual_delivery = timezone.now()
-        order.save()
+        with transaction.atomic():
+            order.status = new_status
+            if new_status == 'delivered':
+                order.actual_delivery = timezone.now()
+            order.save()
+            if new_status in CLOSED_ORDER_STATUSES:
+                # Closed orders stop holding their allocated material
+                for item in order.items.all():
+                    release(order_item=item)
         return Response(OrderDetailSerializer(order).data)
 
 class OrderItemViewSet(viewsets.ModelViewSet):
@@ -137,6 +148,33 @@ class MaterialRequirementViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        requirement.allocated_quantity = quantity
-        requirement.save()
+        if requirement.order_item.order.status in CLOSED_ORDER_STATUSES:
+            return Response(
+                {'error': 'Cannot allocate material to a closed order'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # The allocation is held as a reservation of the item's material
+        try:
+            with transaction.atomic():
+                requirement.allocated_quantity = quantity
+                requirement.save()
+                requirement.refresh_from_db(fields=['allocated_quantity'])
+                allocated = (
+                    MaterialRequirement.objects.filter(
+                        order_item=requirement.order_item, material=requirement.material
+                    ).aggregate(total=Sum('allocated_quantity'))['total']
+                )
+                reserve_to(
+                    {requirement.material_id: allocated},
+                    order_item=requirement.order_item,
+                    performed_by=request.user if request.user.is_authenticated else None
+                )
+        except ReservationShortage as error:
+            return Response(
+                {'error': 'Insufficient materials', 'details': error.shortages},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except ValidationError as error:
+            return Response({'error': error.messages}, status=status.HTTP_400_BAD_REQUEST)
         return Response(MaterialRequirementSerializer(requirement).data)
@@ -4,7 +4,8 @@ from django.urls import reverse
 from django.utils import timezone
 from .models import (
     ProductionLine, ProductionOrder, ProductionBatch,
-    MaterialConsumption, QualityCheck, MaintenanceLog
+    MaterialConsumption, QualityCheck, MaintenanceLog,
+    Formulation, FormulationItem, PlannedMaterialRequirement
 )
 
 @admin.register(ProductionLine)
@@ -74,7 +75,8 @@ class ProductionOrderAdmin(admin.ModelAdmin):
                 'order_number',
                 ('product', 'quantity'),
                 'production_line',
-                ('start_date', 'end_date')
+                ('start_date', 'end_date'),
+                'due_date'
             )
         }),
         ('Status & Assignment', {
@@ -250,3 +252,22 @@ class MaintenanceLogAdmin(admin.ModelAdmin):
         return format_html(
             '<span style="color: orange;">Completed</span>'
         )
+
+class FormulationItemInline(admin.TabularInline):
+    model = FormulationItem
+    extra = 1
+    fields = ('material', 'quantity')
+
+@admin.register(Formulation)
+class FormulationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'version', 'effective_from', 'effective_to', 'updated_at')
+    list_filter = ('effective_from',)
+    readonly_fields = ('requirements',)
+    search_fields = ('product__name', 'product__sku')
+    inlines = [FormulationItemInline]
+
+@admin.register(PlannedMaterialRequirement)
+class PlannedMaterialRequirementAdmin(admin.ModelAdmin):
+    list_display = ('material', 'need_date', 'release_date', 'gross_requirement', 'net_requirement')
+    list_filter = ('release_date',)
+    search_fields = ('material__name', 'material__code')
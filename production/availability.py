@@ -0,0 +1,130 @@
+from decimal import Decimal
+from django.db.models import Sum
+from django.utils import timezone
+from inventory.models import MaterialReservation, RawMaterial
+from .formulations import dated_requirement_vectors, scale_requirements
+
+
+class InsufficientMaterials(ValueError):
+    """An order cannot start for lack of materials; carries the shortage report"""
+
+    def __init__(self, report):
+        self.report = report
+        super().__init__('Insufficient materials available: ' + ', '.join(
+            f"{shortage['name']} (Required: {shortage['required']}, Available: {shortage['available']})"
+            for shortage in report['shortages']
+        ))
+
+
+def material_availability(material_ids):
+    """
+    On-hand, reserved and available quantity of each material, keyed by
+    material id, read from the maintained totals with one query.
+    """
+    rows = (
+        RawMaterial.objects.filter(pk__in=list(material_ids))
+        .values_list('pk', 'code', 'name', 'unit', 'on_hand', 'reserved')
+    )
+    return {
+        pk: {
+            'code': code,
+            'name': name,
+            'unit': unit,
+            'on_hand': on_hand,
+            'reserved': reserved,
+            'available': on_hand - reserved,
+        }
+        for pk, code, name, unit, on_hand, reserved in rows
+    }
+
+
+def _start_day(order):
+    return timezone.localtime(order.start_date).date()
+
+
+def order_requirements(orders):
+    """
+    Material quantities of each order under the formulation version in
+    effect on its start day, in the orders' sequence. One query at most.
+    """
+    vectors = dated_requirement_vectors([(order.product_id, _start_day(order)) for order in orders])
+    return [
+        scale_requirements(vectors[order.product_id, _start_day(order)], order.quantity)
+        for order in orders
+    ]
+
+
+def _report(order, required, available, materials):
+    shortages = []
+    for material_id, quantity in sorted(required.items()):
+        on_hand = available.get(material_id, Decimal(0))
+        if quantity > on_hand:
+            material = materials.get(material_id, {})
+            shortages.append({
+                'material': material_id,
+                'code': material.get('code'),
+                'name': material.get('name'),
+                'unit': material.get('unit'),
+                'required': quantity,
+                'available': on_hand,
+                'shortfall': quantity - on_hand,
+            })
+    return {
+        'order': order.pk,
+        'order_number': order.order_number,
+        'ready': not shortages,
+        'shortages': shortages,
+    }
+
+
+def held_by_orders(orders):
+    """``{order id: {material id: quantity}}`` the orders' active reservations hold; one query"""
+    held = {}
+    for order_id, material_id, quantity in (
+        MaterialReservation.objects.filter(
+            production_order__in=[order.pk for order in orders if order.pk], status='active'
+        )
+        .values_list('production_order_id', 'material_id')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    ):
+        held.setdefault(order_id, {})[material_id] = quantity
+    return held
+
+
+def check_orders(orders, cumulative=False):
+    """
+    Shortage report of each order, with three queries for any number of
+    orders: their formulation vectors, the availability of every material
+    they use and what the orders themselves already hold reserved, which
+    counts as available to them.
+
+    Orders are checked independently against current availability, or with
+    ``cumulative`` one after another by start date and priority, each order
+    that can start taking its materials from what the next ones see.
+    """
+    orders = list(orders)
+    if cumulative:
+        orders.sort(key=lambda order: (order.start_date, -order.priority, order.pk or 0))
+    requirements = order_requirements(orders)
+    materials = material_availability({material_id for required in requirements for material_id in required})
+    available = {material_id: Decimal(material['available']) for material_id, material in materials.items()}
+    held = held_by_orders(orders)
+    reports = []
+    for order, required in zip(orders, requirements):
+        own = held.get(order.pk, {})
+        usable = {
+            material_id: available.get(material_id, Decimal(0)) + own.get(material_id, Decimal(0))
+            for material_id in required
+        }
+        report = _report(order, required, usable, materials)
+        if cumulative and report['ready']:
+            for material_id, quantity in required.items():
+                available[material_id] -= quantity - min(quantity, own.get(material_id, Decimal(0)))
+        reports.append(report)
+    return reports
+
+
+def check_availability(order):
+    """Shortage report of one order"""
+    return check_orders([order])[0]
@@ -0,0 +1,144 @@
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from inventory.changes import bump_version_on_commit, cache_generation
+from inventory.models import RawMaterial
+from .models import Formulation, FormulationItem
+
+# Change counter covering formulations and their items
+FORMULATIONS = 'formulations'
+# Seconds a compiled vector stays cached; any formulation change retires it sooner
+FORMULATION_CACHE_TIMEOUT = 3600
+
+
+def compile_formulation(formulation_id):
+    """
+    Recompute a version's requirement vector from its items and store it.
+    Written with an UPDATE, so compiling after the version itself is gone
+    is a no-op. Returns the vector.
+    """
+    requirements = {
+        str(material_id): str(quantity)
+        for material_id, quantity in FormulationItem.objects.filter(formulation_id=formulation_id)
+        .values_list('material_id', 'quantity')
+    }
+    Formulation.objects.filter(pk=formulation_id).update(requirements=requirements, updated_at=timezone.now())
+    return requirements
+
+
+def formulations_in_effect(keys):
+    """
+    The formulation version in effect for each ``(product id, day)`` key,
+    as ``{key: formulation}``. The version with the latest effective date
+    not after the day wins, unless its end date has passed. One query for
+    all keys.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+    versions = {}
+    for formulation in (
+        Formulation.objects.filter(
+            product_id__in={product_id for product_id, _ in keys},
+            effective_from__lte=max(day for _, day in keys)
+        )
+        .order_by('product_id', '-effective_from', '-version')
+        .only('pk', 'product_id', 'version', 'effective_from', 'effective_to', 'requirements')
+    ):
+        versions.setdefault(formulation.product_id, []).append(formulation)
+    in_effect = {}
+    for product_id, day in keys:
+        formulation = next(
+            (version for version in versions.get(product_id, ()) if version.effective_from <= day), None
+        )
+        if formulation and (not formulation.effective_to or formulation.effective_to > day):
+            in_effect[product_id, day] = formulation
+    return in_effect
+
+
+def active_formulations(product_ids, on=None):
+    """The formulation version of each product that applies on ``on`` (today by default)"""
+    on = on or timezone.localdate()
+    return {
+        product_id: formulation
+        for (product_id, _), formulation in formulations_in_effect((product_id, on) for product_id in product_ids).items()
+    }
+
+
+def dated_requirement_vectors(keys):
+    """
+    ``{(product id, day): {material id: quantity per unit}}`` from the
+    compiled vectors of the versions in effect. Cache hits cost no query;
+    the misses are read together with one. Products without a version in
+    effect map to an empty vector.
+    """
+    generation = cache_generation(FORMULATIONS)
+    cache_keys = {key: f'formulation:{generation}:{key[1].isoformat()}:{key[0]}' for key in set(keys)}
+    cached = cache.get_many(list(cache_keys.values()))
+    vectors = {key: cached[cache_key] for key, cache_key in cache_keys.items() if cache_key in cached}
+    missing = [key for key in cache_keys if key not in vectors]
+    if missing:
+        in_effect = formulations_in_effect(missing)
+        compiled = {
+            key: {
+                int(material_id): Decimal(quantity)
+                for material_id, quantity in (in_effect[key].requirements if key in in_effect else {}).items()
+            }
+            for key in missing
+        }
+        cache.set_many({cache_keys[key]: vector for key, vector in compiled.items()}, FORMULATION_CACHE_TIMEOUT)
+        vectors.update(compiled)
+    return vectors
+
+
+def requirement_vectors(product_ids, on=None):
+    """``{product id: {material id: quantity per unit}}`` on ``on`` (today by default)"""
+    on = on or timezone.localdate()
+    vectors = dated_requirement_vectors([(product_id, on) for product_id in product_ids])
+    return {product_id: vectors[product_id, on] for product_id in product_ids}
+
+
+def requirement_vector(product_id, on=None):
+    """The active ``{material id: quantity per unit}`` vector of one product"""
+    return requirement_vectors([product_id], on)[product_id]
+
+
+def scale_requirements(vector, quantity):
+    """Material quantities for ``quantity`` units of output"""
+    quantity = Decimal(quantity)
+    return {material_id: per_unit * quantity for material_id, per_unit in vector.items()}
+
+
+def material_costs(product_ids, on=None):
+    """
+    Raw material cost of one unit of each product under its active
+    formulation, at current material prices. Two queries at most.
+    """
+    vectors = requirement_vectors(product_ids, on)
+    material_ids = {material_id for vector in vectors.values() for material_id in vector}
+    prices = dict(RawMaterial.objects.filter(pk__in=material_ids).values_list('pk', 'unit_price'))
+    return {
+        product_id: sum(
+            (quantity * prices[material_id] for material_id, quantity in vector.items() if material_id in prices),
+            Decimal(0)
+        )
+        for product_id, vector in vectors.items()
+    }
+
+
+def save_formulation(formulation, items):
+    """
+    Save a formulation version with ``[(material id, quantity per unit)]``
+    as its complete item list, replacing any items it had, and compile it.
+    """
+    with transaction.atomic():
+        formulation.save()
+        formulation.items.all().delete()
+        FormulationItem.objects.bulk_create([
+            FormulationItem(formulation=formulation, material_id=material_id, quantity=quantity)
+            for material_id, quantity in items
+        ])
+        formulation.requirements = compile_formulation(formulation.pk)
+        bump_version_on_commit(FORMULATIONS)
+    return formulation
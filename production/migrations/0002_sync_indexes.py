@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productionbatch',
+            index=models.Index(fields=['updated_at', 'id'], name='production__updated_c049b4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionline',
+            index=models.Index(fields=['updated_at', 'id'], name='production__updated_ba6e55_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionorder',
+            index=models.Index(fields=['updated_at', 'id'], name='production__updated_a01083_idx'),
+        ),
+    ]
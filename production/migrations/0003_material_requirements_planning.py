@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:56
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_sync_indexes'),
+        ('products', '0001_initial'),
+        ('production', '0002_sync_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Formulation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='formulation', to='products.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlannedMaterialRequirement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('need_date', models.DateField(help_text='Day the material is consumed by production')),
+                ('release_date', models.DateField(db_index=True, help_text='Day the purchase must be placed, need date less the material lead time')),
+                ('gross_requirement', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('projected_available', models.DecimalField(decimal_places=2, help_text='Available quantity left for this day after earlier requirements', max_digits=14)),
+                ('net_requirement', models.PositiveIntegerField(help_text='Quantity to order, in whole units')),
+                ('computed_at', models.DateTimeField()),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='planned_requirements', to='inventory.rawmaterial')),
+            ],
+            options={
+                'ordering': ['release_date', 'material'],
+                'unique_together': {('material', 'need_date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FormulationItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=4, help_text='Quantity of the material per unit of output', max_digits=12, validators=[django.core.validators.MinValueValidator(0)])),
+                ('formulation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='production.formulation')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='formulation_items', to='inventory.rawmaterial')),
+            ],
+            options={
+                'unique_together': {('formulation', 'material')},
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def compile_formulations(apps, schema_editor):
+    Formulation = apps.get_model('production', 'Formulation')
+    FormulationItem = apps.get_model('production', 'FormulationItem')
+    requirements = {}
+    for formulation_id, material_id, quantity in FormulationItem.objects.values_list(
+        'formulation_id', 'material_id', 'quantity'
+    ):
+        requirements.setdefault(formulation_id, {})[str(material_id)] = str(quantity)
+    for formulation_id, vector in requirements.items():
+        Formulation.objects.filter(pk=formulation_id).update(requirements=vector)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('production', '0003_material_requirements_planning'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='formulation',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='formulations', to='products.product'),
+        ),
+        migrations.AddField(
+            model_name='formulation',
+            name='version',
+            field=models.PositiveIntegerField(blank=True, default=1, help_text='Numbered per product; the next free number by default'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='formulation',
+            name='effective_from',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AddField(
+            model_name='formulation',
+            name='effective_to',
+            field=models.DateField(blank=True, help_text='First day the version no longer applies', null=True),
+        ),
+        migrations.AddField(
+            model_name='formulation',
+            name='requirements',
+            field=models.JSONField(default=dict, editable=False, help_text='Compiled {material id: quantity per unit}, kept in step with the items'),
+        ),
+        migrations.AlterModelOptions(
+            name='formulation',
+            options={'ordering': ['product', '-version']},
+        ),
+        migrations.AlterUniqueTogether(
+            name='formulation',
+            unique_together={('product', 'version')},
+        ),
+        migrations.AddIndex(
+            model_name='formulation',
+            index=models.Index(fields=['product', 'effective_from'], name='production__product_37d9f8_idx'),
+        ),
+        migrations.RunPython(compile_formulations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:30
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def populate_due_dates(apps, schema_editor):
+    # Hand-entered end dates were the only deadline orders had
+    ProductionOrder = apps.get_model('production', 'ProductionOrder')
+    ProductionOrder.objects.update(due_date=F('end_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0004_versioned_formulations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionorder',
+            name='due_date',
+            field=models.DateTimeField(blank=True, help_text='When the order must be finished; the scheduler plans it to end by then', null=True),
+        ),
+        migrations.RunPython(populate_due_dates, migrations.RunPython.noop),
+    ]
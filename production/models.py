@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from django.contrib.auth import get_user_model
@@ -30,6 +31,11 @@ class ProductionLine(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -59,6 +65,11 @@ class ProductionOrder(models.Model):
     
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
+    due_date = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the order must be finished; the scheduler plans it to end by then"
+    )
     status = models.CharField(
         max_length=20,
         choices=STATUS_CHOICES,
@@ -88,19 +99,41 @@ class ProductionOrder(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
     def __str__(self):
         return f"PO-{self.order_number} - {self.product.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Status as persisted, so the start checks run once, when an order starts
+        if 'status' in field_names:
+            instance._loaded_status = values[field_names.index('status')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Reservations the save signals take commit or roll back with the order
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_status = self.status
+
     def calculate_material_requirements(self):
-        """Calculate required raw materials based on product recipe"""
-        requirements = []
-        for recipe_item in self.product.recipe.items.all():
-            required_quantity = recipe_item.quantity * self.quantity
-            requirements.append({
-                'material': recipe_item.material,
-                'required_quantity': required_quantity
-            })
-        return requirements
+        """Required raw materials under the formulation version in effect on the start date"""
+        from .formulations import requirement_vector, scale_requirements  # formulations imports this module
+
+        quantities = scale_requirements(
+            requirement_vector(self.product_id, timezone.localtime(self.start_date).date()),
+            self.quantity
+        )
+        materials = RawMaterial.objects.in_bulk(list(quantities))
+        return [
+            {'material': materials[material_id], 'required_quantity': quantity}
+            for material_id, quantity in quantities.items()
+        ]
 
 class ProductionBatch(models.Model):
     """Model for tracking production batches"""
@@ -128,6 +161,11 @@ class ProductionBatch(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Batch {self.batch_number}"
 
@@ -162,6 +200,11 @@ class MaterialConsumption(models.Model):
     def __str__(self):
         return f"{self.material.name} - {self.batch.batch_number}"
 
+    def save(self, *args, **kwargs):
+        # The stock issue and reservation draw-down the save signals make go with the record
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 class QualityCheck(models.Model):
     """Model for quality control checks during production"""
     RESULT_CHOICES = [
@@ -245,3 +288,108 @@ class MaintenanceLog(models.Model):
 
     def __str__(self):
         return f"{self.maintenance_type} - {self.production_line.name}"
+
+class Formulation(models.Model):
+    """
+    One version of a product's mix design: the raw materials in one unit of
+    output. A version applies from its effective date until the next
+    version of the product takes over or its own end date passes.
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='formulations'
+    )
+    version = models.PositiveIntegerField(
+        blank=True,
+        help_text="Numbered per product; the next free number by default"
+    )
+    effective_from = models.DateField(default=timezone.localdate)
+    effective_to = models.DateField(
+        null=True,
+        blank=True,
+        help_text="First day the version no longer applies"
+    )
+    requirements = models.JSONField(
+        default=dict,
+        editable=False,
+        help_text="Compiled {material id: quantity per unit}, kept in step with the items"
+    )
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['product', 'version']
+        ordering = ['product', '-version']
+        indexes = [
+            models.Index(fields=['product', 'effective_from']),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} formulation v{self.version}"
+
+    def clean(self):
+        if self.effective_to and self.effective_to <= self.effective_from:
+            raise ValidationError({'effective_to': "Must be after the effective date"})
+
+    def save(self, *args, **kwargs):
+        if not self.version:
+            latest = Formulation.objects.filter(product_id=self.product_id).aggregate(
+                latest=models.Max('version')
+            )['latest']
+            self.version = (latest or 0) + 1
+        super().save(*args, **kwargs)
+
+class FormulationItem(models.Model):
+    """One raw material of a formulation"""
+    formulation = models.ForeignKey(
+        Formulation,
+        on_delete=models.CASCADE,
+        related_name='items'
+    )
+    material = models.ForeignKey(
+        RawMaterial,
+        on_delete=models.PROTECT,
+        related_name='formulation_items'
+    )
+    quantity = models.DecimalField(
+        max_digits=12,
+        decimal_places=4,
+        validators=[MinValueValidator(0)],
+        help_text="Quantity of the material per unit of output"
+    )
+
+    class Meta:
+        unique_together = ['formulation', 'material']
+
+    def __str__(self):
+        return f"{self.material.name} - {self.quantity} per unit of {self.formulation.product.name}"
+
+class PlannedMaterialRequirement(models.Model):
+    """Time-phased net requirement of a material, computed by the MRP run"""
+    material = models.ForeignKey(
+        RawMaterial,
+        on_delete=models.CASCADE,
+        related_name='planned_requirements'
+    )
+    need_date = models.DateField(help_text="Day the material is consumed by production")
+    release_date = models.DateField(
+        db_index=True,
+        help_text="Day the purchase must be placed, need date less the material lead time"
+    )
+    gross_requirement = models.DecimalField(max_digits=14, decimal_places=2)
+    projected_available = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        help_text="Available quantity left for this day after earlier requirements"
+    )
+    net_requirement = models.PositiveIntegerField(help_text="Quantity to order, in whole units")
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['material', 'need_date']
+        ordering = ['release_date', 'material']
+
+    def __str__(self):
+        return f"{self.material.name} - {self.net_requirement} needed {self.need_date}"
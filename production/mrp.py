@@ -0,0 +1,281 @@
+import datetime
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from inventory.models import RawMaterial
+from products.models import Product, ProductComponent
+from .models import Formulation, PlannedMaterialRequirement, ProductionOrder
+
+# Production orders whose material needs are still ahead of them
+OPEN_ORDER_STATUSES = ('scheduled', 'in_progress', 'on_hold')
+
+
+def open_order_demand(today):
+    """
+    Quantity still to be produced by every open order, keyed by product and
+    start day. Orders already past their start are needed today.
+    """
+    zero = Value(Decimal(0), output_field=DecimalField(max_digits=10, decimal_places=2))
+    rows = (
+        ProductionOrder.objects.filter(status__in=OPEN_ORDER_STATUSES)
+        .annotate(remaining=Greatest(
+            F('quantity') - Coalesce(Sum('batches__quantity_produced'), zero), zero
+        ))
+        .filter(remaining__gt=0)
+        .values_list('product_id', 'start_date', 'remaining')
+    )
+    frame = pd.DataFrame.from_records(list(rows), columns=['product_id', 'start_date', 'remaining'])
+    if frame.empty:
+        return frame
+    frame['day'] = [
+        max((timezone.localtime(start).date() - today).days, 0) for start in frame['start_date']
+    ]
+    frame['remaining'] = frame['remaining'].astype(float)
+    return frame
+
+
+def component_matrix(product_ids):
+    """
+    The product structure as a sparse matrix: ``components[p, c]`` is the
+    quantity of product c in one unit of product p. Optional components
+    and links to products outside the given ids are left out.
+    """
+    products = pd.Index(product_ids)
+    links = pd.DataFrame.from_records(
+        list(ProductComponent.objects.filter(optional=False).values_list('product_id', 'component_id', 'quantity')),
+        columns=['product_id', 'component_id', 'quantity']
+    )
+    rows, columns = products.get_indexer(links['product_id']), products.get_indexer(links['component_id'])
+    known = (rows >= 0) & (columns >= 0)
+    components = sparse.csr_matrix(
+        (links['quantity'].to_numpy(dtype=float)[known], (rows[known], columns[known])),
+        shape=(len(products), len(products))
+    )
+    return components
+
+
+def formulation_matrix(product_ids, material_ids, today, horizon):
+    """
+    The formulation versions in effect over ``horizon`` days from today.
+
+    Returns the sparse versions x materials matrix of quantities per unit,
+    read from the compiled vectors, the product row of each version and the
+    window of days ``[start, end)`` it applies to. A version ends where the
+    product's next version starts or at its own end date.
+    """
+    products = pd.Index(product_ids)
+    materials = pd.Index(material_ids)
+    versions = pd.DataFrame.from_records(
+        list(
+            Formulation.objects.filter(effective_from__lt=today + datetime.timedelta(days=horizon))
+            .order_by('product_id', 'effective_from', 'version')
+            .values_list('product_id', 'effective_from', 'effective_to', 'requirements')
+        ),
+        columns=['product_id', 'effective_from', 'effective_to', 'requirements']
+    )
+    versions = versions[products.get_indexer(versions['product_id']) >= 0].reset_index(drop=True)
+    successor = versions.groupby('product_id')['effective_from'].shift(-1)
+    start = np.array([(day - today).days for day in versions['effective_from']], dtype=int)
+    end = np.array([
+        min([(day - today).days for day in (effective_to, next_from) if pd.notna(day)], default=horizon)
+        for effective_to, next_from in zip(versions['effective_to'], successor)
+    ], dtype=int)
+
+    items = [
+        (row, int(material_id), float(quantity))
+        for row, requirements in enumerate(versions['requirements'])
+        for material_id, quantity in requirements.items()
+    ]
+    rows = np.array([row for row, _, _ in items], dtype=int)
+    columns = materials.get_indexer([material_id for _, material_id, _ in items])
+    known = columns >= 0
+    matrix = sparse.csr_matrix(
+        (np.array([quantity for _, _, quantity in items])[known], (rows[known], columns[known])),
+        shape=(len(versions), len(materials))
+    )
+    return (
+        matrix,
+        products.get_indexer(versions['product_id']),
+        np.clip(start, 0, horizon),
+        np.clip(end, 0, horizon)
+    )
+
+
+def low_level_codes(components):
+    """
+    Deepest level each product appears at in any product structure, 0 for
+    products that are never a component. Each step multiplies the sparse
+    reachability matrix by the structure once, so the cost grows with the
+    depth of the structure, not the number of products.
+    """
+    n = components.shape[0]
+    structure = (components != 0).astype(np.int8)
+    levels = np.zeros(n, dtype=int)
+    reach = structure
+    depth = 1
+    while reach.nnz:
+        if depth > n:
+            raise ValidationError("Product structure contains a cycle")
+        levels[np.unique(reach.indices)] = depth
+        reach = reach @ structure
+        reach.data[:] = 1
+        reach.eliminate_zeros()
+        depth += 1
+    return levels
+
+
+def net_time_phased(gross, available):
+    """
+    Net a products x days requirement matrix against the quantity available
+    at the start. Each day's requirement draws on what earlier days left.
+    Returns ``(net requirement, available before each day)``.
+    """
+    cumulative = np.cumsum(gross, axis=1)
+    before = np.maximum(available[:, None] - (cumulative - gross), 0)
+    shortfall = np.maximum(cumulative - available[:, None], 0)
+    net = np.diff(shortfall, axis=1, prepend=0)
+    return net, before
+
+
+def shift_earlier(matrix, days):
+    """Move each row ``days[row]`` columns earlier; what falls off the start lands on day 0"""
+    shifted = np.zeros_like(matrix)
+    for offset in np.unique(days):
+        rows = days == offset
+        if offset == 0:
+            shifted[rows] = matrix[rows]
+            continue
+        if offset < matrix.shape[1]:
+            shifted[rows, :matrix.shape[1] - offset] = matrix[rows, offset:]
+        shifted[rows, 0] += matrix[rows, :offset].sum(axis=1)
+    return shifted
+
+
+def compute_material_requirements(today=None):
+    """
+    Time-phased net material requirements of all open production orders.
+
+    Demand is a products x days matrix built from the orders' start days.
+    It is exploded one low-level code at a time: a level's production is
+    multiplied through the sparse component matrix into dependent demand
+    for the next levels, which is netted against the components' finished
+    stock and moved earlier by their manufacturing lead time. The planned
+    production of every product is then multiplied through the sparse
+    matrix of the formulation versions in effect each day into gross
+    material requirements, netted against
+    on-hand stock less customer order allocations. This plant has no
+    purchase orders, so there are no open receipts to net.
+
+    Returns a DataFrame with one row per material and need day.
+    """
+    if today is None:
+        today = timezone.localdate()
+    columns = ['material_id', 'need_date', 'release_date', 'gross_requirement',
+               'projected_available', 'net_requirement']
+    demand = open_order_demand(today)
+    if demand.empty:
+        return pd.DataFrame(columns=columns)
+
+    products = pd.DataFrame.from_records(
+        list(Product.objects.values_list('pk', 'current_stock', 'manufacturing_lead_time')),
+        columns=['product_id', 'current_stock', 'lead_time'],
+        index='product_id'
+    )
+    materials = pd.DataFrame.from_records(
+        list(
+            # What open production orders hold is already in their gross demand
+            RawMaterial.objects.annotate(held=Coalesce(
+                Sum('reservations__quantity', filter=Q(
+                    reservations__status='active',
+                    reservations__production_order__status__in=OPEN_ORDER_STATUSES
+                )),
+                Value(Decimal(0)),
+                output_field=DecimalField(max_digits=14, decimal_places=2)
+            ))
+            .values_list('pk', 'on_hand', 'reserved', 'held', 'lead_time')
+        ),
+        columns=['material_id', 'on_hand', 'reserved', 'held', 'lead_time'],
+        index='material_id'
+    )
+    horizon = int(demand['day'].max()) + 1
+    components = component_matrix(products.index)
+    formulations, version_products, version_start, version_end = formulation_matrix(
+        products.index, materials.index, today, horizon
+    )
+    levels = low_level_codes(components)
+
+    independent = np.zeros((len(products), horizon))
+    np.add.at(
+        independent,
+        (products.index.get_indexer(demand['product_id']), demand['day'].to_numpy(dtype=int)),
+        demand['remaining'].to_numpy()
+    )
+    dependent = np.zeros_like(independent)
+    production = np.zeros_like(independent)
+    stock = products['current_stock'].to_numpy(dtype=float)
+    product_lead_time = products['lead_time'].to_numpy(dtype=int)
+    for level in range(levels.max() + 1):
+        rows = np.flatnonzero(levels == level)
+        production[rows] = independent[rows]
+        if level:
+            # Components are made ahead of the orders that consume them
+            net, _ = net_time_phased(dependent[rows], stock[rows])
+            production[rows] += shift_earlier(net, product_lead_time[rows])
+        dependent += components[rows].T @ production[rows]
+
+    # Each day's production is made with the version in effect that day
+    days = np.arange(horizon)
+    in_effect = (days >= version_start[:, None]) & (days < version_end[:, None])
+    gross = formulations.T @ (production[version_products] * in_effect)
+    available = (
+        materials['on_hand'].to_numpy(dtype=float)
+        - materials['reserved'].to_numpy(dtype=float)
+        + materials['held'].to_numpy(dtype=float)
+    )
+    net, before = net_time_phased(gross, np.maximum(available, 0))
+
+    material_rows, days = np.nonzero(gross > 0)
+    if not len(material_rows):
+        return pd.DataFrame(columns=columns)
+    lead_time = materials['lead_time'].to_numpy(dtype=int)[material_rows]
+    need_dates = [today + datetime.timedelta(days=int(day)) for day in days]
+    return pd.DataFrame({
+        'material_id': materials.index[material_rows],
+        'need_date': need_dates,
+        'release_date': [
+            need_date - datetime.timedelta(days=int(days_ahead))
+            for need_date, days_ahead in zip(need_dates, lead_time)
+        ],
+        'gross_requirement': gross[material_rows, days],
+        'projected_available': before[material_rows, days],
+        # Tolerance keeps float noise from ordering a whole extra unit
+        'net_requirement': np.ceil(net[material_rows, days] - 1e-9).astype(int),
+    }, columns=columns)
+
+
+def run_mrp(today=None):
+    """Recompute and store the planned material requirements; returns the row count"""
+    frame = compute_material_requirements(today=today)
+    now = timezone.now()
+    plans = [
+        PlannedMaterialRequirement(
+            material_id=int(row.material_id),
+            need_date=row.need_date,
+            release_date=row.release_date,
+            gross_requirement=Decimal(f'{row.gross_requirement:.2f}'),
+            projected_available=Decimal(f'{row.projected_available:.2f}'),
+            net_requirement=int(row.net_requirement),
+            computed_at=now
+        )
+        for row in frame.itertuples(index=False)
+    ]
+    with transaction.atomic():
+        PlannedMaterialRequirement.objects.all().delete()
+        PlannedMaterialRequirement.objects.bulk_create(plans, batch_size=1000)
+    return len(plans)
@@ -0,0 +1,443 @@
+import datetime
+import math
+import random
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import MaintenanceLog, ProductionLine, ProductionOrder
+
+# Length of the maintenance planned at a line's maintenance_schedule, and how
+# long maintenance still under way is expected to keep the line down
+MAINTENANCE_WINDOW = datetime.timedelta(hours=8)
+# How far ahead a full re-plan reaches by default
+REPLAN_DAYS = 7
+# Bookings first read when placing a single order; doubled until the slot fits
+SCHEDULE_WINDOW = datetime.timedelta(days=1)
+
+
+def _seconds(moment):
+    return moment.timestamp()
+
+
+def _moment(seconds):
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+
+
+class _Node:
+    __slots__ = ('start', 'end', 'key', 'weight', 'left', 'right', 'lo', 'hi', 'gap')
+
+    def __init__(self, start, end, key, weight):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.weight = weight
+        self.left = None
+        self.right = None
+        self.lo = start
+        self.hi = end
+        self.gap = 0.0
+
+    def update(self):
+        """Recompute the subtree's span and its widest free gap from the children"""
+        self.lo, self.hi, self.gap = self.start, self.end, 0.0
+        if self.left:
+            self.lo = self.left.lo
+            self.gap = max(self.left.gap, self.start - self.left.hi)
+        if self.right:
+            self.hi = self.right.hi
+            self.gap = max(self.gap, self.right.gap, self.right.lo - self.end)
+
+
+def _rotate_right(node):
+    child = node.left
+    node.left = child.right
+    node.update()
+    child.right = node
+    child.update()
+    return child
+
+
+def _rotate_left(node):
+    child = node.right
+    node.right = child.left
+    node.update()
+    child.left = node
+    child.update()
+    return child
+
+
+def _insert(node, new):
+    if node is None:
+        return new
+    if new.start < node.start:
+        node.left = _insert(node.left, new)
+        if node.left.weight > node.weight:
+            return _rotate_right(node)
+    else:
+        node.right = _insert(node.right, new)
+        if node.right.weight > node.weight:
+            return _rotate_left(node)
+    node.update()
+    return node
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.weight > right.weight:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+def _delete(node, start):
+    if start < node.start:
+        node.left = _delete(node.left, start)
+    elif start > node.start:
+        node.right = _delete(node.right, start)
+    else:
+        return _merge(node.left, node.right)
+    node.update()
+    return node
+
+
+def _overlapping(node, start, end, found):
+    if node is None or node.hi <= start or node.lo >= end:
+        return
+    _overlapping(node.left, start, end, found)
+    if node.start < end and node.end > start:
+        found.append((node.start, node.end, node.key))
+    _overlapping(node.right, start, end, found)
+
+
+def _first_gap(node, not_before, length, free_from):
+    """
+    Earliest start, not before ``not_before``, of a free gap of ``length``
+    that ends inside the subtree; ``free_from`` is where the time before
+    the subtree's first interval became free.
+    """
+    if node is None or node.hi <= not_before or max(node.gap, node.lo - free_from) < length:
+        return None
+    found = _first_gap(node.left, not_before, length, free_from)
+    if found is not None:
+        return found
+    begin = max(node.left.hi if node.left else free_from, not_before)
+    if begin + length <= node.start:
+        return begin
+    return _first_gap(node.right, not_before, length, node.end)
+
+
+class IntervalTree:
+    """
+    Booked time of one line as disjoint [start, end) intervals in seconds.
+
+    Intervals live in a treap ordered by start, each node also holding its
+    subtree's span and widest free gap. Booking, unbooking and finding the
+    earliest free slot of a given length take O(log n) expected time.
+    """
+
+    def __init__(self, seed=0):
+        self.root = None
+        self._starts = {}
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __contains__(self, key):
+        return key in self._starts
+
+    def __iter__(self):
+        stack, node = [], self.root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.start, node.end, node.key
+            node = node.right
+
+    def overlapping(self, start, end):
+        """Booked intervals that share time with [start, end), in order"""
+        found = []
+        _overlapping(self.root, start, end, found)
+        return found
+
+    def add(self, start, end, key):
+        if end <= start:
+            raise ValueError(f"Interval of {key!r} ends before it starts")
+        if key in self._starts:
+            raise ValueError(f"{key!r} is already booked")
+        clash = self.overlapping(start, end)
+        if clash:
+            raise ValueError(f"{key!r} overlaps {clash[0][2]!r}")
+        self.root = _insert(self.root, _Node(start, end, key, self._random.random()))
+        self._starts[key] = start
+
+    def remove(self, key):
+        self.root = _delete(self.root, self._starts.pop(key))
+
+    def earliest_fit(self, length, not_before):
+        """Earliest start not before ``not_before`` of ``length`` seconds of free time"""
+        found = _first_gap(self.root, not_before, length, -math.inf)
+        if found is not None:
+            return found
+        return max(not_before, self.root.hi) if self.root else not_before
+
+
+def _merged(intervals):
+    """Union of [start, end) intervals as sorted, disjoint ones"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def downtime_windows(lines, logs, now):
+    """
+    ``{line id: [(start, end)]}`` of planned and unfinished maintenance:
+    every log not yet over, unfinished ones expected to last another
+    MAINTENANCE_WINDOW, each line's maintenance_schedule, and lines marked
+    under maintenance without a log from now on. ``logs`` holds
+    ``(line id, start, end)`` rows.
+    """
+    windows = {line.pk: [] for line in lines}
+    for line_id, start, end in logs:
+        if line_id in windows:
+            windows[line_id].append((start, end or max(start, now) + MAINTENANCE_WINDOW))
+    for line in lines:
+        if line.maintenance_schedule and line.maintenance_schedule + MAINTENANCE_WINDOW > now:
+            windows[line.pk].append((line.maintenance_schedule, line.maintenance_schedule + MAINTENANCE_WINDOW))
+        if line.status == 'maintenance' and not windows[line.pk]:
+            windows[line.pk].append((now, now + MAINTENANCE_WINDOW))
+    return {
+        line_id: [(_moment(start), _moment(end)) for start, end in _merged(
+            (_seconds(start), _seconds(end)) for start, end in intervals
+        )]
+        for line_id, intervals in windows.items()
+    }
+
+
+class ProductionScheduler:
+    """
+    Finite-capacity schedule of every production line.
+
+    Each line's booked time is an IntervalTree holding its scheduled orders
+    and, merged into blocks, its downtime and running orders. An order runs
+    for its quantity over the line's capacity per hour and is placed on the
+    line whose earliest free slot that long finishes first. Inactive lines
+    take no orders.
+    """
+
+    def __init__(self, lines, downtime, now=None):
+        self.now = now or timezone.now()
+        self.lines = {line.pk: line for line in lines}
+        self.downtime = downtime
+        self.timelines = {line.pk: IntervalTree(seed=line.pk) for line in lines}
+        self.orders = {}
+        self.bookings = {}
+        # Scheduled orders whose stored slot overlapped time already booked
+        self.conflicts = []
+
+    @classmethod
+    def load(cls, now=None, line_id=None, until=None):
+        """
+        The schedule as stored: lines, downtime and open orders, in three
+        queries. ``line_id`` loads that line only and ``until`` only the
+        bookings between now and then; slots found past ``until`` may
+        overlap bookings that were not read.
+        """
+        now = now or timezone.now()
+        lines = ProductionLine.objects.only('pk', 'name', 'capacity_per_hour', 'status', 'maintenance_schedule')
+        logs = MaintenanceLog.objects.filter(Q(end_time__isnull=True) | Q(end_time__gt=now))
+        orders = ProductionOrder.objects.filter(status__in=('scheduled', 'in_progress'))
+        if line_id is not None:
+            lines = lines.filter(pk=line_id)
+            logs = logs.filter(production_line_id=line_id)
+            orders = orders.filter(production_line_id=line_id)
+        if until is not None:
+            logs = logs.filter(start_time__lt=until)
+            orders = orders.filter(start_date__lt=until, end_date__gt=now)
+        lines = list(lines)
+        logs = logs.values_list('production_line_id', 'start_time', 'end_time')
+        scheduler = cls(lines, downtime_windows(lines, logs, now), now)
+        scheduler.book_existing(orders.only(
+            'pk', 'order_number', 'production_line', 'quantity', 'status',
+            'priority', 'start_date', 'end_date', 'due_date'
+        ))
+        return scheduler
+
+    def book_existing(self, orders):
+        """
+        Book orders where they stand. Running orders and downtime block their
+        time outright; scheduled orders still ahead keep their slots unless
+        these overlap something booked first, which makes them conflicts.
+        """
+        now = _seconds(self.now)
+        blocked = {line_id: [(_seconds(start), _seconds(end)) for start, end in windows]
+                   for line_id, windows in self.downtime.items()}
+        scheduled = []
+        for order in orders:
+            self.orders[order.pk] = order
+            if order.status == 'in_progress':
+                blocked.setdefault(order.production_line_id, []).append(
+                    (_seconds(order.start_date), max(_seconds(order.end_date), now))
+                )
+            elif order.end_date > self.now:
+                scheduled.append(order)
+        for line_id, intervals in blocked.items():
+            if line_id in self.timelines:
+                for number, (start, end) in enumerate(_merged(intervals)):
+                    if start < end:
+                        self.timelines[line_id].add(start, end, ('blocked', number))
+        for order in sorted(scheduled, key=lambda order: (order.start_date, order.pk)):
+            timeline = self.timelines.get(order.production_line_id)
+            start, end = max(_seconds(order.start_date), now), _seconds(order.end_date)
+            if timeline is not None and not timeline.overlapping(start, end):
+                timeline.add(start, end, order.pk)
+                self.bookings[order.pk] = order.production_line_id
+            else:
+                self.conflicts.append(order.pk)
+
+    def run_length(self, line, quantity):
+        """Seconds the line needs for ``quantity`` units, or None if it cannot take orders"""
+        if line.status == 'inactive' or not line.capacity_per_hour or line.capacity_per_hour <= 0:
+            return None
+        return float(quantity) / float(line.capacity_per_hour) * 3600
+
+    def unbook(self, order_id):
+        line_id = self.bookings.pop(order_id, None)
+        if line_id is not None:
+            self.timelines[line_id].remove(order_id)
+
+    def place(self, order, line_id=None, not_before=None):
+        """
+        Book the order in the earliest slot that finishes first, on
+        ``line_id`` or on any line, moving it if it was booked already.
+        Returns the placement; the order itself is not changed.
+        """
+        self.unbook(order.pk)
+        self.orders[order.pk] = order
+        not_before = _seconds(max(not_before or self.now, self.now))
+        if line_id is not None and line_id not in self.lines:
+            raise ValidationError(f"Production line {line_id} does not exist")
+        best = None
+        for line in ([self.lines[line_id]] if line_id is not None else self.lines.values()):
+            length = self.run_length(line, order.quantity)
+            if length is None:
+                continue
+            start = self.timelines[line.pk].earliest_fit(length, not_before)
+            # Earliest finish wins; staying on the order's own line breaks ties
+            rank = (start + length, line.pk != order.production_line_id, line.pk)
+            if best is None or rank < best[0]:
+                best = (rank, line.pk, start, start + length)
+        if best is None:
+            raise ValidationError(f"No production line can take order {order.order_number}")
+        _, line_id, start, end = best
+        self.timelines[line_id].add(start, end, order.pk)
+        self.bookings[order.pk] = line_id
+        if order.pk in self.conflicts:
+            self.conflicts.remove(order.pk)
+        return self.placement(order, line_id, start, end)
+
+    def placement(self, order, line_id, start, end):
+        end_date = _moment(end)
+        return {
+            'order': order.pk,
+            'order_number': order.order_number,
+            'production_line': line_id,
+            'start_date': _moment(start),
+            'end_date': end_date,
+            'due_date': order.due_date,
+            'late': bool(order.due_date and end_date > order.due_date),
+        }
+
+    def plan(self, orders, not_before=None):
+        """
+        Re-place ``orders`` from scratch: all are unbooked first, then placed
+        by priority, highest first, and due date, earliest first.
+        """
+        orders = list(orders)
+        for order in orders:
+            self.unbook(order.pk)
+        far = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+        orders.sort(key=lambda order: (-order.priority, order.due_date or far, order.start_date, order.pk))
+        return [self.place(order, not_before=not_before) for order in orders]
+
+    def timeline(self, line_id, until):
+        """Orders and blocked time booked on a line from now until ``until``, in order"""
+        return [
+            {'start': _moment(start), 'end': _moment(end), 'order': None if isinstance(key, tuple) else key}
+            for start, end, key in self.timelines[line_id].overlapping(_seconds(self.now), _seconds(until))
+        ]
+
+
+def save_placements(placements):
+    """Write placements to their orders with one UPDATE per batch of rows"""
+    if not placements:
+        return
+    now = timezone.now()
+    orders = []
+    for placement in placements:
+        order = ProductionOrder(
+            pk=placement['order'],
+            production_line_id=placement['production_line'],
+            start_date=placement['start_date'],
+            end_date=placement['end_date'],
+            updated_at=now
+        )
+        orders.append(order)
+    with transaction.atomic():
+        ProductionOrder.objects.bulk_update(
+            orders, ['production_line', 'start_date', 'end_date', 'updated_at'], batch_size=500
+        )
+
+
+def schedule_order(order, line_id=None, not_before=None, now=None):
+    """
+    Place or move one order against the stored schedule and save it.
+
+    Only bookings from now to SCHEDULE_WINDOW past ``not_before`` are read,
+    on ``line_id`` alone if given. A slot found inside that window is free;
+    one ending past it is checked again with the window widened to cover it.
+    """
+    now = now or timezone.now()
+    start = max(not_before or now, now)
+    window = SCHEDULE_WINDOW
+    while True:
+        until = start + window
+        scheduler = ProductionScheduler.load(now, line_id=line_id, until=until)
+        placement = scheduler.place(order, line_id=line_id, not_before=not_before)
+        if placement['end_date'] <= until:
+            break
+        window = max(2 * window, placement['end_date'] - start)
+    save_placements([placement])
+    return placement
+
+
+def replan(days=REPLAN_DAYS, now=None, dry_run=False):
+    """
+    Re-plan every scheduled order starting or due within ``days`` across all
+    lines, around running orders, downtime and later scheduled orders.
+    Returns the placements and the conflicts left among the later orders.
+    """
+    scheduler = ProductionScheduler.load(now)
+    horizon = scheduler.now + datetime.timedelta(days=days)
+    orders = [
+        order for order in scheduler.orders.values()
+        if order.status == 'scheduled'
+        and (order.start_date < horizon or (order.due_date and order.due_date < horizon))
+    ]
+    placements = scheduler.plan(orders)
+    if not dry_run:
+        save_placements(placements)
+    return placements, [scheduler.orders[order_id].order_number for order_id in scheduler.conflicts]
@@ -1,8 +1,10 @@
 from rest_framework import serializers
 from django.utils import timezone
+from .formulations import save_formulation
 from .models import (
     ProductionLine, ProductionOrder, ProductionBatch,
-    MaterialConsumption, QualityCheck, MaintenanceLog
+    MaterialConsumption, QualityCheck, MaintenanceLog,
+    PlannedMaterialRequirement, Formulation, FormulationItem
 )
 
 class ProductionLineSerializer(serializers.ModelSerializer):
@@ -123,8 +125,8 @@ class ProductionOrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ProductionOrder
-        fields = list(['id', 'production_line', 'order_number', 'product', 'quantity', 'status', 'start_date', 'end_date', 'assigned_to', 'created_by', 'created_at', 'updated_at', 'completed_at', 'batches', 'product_name', 'assigned_to_name', 'created_by_name', 'progress', 'material_requirements'])
-        read_only_fields = ['created_at', 'updated_at', 'completed_at']
+        fields = list(['id', 'production_line', 'order_number', 'product', 'quantity', 'status', 'start_date', 'end_date', 'due_date', 'assigned_to', 'created_by', 'created_at', 'updated_at', 'batches', 'product_name', 'assigned_to_name', 'created_by_name', 'progress', 'material_requirements'])
+        read_only_fields = ['created_at', 'updated_at']
 
     def get_progress(self, obj):
         total_produced = sum(batch.quantity_produced for batch in obj.batches.all())
@@ -133,7 +135,10 @@ class ProductionOrderSerializer(serializers.ModelSerializer):
         return 0
 
     def get_material_requirements(self, obj):
-        return obj.calculate_material_requirements()
+        return [
+            {'material': req['material'].pk, 'material_name': req['material'].name, 'required_quantity': req['required_quantity']}
+            for req in obj.calculate_material_requirements()
+        ]
 
 class MaintenanceLogSerializer(serializers.ModelSerializer):
     production_line_name = serializers.CharField(source='production_line.name', read_only=True)
@@ -264,3 +269,72 @@ class ProductionOrderDetailSerializer(ProductionOrderSerializer):
         # Sort events by time
         events.sort(key=lambda x: x['time'])
         return events
+
+class PlannedMaterialRequirementSerializer(serializers.ModelSerializer):
+    material_name = serializers.CharField(source='material.name', read_only=True)
+    material_code = serializers.CharField(source='material.code', read_only=True)
+    unit = serializers.CharField(source='material.unit', read_only=True)
+    past_due = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PlannedMaterialRequirement
+        fields = '__all__'
+
+    def get_past_due(self, obj):
+        return obj.release_date < timezone.localdate()
+
+class FormulationItemSerializer(serializers.ModelSerializer):
+    material_name = serializers.CharField(source='material.name', read_only=True)
+
+    class Meta:
+        model = FormulationItem
+        fields = ['id', 'material', 'material_name', 'quantity']
+
+class FormulationSerializer(serializers.ModelSerializer):
+    items = FormulationItemSerializer(many=True)
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = Formulation
+        fields = '__all__'
+        read_only_fields = ['requirements', 'created_at', 'updated_at']
+        extra_kwargs = {'version': {'required': False}}
+        # Versions are numbered on save; a version given explicitly is checked in validate()
+        validators = []
+
+    def validate_items(self, items):
+        materials = [item['material'].pk for item in items]
+        if len(set(materials)) != len(materials):
+            raise serializers.ValidationError("Each material may appear only once")
+        return items
+
+    def validate(self, data):
+        effective_from = data.get('effective_from', getattr(self.instance, 'effective_from', None))
+        effective_to = data.get('effective_to', getattr(self.instance, 'effective_to', None))
+        if effective_from and effective_to and effective_to <= effective_from:
+            raise serializers.ValidationError({'effective_to': "Must be after the effective date"})
+        product = data.get('product', getattr(self.instance, 'product', None))
+        if data.get('version'):
+            taken = Formulation.objects.filter(product=product, version=data['version'])
+            if self.instance:
+                taken = taken.exclude(pk=self.instance.pk)
+            if taken.exists():
+                raise serializers.ValidationError({'version': f"Version {data['version']} already exists"})
+        return data
+
+    def create(self, validated_data):
+        items = validated_data.pop('items')
+        return save_formulation(
+            Formulation(**validated_data),
+            [(item['material'].pk, item['quantity']) for item in items]
+        )
+
+    def update(self, instance, validated_data):
+        items = validated_data.pop('items', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if items is None:
+            items = list(instance.items.values_list('material_id', 'quantity'))
+        else:
+            items = [(item['material'].pk, item['quantity']) for item in items]
+        return save_formulation(instance, items)
@@ -1,10 +1,16 @@
-from django.db.models.signals import post_save, pre_save
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.db.models import Sum
+from inventory.changes import bump_version_on_commit
+from inventory.reservations import ReservationShortage, consume, release, reserve_to
+from inventory.services import allocate_issue
+from .availability import InsufficientMaterials, check_availability, order_requirements
+from .formulations import FORMULATIONS, compile_formulation
 from .models import (
     ProductionOrder, ProductionBatch, MaterialConsumption,
-    QualityCheck, MaintenanceLog
+    QualityCheck, MaintenanceLog, Formulation, FormulationItem
 )
 
 @receiver(post_save, sender=ProductionBatch)
@@ -21,11 +27,28 @@ def update_order_progress(sender, instance, **kwargs):
         order.save()
 
 @receiver(post_save, sender=MaterialConsumption)
-def update_material_stock(sender, instance, **kwargs):
-    """Update material stock levels when consumption is recorded"""
-    material = instance.material
-    material.quantity_available -= instance.quantity_used
-    material.save()
+def consume_reserved_material(sender, instance, created, **kwargs):
+    """
+    Recorded consumption, wastage included, is issued from stock (FEFO,
+    any warehouse) and drawn off the order's reservations together, so
+    on hand and reserved fall by the same amount.
+    """
+    if not created:
+        return
+    quantity = instance.quantity_used + instance.wastage
+    if quantity != quantity.to_integral_value():
+        raise ValidationError(f"Consumption of {instance.material.name} must be in whole units, got {quantity}")
+    order = instance.batch.production_order
+    if quantity:
+        allocate_issue(
+            instance.material,
+            int(quantity),
+            None,
+            f"{order.order_number}-MC{instance.pk}",
+            performed_by=instance.recorded_by,
+            notes=f"Consumed by production batch {instance.batch.batch_number}"
+        )
+    consume(instance.material_id, quantity, order)
 
 @receiver(post_save, sender=QualityCheck)
 def update_batch_quality(sender, instance, **kwargs):
@@ -67,24 +90,45 @@ def update_production_line_status(sender, instance, created, **kwargs):
 @receiver(pre_save, sender=ProductionOrder)
 def validate_production_order(sender, instance, **kwargs):
     """Validate production order before saving"""
-    if instance.status == 'in_progress':
+    if instance.status == 'in_progress' and getattr(instance, '_loaded_status', None) != 'in_progress':
         # Ensure production line is available
         if instance.production_line.status != 'active':
             raise ValueError('Production line is not active')
         
         # Check material availability
-        requirements = instance.calculate_material_requirements()
-        insufficient_materials = []
-        
-        for req in requirements:
-            if req['material'].quantity_available < req['required_quantity']:
-                insufficient_materials.append(
-                    f"{req['material'].name} (Required: {req['required_quantity']}, "
-                    f"Available: {req['material'].quantity_available})"
-                )
-        
-        if insufficient_materials:
-            raise ValueError(
-                'Insufficient materials available: ' + 
-                ', '.join(insufficient_materials)
-            )
+        report = check_availability(instance)
+        if not report['ready']:
+            raise InsufficientMaterials(report)
+        if instance.pk:
+            reserve_order_materials(instance)
+        else:
+            instance._reserve_on_create = True
+
+def reserve_order_materials(order):
+    """Hold the order's materials; a start that lost a race for them fails"""
+    try:
+        reserve_to(order_requirements([order])[0], production_order=order)
+    except ReservationShortage:
+        raise InsufficientMaterials(check_availability(order))
+
+@receiver(post_save, sender=ProductionOrder)
+def update_order_reservations(sender, instance, created, **kwargs):
+    """Reserve for orders created already started; release when an order closes"""
+    if created and getattr(instance, '_reserve_on_create', False):
+        instance._reserve_on_create = False
+        reserve_order_materials(instance)
+    elif instance.status in ('completed', 'cancelled') and getattr(instance, '_loaded_status', None) != instance.status:
+        release(production_order=instance)
+
+@receiver(post_save, sender=FormulationItem)
+@receiver(post_delete, sender=FormulationItem)
+def compile_formulation_items(sender, instance, **kwargs):
+    """Keep the version's compiled requirement vector in step with its items"""
+    compile_formulation(instance.formulation_id)
+    bump_version_on_commit(FORMULATIONS)
+
+@receiver(post_save, sender=Formulation)
+@receiver(post_delete, sender=Formulation)
+def retire_cached_formulations(sender, instance, **kwargs):
+    """Effective dates decide which version applies; retire cached vectors"""
+    bump_version_on_commit(FORMULATIONS)
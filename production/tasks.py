@@ -0,0 +1,14 @@
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def run_mrp():
+    """Recompute the planned material requirements of all open production orders"""
+    from .mrp import run_mrp as run  # Import here to avoid loading models at import time
+
+    planned = run()
+    logger.info(f"MRP run planned {planned} material requirement(s)")
+    return planned
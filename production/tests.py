@@ -1,3 +1,717 @@
+import datetime
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from inventory.models import MaterialReservation, RawMaterial, Stock, StockMovement, StorageLocation, Warehouse
+from inventory.reservations import ReservationShortage, release, reserve, reserve_to
+from inventory.services import post_movement
+from orders.models import MaterialRequirement, Order, OrderItem
+from products.models import Category, Product, ProductComponent
+from .models import (
+    Formulation, FormulationItem, MaintenanceLog, MaterialConsumption, PlannedMaterialRequirement,
+    ProductionBatch, ProductionLine, ProductionOrder
+)
+from .availability import InsufficientMaterials, check_availability, check_orders
+from .formulations import material_costs, requirement_vector, requirement_vectors
+from .mrp import component_matrix, compute_material_requirements, low_level_codes
+from .scheduling import IntervalTree, ProductionScheduler, replan, schedule_order
 
-# Create your tests here.
+User = get_user_model()
+
+
+class ProductionTestMixin:
+    def create_plant(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        self.category = Category.objects.create(name='Concrete products')
+        self.line = ProductionLine.objects.create(name='Press 1', capacity_per_hour=Decimal('500'))
+        self.cement = self.create_material('Cement', 'CEM-50', lead_time=7, on_hand=60)
+        self.sand = self.create_material('Sand', 'SND-T', lead_time=3)
+        self.cabro = self.create_product('Cabro 60mm', 'CAB-60')
+        self.block = self.create_product('Hollow block 6in', 'HB-6', current_stock=50, manufacturing_lead_time=2)
+        self.pack = self.create_product('Block pack', 'HB-6-PK')
+        ProductComponent.objects.create(product=self.pack, component=self.block, quantity=10)
+        self.formulate(self.cabro, {self.cement: '0.5', self.sand: '2'})
+        self.formulate(self.block, {self.cement: '0.25'})
+
+    def create_material(self, name, code, lead_time, on_hand=0):
+        material = RawMaterial.objects.create(
+            name=name,
+            code=code,
+            description=name,
+            unit='pcs',
+            unit_price=Decimal('100.00'),
+            maximum_stock=5000,
+            reorder_point=10,
+            lead_time=lead_time,
+            volume_per_unit=Decimal('0.040')
+        )
+        RawMaterial.objects.filter(pk=material.pk).update(on_hand=on_hand)
+        return material
+
+    def create_product(self, name, sku, **fields):
+        return Product.objects.create(
+            name=name,
+            sku=sku,
+            description=name,
+            category=self.category,
+            unit_price=Decimal('60.00'),
+            cost_price=Decimal('35.00'),
+            **fields
+        )
+
+    def formulate(self, product, quantities, **fields):
+        formulation = Formulation.objects.create(product=product, **fields)
+        for material, quantity in quantities.items():
+            FormulationItem.objects.create(formulation=formulation, material=material, quantity=Decimal(quantity))
+        return formulation
+
+    def create_order(self, number, product, quantity, days_ahead, status='scheduled'):
+        start = timezone.now() + datetime.timedelta(days=days_ahead)
+        return ProductionOrder.objects.create(
+            order_number=number,
+            product=product,
+            quantity=Decimal(quantity),
+            production_line=self.line,
+            start_date=start,
+            end_date=start + datetime.timedelta(hours=8),
+            status=status
+        )
+
+
+class MaterialRequirementsPlanningTests(ProductionTestMixin, TestCase):
+    def setUp(self):
+        self.create_plant()
+        self.create_order('PO-1', self.cabro, 100, days_ahead=10)
+        self.create_order('PO-2', self.pack, 20, days_ahead=10)
+        customer_order = Order.objects.create(
+            order_number='SO-1',
+            customer_name='Acme Builders',
+            customer_email='buyer@example.com',
+            customer_phone='0700000000',
+            customer_address='Industrial Area',
+            required_date=timezone.now() + datetime.timedelta(days=20)
+        )
+        item = OrderItem.objects.create(
+            order=customer_order, product=self.cabro, quantity=10, unit_price=Decimal('60.00')
+        )
+        reserve({self.cement.pk: 10}, order_item=item)
+
+    def plan(self):
+        frame = compute_material_requirements(today=self.today)
+        return {
+            (row.material_id, (row.need_date - self.today).days): row
+            for row in frame.itertuples(index=False)
+        }
+
+    def test_explodes_nets_and_time_phases(self):
+        plan = self.plan()
+        self.assertEqual(sorted(plan), sorted([
+            (self.cement.pk, 8), (self.cement.pk, 10), (self.sand.pk, 10)
+        ]))
+
+        # 200 blocks for the packs, less 50 in stock, made 2 days ahead
+        blocks = plan[(self.cement.pk, 8)]
+        self.assertAlmostEqual(blocks.gross_requirement, 37.5)
+        self.assertEqual(blocks.net_requirement, 0)
+        self.assertEqual(blocks.release_date, self.today + datetime.timedelta(days=1))
+
+        # 60 on hand less 10 reserved for the customer order
+        cabros = plan[(self.cement.pk, 10)]
+        self.assertAlmostEqual(cabros.gross_requirement, 50)
+        self.assertAlmostEqual(cabros.projected_available, 12.5)
+        self.assertEqual(cabros.net_requirement, 38)
+
+        sand = plan[(self.sand.pk, 10)]
+        self.assertEqual((sand.net_requirement, sand.release_date), (200, self.today + datetime.timedelta(days=7)))
+
+    def test_plans_only_what_open_orders_still_need(self):
+        order = self.create_order('PO-3', self.cabro, 100, days_ahead=-2, status='on_hold')
+        ProductionBatch.objects.create(
+            batch_number='B-PO-3-1', production_order=order,
+            start_time=order.start_date, quantity_produced=Decimal('60')
+        )
+        self.create_order('PO-4', self.cabro, 500, days_ahead=5, status='cancelled')
+        plan = self.plan()
+        # The late order's remaining 40 are needed today
+        self.assertEqual(plan[(self.sand.pk, 0)].net_requirement, 80)
+        self.assertNotIn((self.sand.pk, 5), plan)
+
+    def test_detects_cyclic_product_structure(self):
+        ProductComponent.objects.create(product=self.block, component=self.pack, quantity=1)
+        products = list(Product.objects.values_list('pk', flat=True))
+        components = component_matrix(products)
+        with self.assertRaises(ValidationError):
+            low_level_codes(components)
+
+    def test_low_level_codes(self):
+        mortar = self.create_product('Mortar', 'MOR-1')
+        ProductComponent.objects.create(product=self.block, component=mortar, quantity=1)
+        ProductComponent.objects.create(product=self.cabro, component=mortar, quantity=1)
+        products = [self.cabro.pk, self.block.pk, self.pack.pk, mortar.pk]
+        components = component_matrix(products)
+        # Mortar is a level 1 component of cabros but level 2 under packs
+        self.assertEqual(list(low_level_codes(components)), [0, 1, 0, 2])
+
+    def test_uses_formulation_version_in_effect_each_day(self):
+        self.formulate(
+            self.cabro, {self.cement: '0.6', self.sand: '2'},
+            effective_from=self.today + datetime.timedelta(days=9)
+        )
+        self.assertAlmostEqual(self.plan()[(self.cement.pk, 10)].gross_requirement, 60)
+
+        self.create_order('PO-3', self.cabro, 10, days_ahead=4)
+        self.assertAlmostEqual(self.plan()[(self.cement.pk, 4)].gross_requirement, 5)
+
+    def test_run_stores_plan_and_api_lists_shortages(self):
+        user = User.objects.create_user(username='planner', password='testpass')
+        self.client.force_login(user)
+        response = self.client.post('/api/production/mrp/run/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'planned': 3, 'shortages': 2})
+        self.assertEqual(PlannedMaterialRequirement.objects.count(), 3)
+
+        response = self.client.get('/api/production/mrp/', {'shortages': 'true', 'material': self.sand.pk})
+        results = response.data['results'] if isinstance(response.data, dict) else response.data
+        self.assertEqual([row['net_requirement'] for row in results], [200])
+        self.assertFalse(results[0]['past_due'])
+
+
+class FormulationTests(ProductionTestMixin, APITestCase):
+    def setUp(self):
+        self.create_plant()
+        self.original = self.cabro.formulations.get()
+
+    def test_compiles_vector_as_items_change(self):
+        self.assertEqual(self.original.version, 1)
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.requirements, {str(self.cement.pk): '0.5000', str(self.sand.pk): '2.0000'})
+
+        self.original.items.filter(material=self.sand).delete()
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.requirements, {str(self.cement.pk): '0.5000'})
+
+    def test_version_in_effect(self):
+        later = self.today + datetime.timedelta(days=30)
+        revised = self.formulate(self.cabro, {self.cement: '0.45'}, effective_from=later)
+        self.assertEqual(revised.version, 2)
+        self.assertEqual(requirement_vector(self.cabro.pk), {self.cement.pk: Decimal('0.5'), self.sand.pk: Decimal('2')})
+        self.assertEqual(requirement_vector(self.cabro.pk, later), {self.cement.pk: Decimal('0.45')})
+
+        # A withdrawn version leaves the product without a formulation
+        revised.effective_to = later + datetime.timedelta(days=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            revised.save()
+        self.assertEqual(requirement_vector(self.cabro.pk, later + datetime.timedelta(days=10)), {})
+
+    def test_vectors_cost_one_query_then_none(self):
+        products = [self.cabro.pk, self.block.pk, self.pack.pk]
+        with self.assertNumQueries(1):
+            vectors = requirement_vectors(products)
+        with self.assertNumQueries(0):
+            self.assertEqual(requirement_vectors(products), vectors)
+        self.assertEqual(vectors[self.pack.pk], {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.original.items.filter(material=self.cement).update(quantity=Decimal('0.55'))
+            self.original.items.get(material=self.cement).save()
+        self.assertEqual(requirement_vector(self.cabro.pk)[self.cement.pk], Decimal('0.55'))
+
+    def test_order_requirements_scale_the_vector(self):
+        order = self.create_order('PO-1', self.cabro, 40, days_ahead=1)
+        with self.assertNumQueries(2):
+            requirements = order.calculate_material_requirements()
+        self.assertEqual(
+            {req['material'].code: req['required_quantity'] for req in requirements},
+            {'CEM-50': Decimal('20'), 'SND-T': Decimal('80')}
+        )
+
+    def test_material_cost(self):
+        self.assertEqual(
+            material_costs([self.cabro.pk, self.block.pk]),
+            {self.cabro.pk: Decimal('250'), self.block.pk: Decimal('25')}
+        )
+
+    def test_api_creates_next_version(self):
+        user = User.objects.create_user(username='engineer', password='testpass')
+        self.client.force_login(user)
+        response = self.client.post('/api/production/formulations/', {
+            'product': self.cabro.pk,
+            'effective_from': self.today.isoformat(),
+            'items': [
+                {'material': self.cement.pk, 'quantity': '0.48'},
+                {'material': self.sand.pk, 'quantity': '2.1'},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(response.data['requirements'], {str(self.cement.pk): '0.4800', str(self.sand.pk): '2.1000'})
+
+        response = self.client.get('/api/production/formulations/active/', {'products': f'{self.cabro.pk}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['version'], row['material_cost_per_unit']) for row in response.data],
+            [(2, Decimal('258'))]
+        )
+
+        response = self.client.post('/api/production/formulations/', {
+            'product': self.cabro.pk,
+            'items': [{'material': self.cement.pk, 'quantity': '1'}, {'material': self.cement.pk, 'quantity': '2'}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MaterialAvailabilityTests(ProductionTestMixin, APITestCase):
+    def setUp(self):
+        self.create_plant()
+        RawMaterial.objects.filter(pk=self.sand.pk).update(on_hand=400)
+        self.user = User.objects.create_user(username='supervisor', password='testpass')
+        self.client.force_login(self.user)
+
+    def test_reports_shortages_net_of_reservations(self):
+        order = self.create_order('PO-1', self.cabro, 100, days_ahead=1)
+        self.assertTrue(check_availability(order)['ready'])
+
+        customer_order = Order.objects.create(
+            order_number='SO-1', customer_name='Acme Builders', customer_email='buyer@example.com',
+            customer_phone='0700000000', customer_address='Industrial Area', required_date=timezone.now()
+        )
+        item = OrderItem.objects.create(order=customer_order, product=self.cabro, quantity=10, unit_price=Decimal('60'))
+        reserve({self.cement.pk: 15}, order_item=item)
+        report = check_availability(order)
+        self.assertFalse(report['ready'])
+        self.assertEqual(report['shortages'], [{
+            'material': self.cement.pk, 'code': 'CEM-50', 'name': 'Cement', 'unit': 'pcs',
+            'required': Decimal('50'), 'available': Decimal('45'), 'shortfall': Decimal('5'),
+        }])
+
+    def test_bulk_check_costs_three_queries(self):
+        orders = [
+            self.create_order(f'PO-{n}', self.cabro if n % 2 else self.block, 10 + n, days_ahead=n % 5)
+            for n in range(60)
+        ]
+        with self.assertNumQueries(3):
+            reports = check_orders(orders)
+        self.assertEqual(len(reports), 60)
+        # Cabro orders need 0.5 cement each; 60 on hand covers up to 120 units
+        self.assertEqual(
+            [report['order_number'] for report in reports if not report['ready']],
+            [order.order_number for order in orders if order.product_id == self.cabro.pk and order.quantity > 120]
+        )
+
+    def test_cumulative_check_hands_stock_to_earlier_orders(self):
+        later = self.create_order('PO-2', self.cabro, 80, days_ahead=3)
+        first = self.create_order('PO-1', self.cabro, 80, days_ahead=1)
+        self.assertEqual([report['ready'] for report in check_orders([later, first])], [True, True])
+        reports = check_orders([later, first], cumulative=True)
+        self.assertEqual([(report['order'], report['ready']) for report in reports], [(first.pk, True), (later.pk, False)])
+        self.assertEqual(reports[1]['shortages'][0]['available'], Decimal('20'))
+
+    def test_checks_once_when_an_order_starts(self):
+        order = self.create_order('PO-1', self.cabro, 200, days_ahead=0)
+        order.status = 'in_progress'
+        with self.assertRaises(InsufficientMaterials):
+            order.save()
+
+        order = ProductionOrder.objects.get(pk=order.pk)
+        order.quantity = Decimal('100')
+        order.status = 'in_progress'
+        order.save()
+        # Later saves of a running order do not check again
+        RawMaterial.objects.filter(pk=self.cement.pk).update(on_hand=0)
+        order = ProductionOrder.objects.get(pk=order.pk)
+        order.notes = 'Shift 2'
+        order.save()
+
+    def test_start_production_endpoint(self):
+        short = self.create_order('PO-1', self.cabro, 200, days_ahead=0)
+        response = self.client.post(f'/api/production/orders/{short.pk}/start_production/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([row['code'] for row in response.data['details']], ['CEM-50'])
+        short.refresh_from_db()
+        self.assertEqual(short.status, 'scheduled')
+
+        order = self.create_order('PO-2', self.cabro, 100, days_ahead=0)
+        response = self.client.post(f'/api/production/orders/{order.pk}/start_production/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'in_progress')
+        self.assertTrue(order.batches.filter(batch_number='B-PO-2-1').exists())
+        self.cement.refresh_from_db()
+        self.assertEqual((self.cement.reserved, self.cement.available), (Decimal('50'), Decimal('10')))
+
+        response = self.client.post(f'/api/production/orders/{order.pk}/start_production/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(order.batches.count(), 1)
+
+    def test_planning_board_endpoint(self):
+        for n in range(3):
+            self.create_order(f'PO-{n}', self.cabro, 100, days_ahead=n + 1, status='draft')
+        self.create_order('PO-9', self.cabro, 100, days_ahead=1)
+        response = self.client.get('/api/production/orders/availability/', {'cumulative': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['orders'], response.data['ready']), (3, 1))
+
+
+class MaterialReservationTests(ProductionTestMixin, APITestCase):
+    def setUp(self):
+        self.create_plant()
+        RawMaterial.objects.filter(pk=self.sand.pk).update(on_hand=400)
+        self.user = User.objects.create_user(username='supervisor', password='testpass')
+        self.client.force_login(self.user)
+
+    def material(self, material):
+        return RawMaterial.objects.get(pk=material.pk)
+
+    def customer_item(self):
+        customer_order = Order.objects.create(
+            order_number='SO-1', customer_name='Acme Builders', customer_email='buyer@example.com',
+            customer_phone='0700000000', customer_address='Industrial Area', required_date=timezone.now()
+        )
+        return OrderItem.objects.create(order=customer_order, product=self.cabro, quantity=10, unit_price=Decimal('60'))
+
+    def test_reserve_release_and_shortage(self):
+        order = self.create_order('PO-1', self.cabro, 10, days_ahead=1)
+        first = reserve({self.cement.pk: 20}, production_order=order)[0]
+        reserve({self.cement.pk: 10, self.sand.pk: 5}, production_order=order)
+        topped_up = order.reservations.filter(material=self.cement).get()
+        self.assertEqual(topped_up.quantity, Decimal('30'))
+        self.assertGreater(topped_up.updated_at, first.updated_at)
+        self.assertEqual(self.material(self.cement).available, Decimal('30'))
+
+        with self.assertRaises(ReservationShortage) as caught:
+            reserve({self.cement.pk: 31, self.sand.pk: 1}, order_item=self.customer_item())
+        self.assertEqual([shortage['material'] for shortage in caught.exception.shortages], [self.cement.pk])
+        self.assertEqual(self.material(self.sand).reserved, Decimal('5'))
+
+        self.assertEqual(release({self.cement.pk: 12}, production_order=order), {self.cement.pk: Decimal('12')})
+        self.assertGreater(order.reservations.get(material=self.cement).updated_at, topped_up.updated_at)
+        self.assertEqual(self.material(self.cement).reserved, Decimal('18'))
+        reserve_to({self.cement.pk: 25}, production_order=order)
+        self.assertEqual(self.material(self.cement).reserved, Decimal('25'))
+        release(production_order=order)
+        self.assertEqual((self.material(self.cement).reserved, self.material(self.sand).reserved), (0, 0))
+        self.assertFalse(order.reservations.filter(status='active').exists())
+
+    def test_batch_reservations_are_limited_by_the_batch(self):
+        warehouse = Warehouse.objects.create(name='Main', code='WH-1', location='Yard', capacity=Decimal('1000'))
+        location = StorageLocation.objects.create(
+            warehouse=warehouse, name='A1', location_type='shelf', capacity=Decimal('100')
+        )
+        stock = Stock.objects.create(material=self.sand, location=location, quantity=30, batch_number='SND-B1')
+        order = self.create_order('PO-1', self.cabro, 10, days_ahead=1)
+        reserve(batches={stock.pk: 20}, production_order=order)
+        with self.assertRaises(ReservationShortage):
+            reserve(batches={stock.pk: 11}, order_item=self.customer_item())
+        reservation = order.reservations.get()
+        self.assertEqual((reservation.stock_id, reservation.material_id), (stock.pk, self.sand.pk))
+
+    def test_order_lifecycle_reserves_consumes_and_releases(self):
+        warehouse = Warehouse.objects.create(name='Main', code='WH-1', location='Yard', capacity=Decimal('1000'))
+        location = StorageLocation.objects.create(
+            warehouse=warehouse, name='A1', location_type='floor', capacity=Decimal('100')
+        )
+        post_movement(
+            material=self.cement, destination_location=location, movement_type='receipt',
+            quantity=40, batch_number='CEM-B1', reference_number='GRN-1', unit_cost=Decimal('100')
+        )
+        order = self.create_order('PO-1', self.cabro, 100, days_ahead=0)
+        order.status = 'in_progress'
+        order.save()
+        self.assertEqual(self.material(self.cement).reserved, Decimal('50'))
+        self.assertEqual(self.material(self.sand).reserved, Decimal('200'))
+
+        batch = ProductionBatch.objects.create(
+            production_order=order, batch_number='B-1', start_time=timezone.now(), quantity_produced=0
+        )
+        consumption = MaterialConsumption.objects.create(
+            batch=batch, material=self.cement, quantity_used=Decimal('30'), wastage=Decimal('2')
+        )
+        reservation = order.reservations.get(material=self.cement)
+        self.assertEqual((reservation.quantity, reservation.consumed_quantity), (Decimal('18'), Decimal('32')))
+        # Consumption leaves stock as it leaves the reservation; what is free stays the same
+        cement = self.material(self.cement)
+        self.assertEqual((cement.on_hand, cement.reserved, cement.available), (68, Decimal('18'), Decimal('50')))
+        self.assertEqual(Stock.objects.get(batch_number='CEM-B1').quantity, 8)
+        self.assertTrue(StockMovement.objects.filter(
+            reference_number=f'PO-1-MC{consumption.pk}-1', movement_type='issue', quantity=32
+        ).exists())
+
+        # Consumption the stock cannot cover is refused whole
+        with self.assertRaises(ValidationError):
+            MaterialConsumption.objects.create(batch=batch, material=self.cement, quantity_used=Decimal('10'))
+        self.assertEqual(MaterialConsumption.objects.count(), 1)
+        self.assertEqual(self.material(self.cement).reserved, Decimal('18'))
+
+        order.status = 'completed'
+        order.save()
+        self.assertEqual((self.material(self.cement).reserved, self.material(self.sand).reserved), (0, 0))
+
+    def test_failed_start_keeps_no_reservations(self):
+        self.create_order('PO-1', self.cabro, 10, days_ahead=1)
+        order = self.create_order('PO-2', self.cabro, 100, days_ahead=0)
+        order.status = 'in_progress'
+        order.order_number = 'PO-1'
+        with self.assertRaises(IntegrityError):
+            order.save()
+        self.assertEqual((self.material(self.cement).reserved, self.material(self.sand).reserved), (0, 0))
+        self.assertFalse(MaterialReservation.objects.exists())
+
+    def test_competing_starts_cannot_both_take_the_stock(self):
+        first = self.create_order('PO-1', self.cabro, 80, days_ahead=0)
+        second = self.create_order('PO-2', self.cabro, 80, days_ahead=0)
+        response = self.client.post(f'/api/production/orders/{first.pk}/start_production/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(f'/api/production/orders/{second.pk}/start_production/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['details'][0]['available'], Decimal('20'))
+
+        first.refresh_from_db()
+        first.status = 'cancelled'
+        first.save()
+        self.assertEqual(self.material(self.cement).reserved, 0)
+
+    def test_starting_through_update_reports_shortages(self):
+        order = self.create_order('PO-1', self.cabro, 200, days_ahead=0)
+        response = self.client.patch(f'/api/production/orders/{order.pk}/', {'status': 'in_progress'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Insufficient materials')
+        self.assertEqual(
+            [(shortage['material'], shortage['required']) for shortage in response.data['details']],
+            [(self.cement.pk, Decimal('100'))]
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'scheduled')
+        self.assertEqual(self.material(self.cement).reserved, 0)
+
+    def test_reserve_and_release_endpoints(self):
+        order = self.create_order('PO-1', self.cabro, 100, days_ahead=3)
+        response = self.client.post(f'/api/production/orders/{order.pk}/reserve/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(len(response.data), 2)
+        # Reserving again tops up to the requirements rather than doubling them
+        self.client.post(f'/api/production/orders/{order.pk}/reserve/')
+        self.assertEqual(self.material(self.cement).reserved, Decimal('50'))
+        # An order's own reservations count as available to it
+        self.assertTrue(check_availability(order)['ready'])
+
+        response = self.client.post(f'/api/production/orders/{order.pk}/release/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.material(self.cement).reserved, 0)
+
+        # Deleting an order gives back what it held
+        reserve_to({self.cement.pk: 40}, production_order=order)
+        order.delete()
+        self.assertEqual(self.material(self.cement).reserved, 0)
+
+    def test_customer_allocation_holds_material(self):
+        item = self.customer_item()
+        requirement = MaterialRequirement.objects.create(
+            order_item=item, material=self.cement, required_quantity=Decimal('15')
+        )
+        response = self.client.post(
+            f'/api/orders/material-requirements/{requirement.pk}/allocate/', {'quantity': '15'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(self.material(self.cement).reserved, Decimal('15'))
+        response = self.client.post(
+            f'/api/orders/material-requirements/{requirement.pk}/allocate/', {'quantity': '100'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.material(self.cement).reserved, Decimal('15'))
+
+        response = self.client.post(f'/api/orders/orders/{item.order_id}/update_status/', {'status': 'cancelled'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.material(self.cement).reserved, 0)
+
+
+class IntervalTreeTests(TestCase):
+    def test_earliest_fit_matches_a_linear_scan(self):
+        generator = random.Random(7)
+        tree, booked = IntervalTree(), {}
+        for key in range(400):
+            if booked and generator.random() < 0.3:
+                removed = generator.choice(sorted(booked))
+                tree.remove(removed)
+                del booked[removed]
+            length, not_before = generator.randint(1, 30), generator.randint(0, 3000)
+            start = not_before
+            for begin, end in sorted(booked.values()):
+                if begin >= start + length:
+                    break
+                start = max(start, end)
+            self.assertEqual(tree.earliest_fit(length, not_before), start)
+            tree.add(start, start + length, key)
+            booked[key] = (start, start + length)
+        self.assertEqual([(start, end) for start, end, _ in tree], sorted(booked.values()))
+
+    def test_rejects_overlapping_bookings(self):
+        tree = IntervalTree()
+        tree.add(0, 10, 'a')
+        tree.add(10, 20, 'b')
+        with self.assertRaises(ValueError):
+            tree.add(5, 12, 'c')
+        self.assertEqual(tree.overlapping(9, 11), [(0, 10, 'a'), (10, 20, 'b')])
+        tree.remove('a')
+        self.assertEqual(tree.earliest_fit(10, 0), 0)
+        self.assertEqual(tree.earliest_fit(11, 0), 20)
+
+
+class ProductionSchedulingTests(ProductionTestMixin, APITestCase):
+    def setUp(self):
+        self.create_plant()
+        self.now = timezone.now().replace(microsecond=0)
+        self.slow_line = ProductionLine.objects.create(name='Press 2', capacity_per_hour=Decimal('250'))
+        self.user = User.objects.create_user(username='planner', password='testpass')
+        self.client.force_login(self.user)
+
+    def order(self, number, quantity, priority=3, due_in=None, line=None):
+        order = self.create_order(number, self.block, quantity, days_ahead=1)
+        ProductionOrder.objects.filter(pk=order.pk).update(
+            priority=priority,
+            production_line=line or self.line,
+            due_date=self.now + due_in if due_in else None
+        )
+        return ProductionOrder.objects.get(pk=order.pk)
+
+    def test_places_orders_where_they_finish_first(self):
+        scheduler = ProductionScheduler.load(self.now)
+        hours = datetime.timedelta(hours=1)
+        first = scheduler.place(self.order('PO-1', 1000))
+        self.assertEqual((first['production_line'], first['start_date'], first['end_date']), (self.line.pk, self.now, self.now + 2 * hours))
+        # The fast line is busy for 2 hours; 4 hours on the slow line finishes later
+        second = scheduler.place(self.order('PO-2', 1000))
+        self.assertEqual((second['production_line'], second['start_date']), (self.line.pk, self.now + 2 * hours))
+        third = scheduler.place(self.order('PO-3', 500))
+        self.assertEqual((third['production_line'], third['end_date']), (self.slow_line.pk, self.now + 2 * hours))
+
+        # Moving an order frees its slot
+        scheduler.place(ProductionOrder.objects.get(order_number='PO-1'), line_id=self.slow_line.pk)
+        fourth = scheduler.place(self.order('PO-4', 1000))
+        self.assertEqual((fourth['production_line'], fourth['start_date']), (self.line.pk, self.now))
+
+    def test_avoids_downtime_and_inactive_lines(self):
+        hours = datetime.timedelta(hours=1)
+        MaintenanceLog.objects.create(
+            production_line=self.line, maintenance_type='breakdown', description='Hydraulics',
+            start_time=self.now - hours, end_time=self.now + hours
+        )
+        ProductionLine.objects.filter(pk=self.line.pk).update(
+            status='active', maintenance_schedule=self.now + 3 * hours
+        )
+        ProductionLine.objects.filter(pk=self.slow_line.pk).update(status='inactive')
+        scheduler = ProductionScheduler.load(self.now)
+        self.assertEqual(scheduler.downtime[self.line.pk], [
+            (self.now - hours, self.now + hours), (self.now + 3 * hours, self.now + 11 * hours)
+        ])
+        short = scheduler.place(self.order('PO-1', 1000))
+        self.assertEqual((short['start_date'], short['end_date']), (self.now + hours, self.now + 3 * hours))
+        longer = scheduler.place(self.order('PO-2', 1500))
+        self.assertEqual(longer['start_date'], self.now + 11 * hours)
+        with self.assertRaises(ValidationError):
+            scheduler.place(self.order('PO-3', 100), line_id=self.slow_line.pk)
+
+    def test_keeps_running_orders_and_reports_double_bookings(self):
+        running = self.order('PO-1', 1000)
+        ProductionOrder.objects.filter(pk=running.pk).update(
+            status='in_progress', start_date=self.now - datetime.timedelta(hours=1),
+            end_date=self.now + datetime.timedelta(hours=1)
+        )
+        clash = self.order('PO-2', 1000)
+        ProductionOrder.objects.filter(pk=clash.pk).update(
+            start_date=self.now, end_date=self.now + datetime.timedelta(hours=2)
+        )
+        scheduler = ProductionScheduler.load(self.now)
+        self.assertEqual(scheduler.conflicts, [clash.pk])
+        placement = scheduler.place(ProductionOrder.objects.get(pk=clash.pk), line_id=self.line.pk)
+        self.assertEqual(placement['start_date'], self.now + datetime.timedelta(hours=1))
+        self.assertEqual(scheduler.conflicts, [])
+
+    def test_replan_orders_by_priority_then_due_date(self):
+        relaxed = self.order('PO-1', 1000, due_in=datetime.timedelta(days=3))
+        urgent = self.order('PO-2', 1000, due_in=datetime.timedelta(hours=3))
+        important = self.order('PO-3', 1000, priority=5, due_in=datetime.timedelta(days=5))
+        ProductionLine.objects.filter(pk=self.slow_line.pk).update(status='inactive')
+        placements, conflicts = replan(now=self.now)
+        self.assertEqual(
+            [placement['order'] for placement in placements], [important.pk, urgent.pk, relaxed.pk]
+        )
+        self.assertEqual([placement['late'] for placement in placements], [False, True, False])
+        relaxed.refresh_from_db()
+        self.assertEqual((relaxed.start_date, relaxed.end_date), (self.now + datetime.timedelta(hours=4), self.now + datetime.timedelta(hours=6)))
+
+    def test_replan_a_week_across_lines(self):
+        for line in range(3):
+            ProductionLine.objects.create(name=f'Press {line + 3}', capacity_per_hour=Decimal('400'))
+        ProductionOrder.objects.bulk_create([
+            ProductionOrder(
+                order_number=f'PO-{n}', product=self.block, quantity=Decimal(200 + n % 7 * 100),
+                production_line=self.line, start_date=self.now, end_date=self.now,
+                due_date=self.now + datetime.timedelta(hours=n % 150), priority=n % 5 + 1, status='scheduled'
+            )
+            for n in range(600)
+        ])
+        placements, _ = replan(days=7)
+        self.assertEqual(len(placements), 600)
+        booked = {}
+        for placement in placements:
+            booked.setdefault(placement['production_line'], []).append((placement['start_date'], placement['end_date']))
+        for intervals in booked.values():
+            intervals.sort()
+            self.assertTrue(all(end <= start for (_, end), (start, _) in zip(intervals, intervals[1:])))
+        self.assertEqual(len(booked), 5)
+
+    def test_scheduling_one_order_reads_only_its_window(self):
+        hours = datetime.timedelta(hours=1)
+        busy = self.order('PO-1', 1000)
+        ProductionOrder.objects.filter(pk=busy.pk).update(start_date=self.now, end_date=self.now + 20 * hours)
+        later = self.order('PO-2', 1000)
+        ProductionOrder.objects.filter(pk=later.pk).update(
+            start_date=self.now + 28 * hours, end_date=self.now + 32 * hours
+        )
+        elsewhere = self.order('PO-3', 1000, line=self.slow_line)
+        ProductionOrder.objects.filter(pk=elsewhere.pk).update(
+            start_date=self.now + hours, end_date=self.now + 5 * hours
+        )
+        scheduler = ProductionScheduler.load(self.now, line_id=self.line.pk, until=self.now + 24 * hours)
+        self.assertEqual(set(scheduler.orders), {busy.pk})
+        self.assertEqual(list(scheduler.timelines), [self.line.pk])
+
+        # 10 hours do not fit between PO-1 and PO-2, which only a widened window reads
+        order = self.order('PO-4', 5000, line=self.slow_line)
+        placement = schedule_order(order, line_id=self.line.pk, now=self.now)
+        self.assertEqual(
+            (placement['start_date'], placement['end_date']), (self.now + 32 * hours, self.now + 42 * hours)
+        )
+        short = self.order('PO-5', 2000, line=self.slow_line)
+        placement = schedule_order(short, line_id=self.line.pk, now=self.now)
+        self.assertEqual(placement['start_date'], self.now + 20 * hours)
+
+    def test_schedule_endpoints(self):
+        order = self.order('PO-1', 1000)
+        ProductionOrder.objects.filter(pk=order.pk).update(status='draft')
+        response = self.client.post(
+            f'/api/production/orders/{order.pk}/schedule/', {'production_line': self.slow_line.pk}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.production_line_id), ('scheduled', self.slow_line.pk))
+        self.assertEqual(order.end_date - order.start_date, datetime.timedelta(hours=4))
+
+        response = self.client.get(f'/api/production/lines/{self.slow_line.pk}/schedule/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([slot['order'] for slot in response.data['booked']], [order.pk])
+
+        response = self.client.post('/api/production/orders/replan/', {'dry_run': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['saved'], response.data['orders']), (False, 1))
+        self.assertEqual(response.data['placements'][0]['production_line'], self.line.pk)
+        order.refresh_from_db()
+        self.assertEqual(order.production_line_id, self.slow_line.pk)
@@ -9,6 +9,8 @@ router.register(r'batches', views.ProductionBatchViewSet)
 router.register(r'consumptions', views.MaterialConsumptionViewSet)
 router.register(r'quality-checks', views.QualityCheckViewSet)
 router.register(r'maintenance', views.MaintenanceLogViewSet)
+router.register(r'mrp', views.PlannedMaterialRequirementViewSet)
+router.register(r'formulations', views.FormulationViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
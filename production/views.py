@@ -1,19 +1,32 @@
+import datetime
 from django.shortcuts import render
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from django.db.models import Sum, F, Q
 from django.utils import timezone
+from inventory.reservations import release as release_reservations
+from inventory.serializers import MaterialReservationSerializer
 from .models import (
     ProductionLine, ProductionOrder, ProductionBatch,
-    MaterialConsumption, QualityCheck, MaintenanceLog
+    MaterialConsumption, QualityCheck, MaintenanceLog,
+    PlannedMaterialRequirement, Formulation
 )
+from .availability import InsufficientMaterials, check_orders
+from .signals import reserve_order_materials
+from .formulations import active_formulations, material_costs
+from .mrp import run_mrp
+from .scheduling import REPLAN_DAYS, ProductionScheduler, replan, schedule_order
 from .serializers import (
     ProductionLineSerializer, ProductionLineDetailSerializer,
     ProductionOrderSerializer, ProductionOrderDetailSerializer,
     ProductionBatchSerializer, MaterialConsumptionSerializer,
-    QualityCheckSerializer, MaintenanceLogSerializer
+    QualityCheckSerializer, MaintenanceLogSerializer,
+    PlannedMaterialRequirementSerializer, FormulationSerializer
 )
 
 class ProductionLineViewSet(viewsets.ModelViewSet):
@@ -29,11 +42,16 @@ class ProductionLineViewSet(viewsets.ModelViewSet):
     
     @action(detail=True)
     def schedule(self, request, pk=None):
-        """Get production schedule for the line"""
+        """Get production schedule for the line: its orders, downtime and booked time ahead"""
         line = self.get_object()
         scheduled_orders = line.production_orders.filter(
             status__in=['scheduled', 'in_progress']
         ).order_by('start_date')
+        try:
+            days = int(request.query_params.get('days', REPLAN_DAYS))
+        except ValueError:
+            return Response({'error': 'days must be a whole number'}, status=status.HTTP_400_BAD_REQUEST)
+        scheduler = ProductionScheduler.load()
         
         return Response({
             'current_order': ProductionOrderSerializer(
@@ -42,7 +60,13 @@ class ProductionLineViewSet(viewsets.ModelViewSet):
             'upcoming_orders': ProductionOrderSerializer(
                 scheduled_orders.filter(status='scheduled'),
                 many=True
-            ).data
+            ).data,
+            'downtime': [{'start': start, 'end': end} for start, end in scheduler.downtime[line.pk]],
+            'booked': scheduler.timeline(line.pk, scheduler.now + datetime.timedelta(days=days)),
+            'conflicts': [
+                scheduler.orders[order_id].order_number for order_id in scheduler.conflicts
+                if scheduler.orders[order_id].production_line_id == line.pk
+            ]
         })
     
     @action(detail=True)
@@ -83,58 +107,152 @@ class ProductionOrderViewSet(viewsets.ModelViewSet):
         if self.action == 'retrieve':
             return ProductionOrderDetailSerializer
         return ProductionOrderSerializer
+
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except InsufficientMaterials as error:
+            return self.shortage_response(error)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def update(self, request, *args, **kwargs):
+        """Setting an order in progress here runs the same start checks as start_production"""
+        try:
+            return super().update(request, *args, **kwargs)
+        except InsufficientMaterials as error:
+            return self.shortage_response(error)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def shortage_response(self, error):
+        return Response({
+            'error': 'Insufficient materials',
+            'details': error.report['shortages']
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'])
     def start_production(self, request, pk=None):
         """Start production for an order"""
         order = self.get_object()
         
-        if order.status != 'scheduled':
+        with transaction.atomic():
+            # Lock the order so concurrent starts run one after the other
+            order = ProductionOrder.objects.select_for_update().get(pk=order.pk)
+            if order.status != 'scheduled':
+                return Response(
+                    {'error': 'Order must be scheduled to start production'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Check if production line is available
+            if order.production_line.status != 'active':
+                return Response(
+                    {'error': 'Production line is not active'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Start production; saving reserves the materials or reports shortages
+            order.status = 'in_progress'
+            try:
+                order.save()
+            except InsufficientMaterials as error:
+                return self.shortage_response(error)
+            
+            # Create initial batch
+            batch = ProductionBatch.objects.create(
+                production_order=order,
+                batch_number=f"B-{order.order_number}-1",
+                start_time=timezone.now(),
+                quantity_produced=0
+            )
+        
+        return Response({
+            'message': 'Production started',
+            'order': ProductionOrderSerializer(order).data,
+            'batch': ProductionBatchSerializer(batch).data
+        })
+    
+    @action(detail=True, methods=['post'])
+    def schedule(self, request, pk=None):
+        """Place the order in the earliest slot that finishes first, on a given line or any line"""
+        order = self.get_object()
+        if order.status not in ('draft', 'scheduled'):
             return Response(
-                {'error': 'Order must be scheduled to start production'},
+                {'error': 'Only draft or scheduled orders can be scheduled'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Check if production line is available
-        if order.production_line.status != 'active':
+        line_id = request.data.get('production_line')
+        try:
+            placement = schedule_order(order, line_id=int(line_id) if line_id else None)
+        except (TypeError, ValueError):
+            return Response({'error': 'production_line must be a line id'}, status=status.HTTP_400_BAD_REQUEST)
+        except DjangoValidationError as error:
+            return Response({'error': error.messages}, status=status.HTTP_400_BAD_REQUEST)
+        if order.status == 'draft':
+            ProductionOrder.objects.filter(pk=order.pk).update(status='scheduled', updated_at=timezone.now())
+        return Response(placement)
+    
+    @action(detail=False, methods=['post'])
+    def replan(self, request):
+        """Re-plan all scheduled orders starting or due within the next days across every line"""
+        try:
+            days = int(request.data.get('days', REPLAN_DAYS))
+        except (TypeError, ValueError):
+            return Response({'error': 'days must be a whole number'}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true')
+        try:
+            placements, conflicts = replan(days=days, dry_run=dry_run)
+        except DjangoValidationError as error:
+            return Response({'error': error.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'saved': not dry_run,
+            'orders': len(placements),
+            'late': sum(placement['late'] for placement in placements),
+            'placements': placements,
+            'conflicts': conflicts,
+        })
+    
+    @action(detail=True, methods=['post'])
+    def reserve(self, request, pk=None):
+        """Reserve the order's materials ahead of its start"""
+        order = self.get_object()
+        if order.status in ('completed', 'cancelled'):
             return Response(
-                {'error': 'Production line is not active'},
+                {'error': 'Closed orders cannot hold reservations'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Check material availability
-        requirements = order.calculate_material_requirements()
-        insufficient_materials = []
-        
-        for req in requirements:
-            if req['material'].quantity_available < req['required_quantity']:
-                insufficient_materials.append({
-                    'material': req['material'].name,
-                    'required': req['required_quantity'],
-                    'available': req['material'].quantity_available
-                })
-        
-        if insufficient_materials:
+        try:
+            with transaction.atomic():
+                reserve_order_materials(order)
+        except InsufficientMaterials as error:
             return Response({
                 'error': 'Insufficient materials',
-                'details': insufficient_materials
+                'details': error.report['shortages']
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Start production
-        order.status = 'in_progress'
-        order.save()
-        
-        # Create initial batch
-        batch = ProductionBatch.objects.create(
-            production_order=order,
-            batch_number=f"B-{order.order_number}-1",
-            start_time=timezone.now()
-        )
-        
+        return Response(MaterialReservationSerializer(
+            order.reservations.filter(status='active').select_related('material', 'stock'), many=True
+        ).data)
+    
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        """Release everything the order holds reserved"""
+        order = self.get_object()
+        released = release_reservations(production_order=order)
+        return Response({'released': {str(material_id): quantity for material_id, quantity in released.items()}})
+    
+    @action(detail=False)
+    def availability(self, request):
+        """Material shortage report of many orders at once, drafts by default, for the planning board"""
+        orders = self.filter_queryset(self.get_queryset())
+        if 'status' not in request.query_params:
+            orders = orders.filter(status='draft')
+        cumulative = request.query_params.get('cumulative') == 'true'
+        reports = check_orders(orders.order_by('start_date', 'pk'), cumulative=cumulative)
         return Response({
-            'message': 'Production started',
-            'order': ProductionOrderSerializer(order).data,
-            'batch': ProductionBatchSerializer(batch).data
+            'orders': len(reports),
+            'ready': sum(report['ready'] for report in reports),
+            'reports': reports,
         })
     
     @action(detail=True, methods=['post'])
@@ -214,6 +332,12 @@ class MaterialConsumptionViewSet(viewsets.ModelViewSet):
     serializer_class = MaterialConsumptionSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['material', 'batch']
+
+    def perform_create(self, serializer):
+        try:
+            serializer.save()
+        except DjangoValidationError as e:
+            raise ValidationError({'detail': e.messages})
     
     @action(detail=False)
     def consumption_report(self, request):
@@ -322,3 +446,59 @@ class MaintenanceLogViewSet(viewsets.ModelViewSet):
                 many=True
             ).data
         })
+
+class PlannedMaterialRequirementViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = PlannedMaterialRequirement.objects.select_related('material')
+    serializer_class = PlannedMaterialRequirementSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['material', 'need_date', 'release_date']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.query_params.get('past_due') == 'true':
+            queryset = queryset.filter(release_date__lt=timezone.localdate())
+        if self.request.query_params.get('shortages') == 'true':
+            queryset = queryset.filter(net_requirement__gt=0)
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def run(self, request):
+        """Re-run MRP over all open production orders now"""
+        planned = run_mrp()
+        return Response({
+            'planned': planned,
+            'shortages': PlannedMaterialRequirement.objects.filter(net_requirement__gt=0).count()
+        })
+
+class FormulationViewSet(viewsets.ModelViewSet):
+    queryset = Formulation.objects.select_related('product').prefetch_related('items__material')
+    serializer_class = FormulationSerializer
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    search_fields = ['product__name', 'product__sku']
+    filterset_fields = ['product']
+
+    @action(detail=False)
+    def active(self, request):
+        """Formulation version in effect per product on a day, with its material cost per unit"""
+        try:
+            on = datetime.date.fromisoformat(request.query_params['date']) if 'date' in request.query_params else None
+            product_ids = [int(pk) for pk in request.query_params.get('products', '').split(',') if pk]
+        except ValueError:
+            return Response(
+                {'error': 'products must be comma separated ids and date YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not product_ids:
+            product_ids = list(Formulation.objects.values_list('product_id', flat=True).distinct())
+        active = active_formulations(product_ids, on)
+        costs = material_costs(list(active), on)
+        return Response([
+            {
+                'product': product_id,
+                'formulation': formulation.pk,
+                'version': formulation.version,
+                'requirements': formulation.requirements,
+                'material_cost_per_unit': costs[product_id],
+            }
+            for product_id, formulation in sorted(active.items())
+        ])
@@ -1,7 +1,9 @@
 from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
-from django.db.models import Sum
+from decimal import Decimal
+from django.db import models
+from django.db.models import F, Sum
 from .models import Product, ProductComponent
 
 @receiver(post_save, sender=Product)
@@ -27,13 +29,13 @@ def update_product_cost(sender, instance, **kwargs):
     # Calculate total component cost
     total_component_cost = product.components.aggregate(
         total=Sum(
-            'quantity' * F('component__cost_price'),
+            F('quantity') * F('component__cost_price'),
             output_field=models.DecimalField()
         )
     )['total'] or 0
     
     # Add manufacturing cost (assumed 20% of component cost)
-    manufacturing_cost = total_component_cost * 0.2
+    manufacturing_cost = total_component_cost * Decimal('0.2')
     
     # Update product cost
     product.cost_price = total_component_cost + manufacturing_cost